@@ -5,30 +5,44 @@
 
 import time
 import math
-import smbus
-from gpiozero import LED
 
 FORWARD = 'forward'
 BACKWARD = 'backward'
 
 class PCA9685:
     __MODE1 = 0x00
+    __MODE1_AI = 0x20          # 暫存器自動遞增 (Auto-Increment)
     __PRESCALE = 0xFE
     __LED0_ON_L = 0x06
     __ALLLED_ON_L = 0xFA
     __ALLLED_OFF_L = 0xFC
-
-    def __init__(self, address, debug=False):
-        self.bus = smbus.SMBus(1)
+    BLOCK_BYTES = 32           # SMBus 區塊寫入上限 32 bytes = 8 個通道
+    LED_REGS = 64              # 16 通道 x (ON_L, ON_H, OFF_L, OFF_H)
+    GAP_BRIDGE = 4             # 兩段變動之間只隔 <= 4 個已同步的 byte 就併成同一次寫入
+
+    def __init__(self, address, debug=False, bus=None, auto_increment=True):
+        if bus is None:
+            import smbus
+            bus = smbus.SMBus(1)
+        self.bus = bus
         self.address = address
         self.debug = debug
-        self.write(self.__MODE1, 0x00)
+        self.auto_increment = auto_increment
+        # 影子暫存器：shadow 為最後要求的值 (None=從未設定)，synced 表示晶片上確定是這個值
+        self.shadow = [None] * self.LED_REGS
+        self.synced = [False] * self.LED_REGS
+        self.write(self.__MODE1, self.__MODE1_AI if auto_increment else 0x00)
 
     def write(self, reg, value):
         self.bus.write_byte_data(self.address, reg, value)
         if self.debug:
             print(f"I2C: Write 0x{value:02X} to register 0x{reg:02X}")
 
+    def write_block(self, reg, values):
+        self.bus.write_i2c_block_data(self.address, reg, values)
+        if self.debug:
+            print(f"I2C: Write {len(values)} bytes from register 0x{reg:02X}")
+
     def read(self, reg):
         result = self.bus.read_byte_data(self.address, reg)
         if self.debug:
@@ -47,10 +61,66 @@ class PCA9685:
         self.write(self.__MODE1, oldmode | 0x80)
 
     def setPWM(self, channel, on, off):
-        self.write(self.__LED0_ON_L + 4 * channel, on & 0xFF)
-        self.write(self.__LED0_ON_L + 4 * channel + 1, on >> 8)
-        self.write(self.__LED0_ON_L + 4 * channel + 2, off & 0xFF)
-        self.write(self.__LED0_ON_L + 4 * channel + 3, off >> 8)
+        self.setPWMMulti({channel: (on, off)})
+
+    def setPWMMulti(self, values):
+        """values: {channel: (on, off)}；只寫出與影子暫存器不同的 byte，相近的變動併成一次區塊寫入"""
+        want = {}
+        for ch, (on, off) in values.items():
+            r = 4 * ch
+            want[r], want[r + 1], want[r + 2], want[r + 3] = on & 0xFF, on >> 8, off & 0xFF, off >> 8
+        dirty = sorted(r for r, v in want.items() if not self.synced[r] or self.shadow[r] != v)
+        if not dirty:
+            return
+        if not self.auto_increment:
+            for r in dirty:
+                self._write_span(r, r, want)
+            return
+
+        start = end = dirty[0]
+        for r in dirty[1:]:
+            gap = range(end + 1, r)
+            if (len(gap) <= self.GAP_BRIDGE and r - start < self.BLOCK_BYTES
+                    and all(k in want or self.synced[k] for k in gap)):
+                end = r
+            else:
+                self._write_span(start, end, want)
+                start = end = r
+        self._write_span(start, end, want)
+
+    def _write_span(self, start, end, want):
+        data = [want[k] if k in want else self.shadow[k] for k in range(start, end + 1)]
+        for k in range(start, end + 1):
+            self.shadow[k] = data[k - start]
+        try:
+            if len(data) == 1:
+                self.write(self.__LED0_ON_L + start, data[0])
+            else:
+                self.write_block(self.__LED0_ON_L + start, data)
+        except OSError:
+            # 匯流排錯誤：晶片狀態不明，下次一定重寫 (或呼叫 flush() 立刻補寫)
+            for k in range(start, end + 1):
+                self.synced[k] = False
+            raise
+        for k in range(start, end + 1):
+            self.synced[k] = True
+
+    def invalidate(self):
+        """忘記晶片狀態；之後每個要求的值都會實際寫出"""
+        self.synced = [False] * self.LED_REGS
+
+    def flush(self):
+        """把影子暫存器中所有設定過的值整批重寫到晶片 (匯流排錯誤 / 晶片重置後復原用)"""
+        known = [r for r in range(self.LED_REGS) if self.shadow[r] is not None]
+        self.invalidate()
+        want = {r: self.shadow[r] for r in known}
+        i = 0
+        while i < len(known):
+            start = end = known[i]
+            while i + 1 < len(known) and known[i + 1] == end + 1 and (self.auto_increment and end + 1 - start < self.BLOCK_BYTES):
+                i += 1; end = known[i]
+            self._write_span(start, end, want)
+            i += 1
 
     def setDutycycle(self, channel, percent):
         pulse = int(percent * 4096 / 100)
@@ -59,19 +129,30 @@ class PCA9685:
     def setLevel(self, channel, value):
         self.setPWM(channel, 0, 4095 if value else 0)
 
+    @staticmethod
+    def duty(percent):
+        return (0, int(percent * 4096 / 100))
+
+    @staticmethod
+    def level(value):
+        return (0, 4095 if value else 0)
+
 
 class LOBOROBOT:
-    def __init__(self):
+    def __init__(self, pwm=None, led=None):
         self.PWMA, self.AIN1, self.AIN2 = 0, 2, 1  # 左前輪
         self.PWMB, self.BIN1, self.BIN2 = 5, 3, 4  # 右前輪
         self.PWMC, self.CIN1, self.CIN2 = 6, 8, 7  # 左後輪
         self.PWMD, self.DIN1, self.DIN2 = 11, 25, 24  # 右後輪
 
-        self.pwm = PCA9685(0x40, debug=False)
+        self.pwm = pwm if pwm is not None else PCA9685(0x40, debug=False)
         self.pwm.setPWMFreq(50)
 
-        self.motorD1 = LED(self.DIN1)
-        self.motorD2 = LED(self.DIN2)
+        if led is None:
+            from gpiozero import LED as led
+        self.motorD1 = led(self.DIN1)
+        self.motorD2 = led(self.DIN2)
+        self._d_forward = None      # 右後輪 GPIO 方向快取，方向沒變就不切換
 
     def _validate_speed(self, speed):
         if not 0 <= speed <= 100:
@@ -81,31 +162,47 @@ class LOBOROBOT:
         self.pwm.setLevel(in1, int(forward))
         self.pwm.setLevel(in2, int(not forward))
 
-    def MotorRun(self, motor, direction, speed):
+    def _motor_channels(self, motor, direction, speed, out):
+        """把單一馬達的 PWM 與方向通道值填入 out；右後輪方向走 GPIO，直接設定"""
         self._validate_speed(speed)
         forward = (direction == FORWARD)
+        duty, level = PCA9685.duty, PCA9685.level
 
         if motor == 0:
-            self.pwm.setDutycycle(self.PWMA, speed)
-            self._set_motor_direction(self.AIN1, self.AIN2, not forward)
+            out[self.PWMA] = duty(speed)
+            out[self.AIN1], out[self.AIN2] = level(not forward), level(forward)
         elif motor == 1:
-            self.pwm.setDutycycle(self.PWMB, speed)
-            self._set_motor_direction(self.BIN1, self.BIN2, forward)
+            out[self.PWMB] = duty(speed)
+            out[self.BIN1], out[self.BIN2] = level(forward), level(not forward)
         elif motor == 2:
-            self.pwm.setDutycycle(self.PWMC, speed)
-            self._set_motor_direction(self.CIN1, self.CIN2, forward)
+            out[self.PWMC] = duty(speed)
+            out[self.CIN1], out[self.CIN2] = level(forward), level(not forward)
         elif motor == 3:
-            self.pwm.setDutycycle(self.PWMD, speed)
+            out[self.PWMD] = duty(speed)
+            if forward == self._d_forward:
+                return
             if forward:
                 self.motorD1.off()
                 self.motorD2.on()
             else:
                 self.motorD1.on()
                 self.motorD2.off()
+            self._d_forward = forward
+
+    def MotorRun(self, motor, direction, speed):
+        values = {}
+        self._motor_channels(motor, direction, speed, values)
+        self.pwm.setPWMMulti(values)
+
+    def MotorRunAll(self, runs):
+        """runs: [(motor, direction, speed), ...]；四輪的 PWM 與方向一起用最少的 I2C 區塊寫入"""
+        values = {}
+        for motor, direction, speed in runs:
+            self._motor_channels(motor, direction, speed, values)
+        self.pwm.setPWMMulti(values)
 
     def MotorStop(self, motor):
-        for pwm in [self.PWMA, self.PWMB, self.PWMC, self.PWMD]:
-            self.pwm.setDutycycle(pwm, 0)
+        self.pwm.setPWMMulti({pwm: (0, 0) for pwm in [self.PWMA, self.PWMB, self.PWMC, self.PWMD]})
 
     def move(self, direction, speed, t_time):
         for m in range(4):
@@ -178,10 +275,10 @@ class LOBOROBOT:
         if t_time > 0: time.sleep(t_time)  # 等幾秒，可以有小數點
 
     def t_stop(self, t_time):
-        for m in range(4):
-            self.MotorStop(m)
-        self.pwm.setPWM(9, 0, 0)            # 停止頂部舵機控制
-        self.pwm.setPWM(10, 0, 0)           # 停止底座舵機控制
+        values = {pwm: (0, 0) for pwm in [self.PWMA, self.PWMB, self.PWMC, self.PWMD]}
+        values[9] = (0, 0)                  # 停止頂部舵機控制
+        values[10] = (0, 0)                 # 停止底座舵機控制
+        self.pwm.setPWMMulti(values)
         if t_time > 0:
             time.sleep(t_time)
 
@@ -0,0 +1,112 @@
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+@  文件名：actuator.py
+@  馬達執行緒：獨占 LOBOROBOT，控制迴圈只把 (l, r) / 停車 丟進單格信箱，
+@  I2C 再慢也不會拖到下一張影格的處理
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+
+import threading
+import time
+import traceback
+from collections import deque
+
+STOPPED = "stop"
+
+
+class Actuator:
+    """
+    - drive(l, r)：單格信箱，還沒執行的舊指令直接被新指令覆蓋 (latest-wins)
+    - stop()：緊急停車旗標，優先於信箱內的 drive 與其他排隊工作
+    - call(fn, *args)：其他硬體操作 (鏡頭舵機) 依序執行
+    """
+
+    def __init__(self, robot, perf=None):
+        self.robot = robot
+        self.perf = perf
+        self.cond = threading.Condition()
+        self._drive = None          # (l, r, 投遞時間)
+        self._stop = None           # 停車投遞時間
+        self._aux = deque()
+        self._applied = None        # 目前車體狀態：(l, r) 或 STOPPED
+        self.running = False
+        self.posted = 0
+        self.overwritten = 0
+        self.applied = 0
+        self.errors = 0
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def drive(self, l, r):
+        with self.cond:
+            if self._drive is not None: self.overwritten += 1
+            self._drive = (l, r, time.perf_counter())
+            self.posted += 1
+            self.cond.notify()
+
+    def stop(self):
+        with self.cond:
+            self._drive = None      # 停車前的 drive 作廢
+            if self._stop is None: self._stop = time.perf_counter()
+            self.cond.notify()
+
+    def call(self, fn, *args):
+        with self.cond:
+            self._aux.append((fn, args))
+            self.cond.notify()
+
+    def close(self, timeout=1.0):
+        """停車並結束執行緒"""
+        self.stop()
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.thread is not None: self.thread.join(timeout)
+
+    def stats(self):
+        return {"posted": self.posted, "overwritten": self.overwritten,
+                "applied": self.applied, "errors": self.errors}
+
+    def _run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self._stop is not None or self._drive is not None
+                                   or self._aux or not self.running)
+                if self._stop is not None:
+                    state, t_post, aux = STOPPED, self._stop, None
+                    self._stop = None
+                elif self._aux:
+                    state, t_post, aux = None, None, self._aux.popleft()
+                elif self._drive is not None:
+                    l, r, t_post = self._drive
+                    state, aux = (l, r), None
+                    self._drive = None
+                else:
+                    break           # 已 close 且沒有待辦
+            try:
+                if aux is not None:
+                    fn, args = aux
+                    fn(*args)
+                else:
+                    self._apply(state, t_post)
+            except Exception as e:
+                self.errors += 1
+                print(f"Error in actuator: {e}")
+                traceback.print_exc()
+                # I2C 錯誤後晶片狀態不明：下一個指令全部重寫
+                self._applied = None
+                pwm = getattr(self.robot, "pwm", None)
+                if pwm is not None and hasattr(pwm, "invalidate"): pwm.invalidate()
+
+    def _apply(self, state, t_post):
+        if state == self._applied: return
+        if state == STOPPED:
+            self.robot.t_stop(0)
+        else:
+            l, r = state
+            self.robot.MotorRunAll([(0, "forward", l), (2, "forward", l), (1, "forward", r), (3, "forward", r)])
+        self._applied = state
+        self.applied += 1
+        if self.perf is not None: self.perf.add("actuate", time.perf_counter() - t_post)
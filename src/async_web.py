@@ -0,0 +1,286 @@
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+@  文件名：async_web.py
+@  --web async：同一組網址改由 asyncio 服務 (只用標準函式庫)。
+@  /live_view、/api/mask_stream、/api/stream、/api/hud 在事件迴圈裡處理：閒置的觀看者只是一個等待中的協程，不占執行緒；
+@  其他路由 (首頁、參數、模式、錄影…) 交給原本的 Flask app (WSGI) 在執行緒池執行，路由不用寫兩份
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+
+import asyncio
+import io
+import json
+import sys
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, unquote
+
+from streaming import ViewerLink, limit_send_buffer
+from mask_stream import MaskLink
+
+MAX_HEADER = 16384
+MAX_BODY = 1 << 20
+
+Request = namedtuple("Request", "method path query version headers body peer")
+
+
+class AsyncFrameFeed:
+    """
+    broadcaster.publish() 之後把影格序號放進每個觀看者的 asyncio.Queue(maxsize=1)：
+    只留最新一張，慢的觀看者自然跳格；沒有觀看者時 publish 完全不碰事件迴圈
+    """
+
+    def __init__(self, broadcaster, views):
+        self.broadcaster = broadcaster
+        self.views = views
+        self.loop = None
+        self.queues = set()
+
+    def attach(self, loop):
+        self.loop = loop
+        self.broadcaster.listeners.append(self._on_publish)
+
+    def _on_publish(self, seq):
+        # 在控制迴圈 (或 FramePump) 執行緒：只排一個 callback，不等事件迴圈
+        if not self.queues: return
+        try: self.loop.call_soon_threadsafe(self._fan_out, seq)
+        except RuntimeError: pass           # 事件迴圈已關閉
+
+    def _fan_out(self, seq):
+        for q in self.queues:
+            if q.full(): q.get_nowait()
+            q.put_nowait(seq)
+
+    def subscribe(self, link):
+        q = asyncio.Queue(maxsize=1)
+        self.queues.add(q)
+        self.views.subscribe(link.m, link)
+        return q
+
+    def unsubscribe(self, link, q):
+        self.queues.discard(q)
+        self.views.unsubscribe(link.m, link)
+
+
+def _head(status, headers):
+    lines = [f"HTTP/1.1 {status}"] + [f"{k}: {v}" for k, v in headers]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+def _arg(req, key, default=None):
+    vals = parse_qs(req.query).get(key)
+    return vals[0] if vals else default
+
+
+class AsyncWebServer:
+    """
+    hud()          → /api/hud 的 dict
+    new_stream(hz) → /api/stream 的 telemetry.EventStream
+    masks          → /api/mask_stream 的 mask_stream.MaskEncoder
+    /api/exit 用的 werkzeug.server.shutdown 由這裡提供
+    """
+
+    def __init__(self, wsgi_app, feed, hud, new_stream, masks, workers=8):
+        self.app = wsgi_app
+        self.feed = feed
+        self.hud = hud
+        self.new_stream = new_stream
+        self.masks = masks
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix="web")
+        self.loop = None
+        self._stop = None
+        self._writers = {}          # 連線 task -> writer
+        self._busy = set()          # 正在處理一般請求的 task
+        self.addr = ("", 0)
+
+    def run(self, host, port):
+        try:
+            asyncio.run(self._main(host, port))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        """可從任何執行緒呼叫"""
+        if self.loop is not None: self.loop.call_soon_threadsafe(self._stop.set)
+
+    async def _main(self, host, port):
+        self.loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self.addr = (host, port)
+        self.feed.attach(self.loop)
+        server = await asyncio.start_server(self._client, host, port, limit=MAX_HEADER)
+        print(f" * asyncio server on http://{host}:{port}")
+        await self._stop.wait()
+        server.close()
+        # 串流與閒置的 keep-alive 連線直接關掉 (協程會讀到 EOF 自己結束)；
+        # 處理中的請求 (例如 /api/exit 自己) 讓它回完
+        for t, w in list(self._writers.items()):
+            if t not in self._busy: w.close()
+        if self._writers: await asyncio.wait(list(self._writers), timeout=2.0)
+
+    # ---------------- HTTP/1.1 ----------------
+
+    async def _client(self, reader, writer):
+        task = asyncio.current_task()
+        self._writers[task] = writer
+        try:
+            while not self._stop.is_set():
+                try:
+                    req = await self._read_request(reader, writer)
+                except ValueError:          # 請求列 / 標頭格式錯誤
+                    writer.write(_head("400 Bad Request", [("Content-Length", "0"), ("Connection", "close")]))
+                    break
+                if req is None: break
+                if not await self._dispatch(req, reader, writer): break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            del self._writers[task]
+            writer.close()
+
+    async def _read_request(self, reader, writer):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError:
+            return None             # keep-alive 連線正常關閉
+        lines = head.decode("latin-1").split("\r\n")
+        method, target, version = lines[0].split(" ", 2)
+        headers = {}
+        for line in lines[1:]:
+            if not line: continue
+            k, _, v = line.partition(":")
+            headers[k.strip().lower()] = v.strip()
+        n = int(headers.get("content-length") or 0)
+        if n > MAX_BODY: raise ValueError("body too large")
+        body = await reader.readexactly(n) if n else b""
+        path, _, query = target.partition("?")
+        return Request(method, path, query, version, headers, body, writer.get_extra_info("peername"))
+
+    @staticmethod
+    def _keep_alive(req):
+        conn = req.headers.get("connection", "").lower()
+        if req.version == "HTTP/1.0": return conn == "keep-alive"
+        return conn != "close"
+
+    async def _dispatch(self, req, reader, writer):
+        """回傳 True 表示連線可以繼續讀下一個請求"""
+        if req.path == "/live_view":
+            await self._live_view(req, reader, writer)
+            return False
+        if req.path == "/api/mask_stream":
+            await self._mask_stream(req, reader, writer)
+            return False
+        if req.path == "/api/stream":
+            await self._stream(req, reader, writer)
+            return False
+        keep = self._keep_alive(req)
+        task = asyncio.current_task()
+        self._busy.add(task)
+        try:
+            if req.path == "/api/hud" and req.method == "GET":
+                status, headers = "200 OK", [("Content-Type", "application/json")]
+                body = json.dumps(self.hud(), separators=(",", ":")).encode()
+            else:
+                status, headers, body = await self.loop.run_in_executor(self.pool, self._call_wsgi, req)
+            headers = [(k, v) for k, v in headers if k.lower() not in ("content-length", "connection")]
+            headers += [("Content-Length", str(len(body))), ("Connection", "keep-alive" if keep else "close")]
+            writer.write(_head(status, headers) + (b"" if req.method == "HEAD" else body))
+            await writer.drain()
+        finally:
+            self._busy.discard(task)
+        return keep
+
+    def _call_wsgi(self, req):
+        """在執行緒池執行 Flask；回應一次收齊 (串流路由不會走到這裡)"""
+        environ = {
+            "REQUEST_METHOD": req.method, "SCRIPT_NAME": "", "PATH_INFO": unquote(req.path, "latin-1"),
+            "QUERY_STRING": req.query, "SERVER_PROTOCOL": req.version,
+            "SERVER_NAME": str(self.addr[0]), "SERVER_PORT": str(self.addr[1]),
+            "REMOTE_ADDR": req.peer[0] if req.peer else "",
+            "CONTENT_TYPE": req.headers.get("content-type", ""), "CONTENT_LENGTH": str(len(req.body)),
+            "wsgi.version": (1, 0), "wsgi.url_scheme": "http", "wsgi.input": io.BytesIO(req.body),
+            "wsgi.errors": sys.stderr, "wsgi.multithread": True, "wsgi.multiprocess": False, "wsgi.run_once": False,
+            "werkzeug.server.shutdown": self.shutdown,
+        }
+        for k, v in req.headers.items():
+            if k in ("content-type", "content-length"): continue
+            environ["HTTP_" + k.upper().replace("-", "_")] = v
+        out = {}
+        chunks = []
+
+        def start_response(status, headers, exc_info=None):
+            out["status"], out["headers"] = status, headers
+            return chunks.append
+
+        result = self.app(environ, start_response)
+        try:
+            for c in result: chunks.append(c)
+        finally:
+            if hasattr(result, "close"): result.close()
+        return out["status"], out["headers"], b"".join(chunks)
+
+    # ---------------- 串流 ----------------
+
+    async def _live_view(self, req, reader, writer):
+        link = ViewerLink(_arg(req, "m", "cv"), _arg(req, "q"), _arg(req, "scale"), _arg(req, "fps"))
+        bc = self.feed.broadcaster
+
+        async def fetch():
+            # 已編好就直接送；第一個要這張的觀看者在執行緒池編碼 (cv2 會放掉 GIL)
+            return (bc.cached(link.m, link.q, link.scale) or
+                    await self.loop.run_in_executor(self.pool, bc.frame, link.m, link.q, link.scale))
+
+        await self._push(link, fetch, "multipart/x-mixed-replace; boundary=frame", reader, writer)
+
+    async def _mask_stream(self, req, reader, writer):
+        link = MaskLink(_arg(req, "m", "mask"), _arg(req, "fps"))
+
+        async def fetch():
+            return self.masks.frame(link)   # packbits + XOR + zlib 只要幾十 µs，直接在事件迴圈做
+
+        await self._push(link, fetch, "application/octet-stream", reader, writer)
+
+    async def _push(self, link, fetch, ctype, reader, writer):
+        """串流共用：每張新影格 await fetch() 取得 (seq, bytes) 寫出，依 link.sent() 控制節奏"""
+        writer.write(_head("200 OK", [("Content-Type", ctype), ("Cache-Control", "no-cache"), ("Connection", "close")]))
+        await writer.drain()
+        # 不在使用者空間排隊：drain() 要等整張交給核心，核心緩衝也調小，寫出耗時才反映網路
+        writer.transport.set_write_buffer_limits(high=0)
+        limit_send_buffer(writer.get_extra_info("socket"))
+        bc = self.feed.broadcaster
+        q = self.feed.subscribe(link)
+        gone = asyncio.ensure_future(reader.read())     # 觀看者關閉連線時完成
+        try:
+            last_seq = -1
+            while True:
+                get = asyncio.ensure_future(q.get())
+                await asyncio.wait((get, gone), return_when=asyncio.FIRST_COMPLETED)
+                if gone.done():
+                    get.cancel(); break
+                seq, chunk = await fetch()
+                if chunk is None or seq == last_seq: continue
+                last_seq = seq
+                t0 = self.loop.time()
+                writer.write(chunk)
+                await writer.drain()
+                await asyncio.sleep(link.sent(len(chunk), self.loop.time() - t0, bc.seq - seq))
+        finally:
+            gone.cancel()
+            self.feed.unsubscribe(link, q)
+
+    async def _stream(self, req, reader, writer):
+        es = self.new_stream(_arg(req, "hz"))
+        writer.write(_head("200 OK", [("Content-Type", "text/event-stream"), ("Cache-Control", "no-cache"),
+                                      ("Connection", "close")]) + es.first().encode())
+        gone = asyncio.ensure_future(reader.read())
+        try:
+            while not gone.done():
+                t0 = self.loop.time()
+                # poll() 在 --procs 時可能等 Pipe 往返 (perf 摘要)，不能卡住事件迴圈上的其他串流
+                text = await self.loop.run_in_executor(self.pool, es.poll)
+                if text:
+                    writer.write(text.encode())
+                    await writer.drain()
+                await asyncio.wait((gone,), timeout=max(0.0, es.period - (self.loop.time() - t0)))
+        finally:
+            gone.cancel()
@@ -0,0 +1,69 @@
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+@  文件名：bench_hsv_lut.py
+@  比較 cvtColor + 兩次 inRange 與 HsvLutClassifier 查表的每張影格耗時
+@  用法：python3 src/bench_hsv_lut.py [圖片資料夾] [--n 500]
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+
+import argparse
+import glob
+import os
+import time
+import cv2
+import numpy as np
+
+from hsv_lut import HsvLutClassifier
+from main import FACTORY_PRESETS, ww, hh
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def bounds(p):
+    lw = np.array([p["h_min"], p["s_min"], p["v_min"]], dtype=np.uint8)
+    uw = np.array([p["h_max"], p["s_max"], p["v_max"]], dtype=np.uint8)
+    ly = np.array([p["yh_min"], p["ys_min"], p["yv_min"]], dtype=np.uint8)
+    uy = np.array([p["yh_max"], p["ys_max"], p["yv_max"]], dtype=np.uint8)
+    return lw, uw, ly, uy
+
+
+def timeit(fn, n):
+    fn()
+    t0 = time.perf_counter()
+    for _ in range(n): fn()
+    return (time.perf_counter() - t0) / n * 1e6
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("images", nargs="?", default=os.path.join(HERE, "..", "data", "images"))
+    ap.add_argument("--n", type=int, default=500)
+    args = ap.parse_args()
+
+    files = sorted(glob.glob(os.path.join(args.images, "*.png")) + glob.glob(os.path.join(args.images, "*.jpg")))
+    if not files:
+        raise SystemExit(f"找不到圖片: {args.images}")
+
+    clf = HsvLutClassifier()
+    print(f"{'image':<24}{'preset':<8}{'hsv+inRange us':>16}{'lut us':>10}{'speedup':>9}{'diff %':>9}")
+    for name, preset in FACTORY_PRESETS.items():
+        lw, uw, ly, uy = bounds(preset)
+        t0 = time.perf_counter(); clf.update(lw, uw, ly, uy)
+        build_ms = (time.perf_counter() - t0) * 1e3
+        roi_y = preset["roi_y_min"] + preset["s_lookahead"]
+        for fn in files:
+            img = cv2.resize(cv2.imread(fn), (ww, hh), interpolation=cv2.INTER_AREA)
+            roi = np.ascontiguousarray(img[roi_y:hh, 0:ww])
+
+            def ref():
+                hsv = cv2.cvtColor(roi, cv2.COLOR_BGR2HSV)
+                return cv2.inRange(hsv, lw, uw), cv2.inRange(hsv, ly, uy)
+
+            t_ref = timeit(ref, args.n)
+            t_lut = timeit(lambda: clf.classify(roi), args.n)
+            w0, y0 = ref(); w1, y1 = clf.classify(roi)
+            diff = ((w0 != w1).mean() + (y0 != y1).mean()) / 2 * 100
+            print(f"{os.path.basename(fn):<24}{name:<8}{t_ref:>16.1f}{t_lut:>10.1f}{t_ref/t_lut:>8.2f}x{diff:>9.3f}")
+        print(f"  (table build for {name}: {build_ms:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+@  文件名：bench_jitter.py
+@  比較不同架構 (threaded / --procs / --web async) 在網頁負載下的控制迴圈週期抖動：
+@  以固定 FPS 回放影片並寫執行紀錄，先空載再同時開 MJPEG 觀看者與 /api/hud 輪詢，
+@  結束後從執行紀錄的時間戳計算各階段的週期分佈；負載期間另記主行程的執行緒數與 CPU
+@  用法：python3 src/bench_jitter.py 影片.avi [--fps 30] [--viewers 20] [--pollers 4] [--seconds 10]
+@        [--layouts threaded procs async async+procs]
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+
+import argparse
+import http.client
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import numpy as np
+
+from runlog import RunLog
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+VIEWS = ("cv", "mask", "maskw", "masky")
+LAYOUTS = {
+    "threaded": [],
+    "procs": ["--procs"],
+    "async": ["--web", "async"],
+    "async+procs": ["--web", "async", "--procs"],
+}
+
+
+def wait_up(base, timeout=15.0):
+    t_end = time.time() + timeout
+    while time.time() < t_end:
+        try:
+            urllib.request.urlopen(base + "/api/hud", timeout=1).read()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def viewer(base, m, stop, counter):
+    while not stop.is_set():
+        try:
+            with urllib.request.urlopen(f"{base}/live_view?m={m}", timeout=5) as r:
+                while not stop.is_set():
+                    # read1：read(amt) 會等滿 amt；先讀再加，避免 += 拿到阻塞前的舊值
+                    n = len(r.read1(65536))
+                    counter[0] += n
+        except (OSError, http.client.HTTPException):
+            time.sleep(0.1)
+
+
+def poller(base, stop, counter):
+    while not stop.is_set():
+        try:
+            urllib.request.urlopen(base + "/api/hud", timeout=5).read()
+            counter[0] += 1
+        except (OSError, http.client.HTTPException):
+            time.sleep(0.1)
+
+
+def proc_usage(pid):
+    """(執行緒數, 累計 CPU 秒)；--procs 時只算網頁行程"""
+    with open(f"/proc/{pid}/status") as f:
+        threads = next(int(line.split()[1]) for line in f if line.startswith("Threads:"))
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return threads, (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def period_stats(t, nominal):
+    d = np.diff(t) * 1e3
+    if len(d) == 0: return None
+    dev = np.abs(d - nominal)
+    return {"ticks": len(d) + 1, "mean": d.mean(), "std": d.std(), "p99": np.percentile(d, 99), "max": d.max(),
+            "dev_p99": np.percentile(dev, 99), "late": int((d > 1.5 * nominal).sum())}
+
+
+def run_layout(args, flags, port):
+    log_dir = tempfile.mkdtemp(prefix="jitter_")
+    cmd = [sys.executable, os.path.join(HERE, "main.py"), "--source", args.video, "--loop", "--rate", str(args.fps),
+           "--auto", "--preset", args.preset, "--runlog", log_dir, "--port", str(port),
+           "--rec-dir", tempfile.gettempdir()] + flags
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{port}"
+    try:
+        if not wait_up(base): raise SystemExit("main.py 沒有啟動")
+        time.sleep(1.0)                         # 等查表與第一張影格
+        t_idle = time.time(); time.sleep(args.seconds)
+        stop = threading.Event()
+        frames_bytes = [0]; polls = [0]
+        workers = [threading.Thread(target=viewer, args=(base, VIEWS[i % len(VIEWS)], stop, frames_bytes), daemon=True)
+                   for i in range(args.viewers)]
+        workers += [threading.Thread(target=poller, args=(base, stop, polls), daemon=True) for _ in range(args.pollers)]
+        t_load = time.time()
+        for w in workers: w.start()
+        time.sleep(0.5)
+        _, cpu0 = proc_usage(proc.pid)
+        time.sleep(args.seconds - 0.5)
+        threads, cpu1 = proc_usage(proc.pid)
+        stop.set()
+        t_end = time.time()
+    finally:
+        proc.send_signal(signal.SIGINT)
+        try: proc.wait(10)
+        except subprocess.TimeoutExpired: proc.kill()
+    tel = RunLog(log_dir).telemetry()
+    t = tel["t"]
+    nominal = 1e3 / args.fps
+    idle = period_stats(t[(t >= t_idle) & (t < t_load)], nominal)
+    load = period_stats(t[(t >= t_load + 0.5) & (t < t_end)], nominal)      # 跳過連線建立的前 0.5 秒
+    usage = {"kbs": frames_bytes[0] / args.seconds / 1e3, "hud": polls[0] / args.seconds,
+             "threads": threads, "cpu": (cpu1 - cpu0) / (args.seconds - 0.5) * 100}
+    return idle, load, usage
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("video")
+    ap.add_argument("--fps", type=float, default=30.0)
+    ap.add_argument("--preset", default="school")
+    ap.add_argument("--viewers", type=int, default=20, help="MJPEG 觀看者數 (輪流 cv/mask/maskw/masky)")
+    ap.add_argument("--pollers", type=int, default=4, help="不停輪詢 /api/hud 的連線數")
+    ap.add_argument("--seconds", type=float, default=10.0, help="空載與負載各跑幾秒")
+    ap.add_argument("--port", type=int, default=5090)
+    ap.add_argument("--layouts", nargs="+", choices=list(LAYOUTS), default=list(LAYOUTS))
+    args = ap.parse_args()
+
+    print(f"{args.fps:.0f} fps, {args.viewers} viewers + {args.pollers} /api/hud pollers, period ms; "
+          f"threads / cpu% of the web process under load")
+    print(f"{'layout':<13}{'phase':<6}{'ticks':>7}{'mean':>8}{'std':>8}{'p99':>8}{'max':>8}{'|dev| p99':>11}{'late':>6}"
+          f"{'KB/s':>8}{'hud/s':>7}{'threads':>9}{'cpu%':>6}")
+    for i, name in enumerate(args.layouts):
+        idle, load, u = run_layout(args, LAYOUTS[name], args.port + i)
+        extra = f"{u['kbs']:>8.0f}{u['hud']:>7.0f}{u['threads']:>9}{u['cpu']:>6.0f}"
+        for phase, st, tail in (("idle", idle, ""), ("load", load, extra)):
+            if st is None: print(f"{name:<13}{phase:<6}  (no ticks)"); continue
+            print(f"{name:<13}{phase:<6}{st['ticks']:>7}{st['mean']:>8.2f}{st['std']:>8.2f}{st['p99']:>8.2f}"
+                  f"{st['max']:>8.2f}{st['dev_p99']:>11.2f}{st['late']:>6}{tail}")
+
+
+if __name__ == "__main__":
+    main()
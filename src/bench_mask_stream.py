@@ -0,0 +1,100 @@
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+@  文件名：bench_mask_stream.py
+@  比較遮罩畫面的三種送法，每張的 bytes 與網頁行程的編碼耗時：
+@    jpeg3  舊路徑：GRAY2BGR 展成三通道 → RGB2BGR → JPEG
+@    jpeg1  單通道灰階 JPEG (/live_view?m=mask 現在的路徑)
+@    bits   np.packbits + 對上一張 XOR + zlib (/api/mask_stream)
+@  bits 另外逐張用 mask_stream.decode() 解回來，確認跟原遮罩完全相同
+@  用法：python3 src/bench_mask_stream.py 影片.avi [--preset school] [--frames 600] [--quality 80]
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+import argparse
+import time
+import cv2
+import numpy as np
+
+from frame_source import VideoFileSource, RATE_MAX
+from lane_core import LaneDetector, make_config
+from params_schema import coerce_all
+from mask_stream import MaskEncoder, decode, KEY, DELTA
+from main import PARAMS, FACTORY_PRESETS, ww, hh
+
+MULTIPART = len(b"--frame\r\nContent-Type: image/jpeg\r\n\r\n\r\n")
+
+
+def load_masks(path, limit, cfg):
+    """回傳 {mode: [遮罩...]}，與控制迴圈給 /live_view 的內容相同"""
+    src = VideoFileSource(path, (ww, hh), rate=RATE_MAX)
+    det = LaneDetector(ww)
+    masks = {"mask": [], "maskw": [], "masky": []}
+    while len(masks["mask"]) < limit:
+        f = src.read()
+        if f is None: break
+        d = det.detect(f[cfg.roi_y:hh, 0:ww], cfg)
+        masks["mask"].append(d.mask_clean.copy())
+        masks["maskw"].append(d.mask_w.copy())
+        masks["masky"].append(d.mask_y.copy())
+    src.close()
+    return masks
+
+
+def jpeg3(img, q):
+    bgr = cv2.cvtColor(cv2.cvtColor(img, cv2.COLOR_GRAY2BGR), cv2.COLOR_RGB2BGR)
+    return cv2.imencode(".jpg", bgr, [int(cv2.IMWRITE_JPEG_QUALITY), q])[1].size + MULTIPART
+
+
+def jpeg1(img, q):
+    return cv2.imencode(".jpg", img, [int(cv2.IMWRITE_JPEG_QUALITY), q])[1].size + MULTIPART
+
+
+def run_jpeg(fn, imgs, q):
+    t0 = time.perf_counter()
+    sizes = [fn(img, q) for img in imgs]
+    return (time.perf_counter() - t0) / len(imgs) * 1e6, np.mean(sizes)
+
+
+def run_bits(imgs):
+    """回傳 (us/張, bytes/張, 各 kind 張數, 解碼不符張數)；耗時算 packbits + XOR + zlib"""
+    enc = MaskEncoder(None)
+    msgs = []
+    base = None
+    t0 = time.perf_counter()
+    for seq, img in enumerate(imgs):
+        packed = np.packbits(img)
+        msgs.append(enc.encode(seq, packed, img.shape, base))
+        base = (seq, packed, img.shape)
+    us = (time.perf_counter() - t0) / len(imgs) * 1e6
+    kinds = {KEY: 0, DELTA: 0}
+    bits, bad = None, 0
+    for img, msg in zip(imgs, msgs):
+        kinds[msg[4]] += 1
+        _, (h, w), bits = decode(msg, bits)
+        bad += not np.array_equal(np.unpackbits(bits, count=h * w).reshape(h, w), img > 0)
+    return us, np.mean([len(m) for m in msgs]), kinds, bad
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("video")
+    ap.add_argument("--preset", choices=list(FACTORY_PRESETS.keys()), default="school")
+    ap.add_argument("--frames", type=int, default=600)
+    ap.add_argument("--quality", type=int, default=80)
+    args = ap.parse_args()
+
+    p = dict(PARAMS); p.update(coerce_all(FACTORY_PRESETS[args.preset]))
+    masks = load_masks(args.video, args.frames, make_config(p, hh))
+    if not masks["mask"]: raise SystemExit(f"讀不到影格: {args.video}")
+    h, w = masks["mask"][0].shape
+    print(f"{len(masks['mask'])} frames, mask {w}x{h}, preset {args.preset}, jpeg q{args.quality}")
+    print(f"{'view':<7}{'format':<8}{'bytes':>9}{'us/frame':>10}{'vs jpeg3':>18}  notes")
+    for m, imgs in masks.items():
+        base_us, base_b = run_jpeg(jpeg3, imgs, args.quality)
+        g_us, g_b = run_jpeg(jpeg1, imgs, args.quality)
+        b_us, b_b, kinds, bad = run_bits(imgs)
+        print(f"{m:<7}{'jpeg3':<8}{base_b:>9.0f}{base_us:>10.1f}{'':>18}")
+        print(f"{'':<7}{'jpeg1':<8}{g_b:>9.0f}{g_us:>10.1f}{base_b / g_b:>8.1f}x /{base_us / g_us:>5.1f}x")
+        print(f"{'':<7}{'bits':<8}{b_b:>9.0f}{b_us:>10.1f}{base_b / b_b:>8.1f}x /{base_us / b_us:>5.1f}x"
+              f"  key {kinds[KEY]} delta {kinds[DELTA]}, decode mismatches {bad}")
+
+
+if __name__ == "__main__":
+    main()
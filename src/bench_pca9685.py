@@ -0,0 +1,97 @@
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+@  文件名：bench_pca9685.py
+@  以假的 smbus 計算每次馬達更新的 I2C 交易數與線上位元組數
+@  用法：python3 src/bench_pca9685.py
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+
+from LOBOROBOT2 import LOBOROBOT, PCA9685, FORWARD
+
+
+class FakeSMBus:
+    """只記錄交易；每筆位元組數 = 位址 + 暫存器 + 資料"""
+
+    def __init__(self):
+        self.regs = bytearray(256)
+        self.reset()
+
+    def reset(self):
+        self.transactions = 0
+        self.bytes = 0
+
+    def write_byte_data(self, addr, reg, value):
+        self.regs[reg] = value
+        self.transactions += 1
+        self.bytes += 3
+
+    def write_i2c_block_data(self, addr, reg, values):
+        assert len(values) <= 32, "SMBus block write limited to 32 bytes"
+        self.regs[reg:reg + len(values)] = bytes(values)
+        self.transactions += 1
+        self.bytes += 2 + len(values)
+
+    def read_byte_data(self, addr, reg):
+        self.transactions += 1
+        self.bytes += 3
+        return self.regs[reg]
+
+
+class FakeLED:
+    def __init__(self, pin): self.pin = pin
+    def on(self): pass
+    def off(self): pass
+
+
+def make_robot(auto_increment):
+    bus = FakeSMBus()
+    robot = LOBOROBOT(pwm=PCA9685(0x40, bus=bus, auto_increment=auto_increment), led=FakeLED)
+    bus.reset()
+    return robot, bus
+
+
+def legacy_drive(robot, l, r):
+    robot.MotorRun(0, FORWARD, l); robot.MotorRun(2, FORWARD, l)
+    robot.MotorRun(1, FORWARD, r); robot.MotorRun(3, FORWARD, r)
+
+
+def batched_drive(robot, l, r):
+    robot.MotorRunAll([(0, FORWARD, l), (2, FORWARD, l), (1, FORWARD, r), (3, FORWARD, r)])
+
+
+def measure(name, auto_increment, fn, cached=True, steady=False, n=100):
+    robot, bus = make_robot(auto_increment)
+    fn(robot, 50, 50); bus.reset()
+    for i in range(n):
+        if not cached: robot.pwm.invalidate()       # 模擬沒有影子暫存器：每次都全寫
+        l, r = (50, 50) if steady else (40 + i % 20, 60 - i % 20)
+        fn(robot, l, r)
+    print(f"{name:<44}{bus.transactions / n:>8.1f}{bus.bytes / n:>8.1f}")
+    return bus.regs
+
+
+def main():
+    print(f"{'per motor update':<44}{'txn':>8}{'bytes':>8}")
+    regs_a = measure("byte writes, 4x MotorRun (original)", False, legacy_drive, cached=False)
+    measure("auto-increment, 4x MotorRun", True, legacy_drive, cached=False)
+    measure("auto-increment, MotorRunAll", True, batched_drive, cached=False)
+    regs_b = measure("+ shadow cache, speeds changing", True, batched_drive)
+    measure("+ shadow cache, steady state", True, batched_drive, steady=True)
+    for cached in (False, True):
+        robot, bus = make_robot(True)
+        robot.t_stop(0); bus.reset()
+        for _ in range(10):
+            if not cached: robot.pwm.invalidate()
+            robot.t_stop(0)
+        print(f"{'t_stop' + (' + shadow cache' if cached else ''):<44}{bus.transactions / 10:>8.1f}{bus.bytes / 10:>8.1f}")
+    # 兩種寫法最後的暫存器內容必須一致
+    assert regs_a[0x06:0x46] == regs_b[0x06:0x46]
+    # flush() 要能把影子暫存器完整補寫回晶片
+    robot, bus = make_robot(True)
+    batched_drive(robot, 55, 45)
+    expect = bytes(bus.regs); bus.regs[0x06:0x46] = bytes(64); bus.reset()
+    robot.pwm.flush()
+    assert bus.regs == expect
+    print(f"{'flush after reset':<44}{bus.transactions:>8.1f}{bus.bytes:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+@  文件名：bench_tracking.py
+@  比較全圖掃描與追蹤窗 (track_win) 的偵測耗時、追蹤比例與結果差異
+@  用法：python3 src/bench_tracking.py 影片.avi [--preset school] [--win 8 16 24] [--refresh 10]
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+import argparse
+import time
+import numpy as np
+
+from frame_source import VideoFileSource, RATE_MAX
+from lane_core import LaneDetector, make_config
+from params_schema import coerce_all
+from main import PARAMS, FACTORY_PRESETS, ww, hh
+
+
+def load_frames(path, limit):
+    src = VideoFileSource(path, (ww, hh), rate=RATE_MAX)
+    frames = []
+    while len(frames) < limit:
+        f = src.read()
+        if f is None: break
+        frames.append(f.copy())
+    src.close()
+    return frames
+
+
+def run(frames, cfg, use_lut, repeat):
+    """回傳 (每張平均 us, 每張結果, 每張處理像素數)"""
+    best = None
+    for _ in range(repeat):
+        det = LaneDetector(ww, use_lut=use_lut)
+        # 先建好查表 (約 10ms) 再還原初始狀態，不計入每張耗時
+        det.detect(frames[0][cfg.roi_y:hh, 0:ww], cfg)
+        det.restore(ww // 2, 160, -1, -1, 0, 0, 0, 0)
+        out = []; px = []
+        t_sum = 0.0
+        for frame in frames:
+            roi = frame[cfg.roi_y:hh, 0:ww]
+            t = det.track
+            t0 = time.perf_counter()
+            d = det.detect(roi, cfg)
+            t_sum += time.perf_counter() - t0
+            out.append((d.lx, d.rx, d.lane_center, d.has_line, d.cte, d.tracked))
+            if d.tracked:
+                pad = 4 + (cfg.white_thick if t.is_white else 0)
+                sides = (t.lx is not None) + (t.rx is not None)
+                px.append(sides * (2 * (cfg.track_win + pad) + 1) * min(roi.shape[0], cfg.band_h + pad))
+            else:
+                px.append(roi.shape[0] * roi.shape[1])
+        us = t_sum / len(frames) * 1e6
+        if best is None or us < best[0]: best = (us, out, px)
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("video")
+    ap.add_argument("--preset", choices=list(FACTORY_PRESETS.keys()), default="school")
+    ap.add_argument("--win", type=int, nargs="+", default=[8, 16, 24])
+    ap.add_argument("--refresh", type=int, default=10)
+    ap.add_argument("--frames", type=int, default=2000)
+    ap.add_argument("--repeat", type=int, default=3, help="每種設定跑幾次取最快")
+    ap.add_argument("--no-hsv-lut", action="store_true")
+    args = ap.parse_args()
+
+    frames = load_frames(args.video, args.frames)
+    if not frames: raise SystemExit(f"讀不到影格: {args.video}")
+    p = dict(PARAMS); p.update(coerce_all(FACTORY_PRESETS[args.preset]))
+    use_lut = not args.no_hsv_lut
+
+    base_us, base, base_px = run(frames, make_config(dict(p, track_win=0), hh), use_lut, args.repeat)
+    print(f"{len(frames)} frames, preset {args.preset}, {'lut' if use_lut else 'cvtColor+inRange'}")
+    print(f"{'mode':<14}{'us/frame':>10}{'speedup':>9}{'tracked %':>11}{'lx/rx same %':>14}{'max |dcte|':>12}{'px/frame':>10}")
+    print(f"{'full scan':<14}{base_us:>10.1f}{'1.00x':>9}{0.0:>11.1f}{100.0:>14.1f}{0.0:>12.1f}{np.mean(base_px):>10.0f}")
+    for win in args.win:
+        cfg = make_config(dict(p, track_win=win, track_refresh=args.refresh), hh)
+        us, out, px = run(frames, cfg, use_lut, args.repeat)
+        tracked = np.mean([o[5] for o in out]) * 100
+        same = np.mean([o[:2] == b[:2] for o, b in zip(out, base)]) * 100
+        dcte = max(abs(o[4] - b[4]) for o, b in zip(out, base))
+        print(f"{'win ' + str(win):<14}{us:>10.1f}{base_us/us:>8.2f}x{tracked:>11.1f}{same:>14.1f}{dcte:>12.1f}{np.mean(px):>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+@  文件名：buffers.py
+@  預先配置的記憶體：影格環形緩衝 (capture → control 交接不複製)、
+@  遮罩/型態學的輸出緩衝 (熱路徑用 dst= 不再每張影格配置)
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+
+import threading
+import time
+import numpy as np
+
+
+class FrameRing:
+    """
+    slots 個固定影格槽，以索引交接所有權：
+    - 寫入端 acquire_write() 拿一個「不是最新、也沒被讀取端持有」的槽，寫完 publish()
+    - 讀取端 acquire_read() 拿最新槽並持有，用完 release()；持有期間不會被覆寫
+    aux_shape 給定時每個槽另有一塊同索引的副緩衝 (相機 lores 串流)
+    """
+
+    def __init__(self, shape, slots=4, dtype=np.uint8, aux_shape=None):
+        self.slots = [np.zeros(shape, dtype=dtype) for _ in range(slots)]
+        self.aux = [np.zeros(aux_shape, dtype=dtype) for _ in range(slots)] if aux_shape else None
+        self.cond = threading.Condition()
+        self.held = [0] * slots
+        self.latest = -1
+        self.seq = 0
+        self.stamp = 0.0
+        self.read_seq = 0
+
+    def acquire_write(self):
+        with self.cond:
+            for i in range(len(self.slots)):
+                if i != self.latest and self.held[i] == 0:
+                    return i
+        raise RuntimeError("FrameRing: no free slot")
+
+    def publish(self, idx):
+        with self.cond:
+            self.latest = idx
+            self.seq += 1
+            self.stamp = time.perf_counter()
+            self.cond.notify_all()
+
+    def acquire_read(self, last_seq, timeout=0.5):
+        """等到有比 last_seq 新的影格；回傳 (idx, seq, stamp)，逾時回傳 None"""
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.seq != last_seq, timeout):
+                return None
+            self.held[self.latest] += 1
+            self.read_seq = self.seq
+            self.cond.notify_all()
+            return self.latest, self.seq, self.stamp
+
+    def wait_consumed(self, timeout=0.5):
+        """等讀取端取走最新影格 (離線最快速回放用，確保每張都有處理)"""
+        with self.cond:
+            return self.cond.wait_for(lambda: self.read_seq == self.seq, timeout)
+
+    def release(self, idx):
+        with self.cond:
+            self.held[idx] -= 1
+
+
+class MaskBuffers:
+    """依 ROI 尺寸配置的遮罩緩衝；roi_y 改變時才重新配置"""
+
+    def __init__(self):
+        self.shape = None
+
+    def ensure(self, shape):
+        if shape == self.shape:
+            return self
+        h, w = shape
+        self.hsv = np.empty((h, w, 3), dtype=np.uint8)
+        self.mask_w = np.empty((h, w), dtype=np.uint8)
+        self.mask_y = np.empty((h, w), dtype=np.uint8)
+        self.mask_or = np.empty((h, w), dtype=np.uint8)
+        self.dilated = np.empty((h, w), dtype=np.uint8)
+        self.opened = np.empty((h, w), dtype=np.uint8)
+        self.clean = np.empty((h, w), dtype=np.uint8)
+        self.colsum = np.empty((w,), dtype=np.int32)
+        self.shape = shape
+        return self
@@ -0,0 +1,241 @@
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+@  文件名：frame_source.py
+@  影像來源：實機相機 (Picamera2，可加開 YUV420 lores 串流) 或離線錄影回放 (mp4 / avi)；
+@  StandInCamera 以錄影檔模擬相機，離線測試雙串流
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+
+import os
+import time
+import cv2
+import numpy as np
+
+RATE_NATIVE = "native"   # 依影片原始 FPS 播放
+RATE_MAX = "max"         # 不限速，盡可能快
+
+
+def bgr_to_i420(bgr, dst):
+    """BGR → YUV420 平面 (Y, U, V 依序，形狀 [h*3/2, w])，色彩與相機 lores 相同 (sYCC 全範圍)"""
+    h, w = bgr.shape[:2]
+    ycc = cv2.cvtColor(bgr, cv2.COLOR_BGR2YCrCb)
+    dst[:h] = ycc[:, :, 0]
+    chroma = cv2.resize(ycc[:, :, 1:], (w // 2, h // 2), interpolation=cv2.INTER_AREA)
+    q = h * w // 4
+    flat = dst[h:].reshape(-1)
+    flat[:q] = chroma[:, :, 1].reshape(-1)      # U = Cb
+    flat[q:] = chroma[:, :, 0].reshape(-1)      # V = Cr
+    return dst
+
+
+class LoresRoi:
+    """
+    YUV420 影格只取 ROI (y0 以下) 的 Y 列與對應的色度列，以 OpenCV 的 I420 解碼直接輸出 BGRA
+    (查表分類本來就要 BGRA，省掉 BGR2BGRA)。OpenCV 解碼用 BT.601 限制範圍，相機是全範圍 sYCC，
+    色偏由 HsvLutClassifier(space="i420") 建表時修正
+    """
+
+    def __init__(self, size):
+        self.w, self.h = size
+        self.y0 = None
+
+    def __call__(self, yuv, y0):
+        w, h = self.w, self.h
+        ye = y0 & ~1                                    # 色度一列對應兩列 Y，從偶數列開始
+        rows = h - ye
+        if y0 != self.y0:
+            self.sub = np.empty((rows * 3 // 2, w), dtype=np.uint8)
+            self.buf = np.empty((rows, w, 4), dtype=np.uint8)
+            self.y0 = y0
+        q = rows * w // 4
+        chroma = yuv[h:].reshape(2, -1)                 # U 平面、V 平面
+        flat = self.sub[rows:].reshape(-1)
+        self.sub[:rows] = yuv[ye:h]
+        flat[:q] = chroma[0, ye // 2 * (w // 2):]
+        flat[q:] = chroma[1, ye // 2 * (w // 2):]
+        cv2.cvtColor(self.sub, cv2.COLOR_YUV2BGRA_I420, dst=self.buf)
+        return self.buf[y0 - ye:]
+
+
+class PicameraSource:
+    """
+    實機相機：main 320x240 RGB888 (記憶體順序為 BGR) 給錄影與 /live_view；
+    lores=True 時另開同尺寸 YUV420 的 lores 串流給控制迴圈 (ISP 做縮放與色彩轉換，每張只複製一半的位元組，
+    沒人看也沒錄影時 main 不複製)。
+    cam 可傳入 StandInCamera，離線測試同一套程式
+    """
+
+    def __init__(self, size, hflip=1, vflip=1, lores=False, cam=None):
+        if cam is None:
+            import libcamera
+            from picamera2 import Picamera2, MappedArray
+            cam = Picamera2()
+            transform = libcamera.Transform(hflip=hflip, vflip=vflip)
+        else:
+            MappedArray = cam.MappedArray
+            transform = None        # 替身輸出的就是錄好的畫面，不再翻轉
+
+        self.MappedArray = MappedArray
+        self.size = size
+        self.lores = lores
+        self.cam = cam
+        self.lockstep = getattr(cam, "lockstep", False)
+        self.frames = 0
+        streams = {"main": {"format": "RGB888", "size": size}}
+        # lores 尺寸必須 <= main；取相同尺寸，ROI / 參數的像素座標不用換算
+        if lores: streams["lores"] = {"format": "YUV420", "size": size}
+        cfg = self.cam.create_preview_configuration(**streams)
+        if transform is not None: cfg["transform"] = transform
+        self.cam.configure(cfg)
+        self.cam.start()
+
+    def read(self, dst=None, lores_dst=None):
+        """
+        dst 為預先配置的影格槽時，直接從相機 buffer 複製進去 (不另外配置)；
+        lores_dst 給定時同一個 request 也複製 lores，此時 dst=None 表示這張不需要 main (沒人看也沒錄影)
+        """
+        if dst is None and lores_dst is None:
+            frame = self.cam.capture_array()
+            if frame is not None: self.frames += 1
+            return frame
+        request = self.cam.capture_request()
+        if request is None: return None         # 替身回放結束
+        try:
+            if dst is not None:
+                with self.MappedArray(request, "main") as m:
+                    np.copyto(dst, m.array[:, :self.size[0], :3])
+            if lores_dst is not None:
+                # 寬 320 時 stride 等於寬度，U/V 平面緊接在 Y 後面
+                with self.MappedArray(request, "lores") as m:
+                    np.copyto(lores_dst, m.array[:, :self.size[0]])
+        finally:
+            request.release()
+        self.frames += 1
+        return dst if dst is not None else lores_dst
+
+    def close(self):
+        self.cam.stop()
+
+
+class _StandInRequest:
+    def __init__(self, arrays): self.arrays = arrays
+    def release(self): self.arrays = None
+
+
+class _StandInMapped:
+    """對應 picamera2.MappedArray(request, stream)"""
+
+    def __init__(self, request, stream): self.array = request.arrays[stream]
+    def __enter__(self): return self
+    def __exit__(self, *exc): return False
+
+
+class StandInCamera:
+    """
+    Picamera2 的替身 (PicameraSource 用到的部分)：影格來自錄影檔，
+    main 為 RGB888 (BGR 記憶體順序)、lores 為 YUV420，依回放速度送出
+    """
+    MappedArray = _StandInMapped
+
+    def __init__(self, path, size, rate=RATE_NATIVE, loop=False, swap_rb=None):
+        self.video = VideoFileSource(path, size, rate=rate, loop=loop, swap_rb=swap_rb)
+        self.lockstep = self.video.lockstep
+        self.size = size
+        self.streams = None
+
+    def create_preview_configuration(self, main, lores=None):
+        return {"main": main, "lores": lores}
+
+    def configure(self, cfg):
+        w, h = cfg["main"]["size"]
+        self.main = np.empty((h, w, 3), dtype=np.uint8)
+        self.yuv = None
+        if cfg["lores"] is not None:
+            lw, lh = cfg["lores"]["size"]
+            if (lw, lh) != (w, h):
+                raise ValueError("StandInCamera: lores 尺寸需與 main 相同")
+            self.yuv = np.empty((h * 3 // 2, w), dtype=np.uint8)
+
+    def start(self): pass
+
+    def stop(self): self.video.close()
+
+    def capture_array(self, stream="main"):
+        request = self.capture_request()
+        return None if request is None else request.arrays[stream].copy()
+
+    def capture_request(self):
+        if self.video.read(self.main) is None: return None
+        arrays = {"main": self.main}
+        if self.yuv is not None: arrays["lores"] = bgr_to_i420(self.main, self.yuv)
+        return _StandInRequest(arrays)
+
+
+class VideoFileSource:
+    """離線回放：依原速 / 固定 FPS / 最快速度輸出影格，結束時回傳 None"""
+
+    def __init__(self, path, size, rate=RATE_NATIVE, loop=False, swap_rb=None):
+        self.cap = cv2.VideoCapture(path)
+        if not self.cap.isOpened():
+            raise IOError(f"無法開啟影片: {path}")
+        self.path = path
+        self.size = size
+        self.loop = loop
+        # /api/rec/toggle 錄下的 AVI 寫入時做過 RGB2BGR，回放時要換回來
+        self.swap_rb = path.lower().endswith(".avi") if swap_rb is None else swap_rb
+
+        # 最快速回放時與控制迴圈同步，一張處理完才送下一張
+        self.lockstep = rate == RATE_MAX
+        if rate == RATE_MAX:
+            self.period = 0.0
+        elif rate == RATE_NATIVE:
+            fps = self.cap.get(cv2.CAP_PROP_FPS)
+            self.period = 1.0 / fps if fps and fps > 0 else 1.0 / 30
+        else:
+            self.period = 1.0 / float(rate)
+
+        self.frames = 0
+        self._next_t = None
+        native = (int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        self._resize = native != tuple(size)
+        self._raw = None
+
+    def read(self, dst=None):
+        """dst 為預先配置的影格槽時直接解碼 / 縮放進去"""
+        direct = dst is not None and not self._resize and not self.swap_rb
+        ok, frame = self.cap.read(dst if direct else self._raw)
+        if not ok and self.loop:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self.cap.read(dst if direct else self._raw)
+        if not ok:
+            return None
+
+        if not direct:
+            self._raw = frame
+            if self._resize:
+                frame = cv2.resize(frame, self.size, dst=None if self.swap_rb else dst, interpolation=cv2.INTER_AREA)
+            if self.swap_rb:
+                frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR, dst=dst)
+
+        # 節流：以絕對時間排程，避免累積誤差
+        if self.period > 0:
+            now = time.monotonic()
+            if self._next_t is None: self._next_t = now
+            wait = self._next_t - now
+            if wait > 0: time.sleep(wait)
+            self._next_t = max(self._next_t + self.period, now - self.period)
+
+        self.frames += 1
+        return frame
+
+    def close(self):
+        self.cap.release()
+
+
+def open_frame_source(spec, size, rate=RATE_NATIVE, loop=False, swap_rb=None, lores=False):
+    """spec 為 'camera' 時開實機相機，否則視為影片路徑；影片 + lores 時用 StandInCamera 模擬雙串流相機"""
+    if spec == "camera":
+        return PicameraSource(size, lores=lores)
+    if not os.path.exists(spec):
+        raise IOError(f"找不到影片: {spec}")
+    if lores:
+        return PicameraSource(size, lores=True, cam=StandInCamera(spec, size, rate=rate, loop=loop, swap_rb=swap_rb))
+    return VideoFileSource(spec, size, rate=rate, loop=loop, swap_rb=swap_rb)
@@ -0,0 +1,100 @@
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+@  文件名：hsv_lut.py
+@  HSV 門檻查表：預先把 (量化後) BGR 顏色對應到 白線/黃線 位元，
+@  每張影格只需一次查表，取代 cvtColor + 兩次 inRange
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+
+import cv2
+import numpy as np
+
+WHITE_BIT = 0x40
+YELLOW_BIT = 0x80
+MAX_SHAPES = 4              # 全圖 + 追蹤窗各一組；roi_y / track_win 改過幾次也不會一直累積
+
+
+class HsvLutClassifier:
+    """
+    查表索引直接取 BGRA 像素的 32-bit 值 (小端序: B | G<<8 | R<<16 | A<<24)，
+    與 qmask 做 AND 同時完成「去掉 alpha」與「量化」兩件事。
+    表格大小 16MB (2^24)，實際只會用到 2^(3*bits) 個格子。
+    space="i420" 時輸入是 OpenCV 以 BT.601 限制範圍解碼的相機 lores (全範圍 sYCC)：
+    建表時把格子還原成相機原本的 YCrCb 再轉 BGR，色彩修正不花每張影格的時間。
+    """
+
+    def __init__(self, bits=6, space="bgr"):
+        if space not in ("bgr", "i420"): raise ValueError(f"unknown color space: {space}")
+        self.bits = bits
+        self.space = space
+        keep = (0xFF << (8 - bits)) & 0xFF
+        self.qmask = np.uint32(keep | (keep << 8) | (keep << 16))
+        self.table = np.zeros(1 << 24, dtype=np.uint8)
+        self.thresholds = None
+        self._shape = None
+        self._sets = {}             # (h, w) -> 該尺寸的暫存緩衝
+
+        # 量化格子的代表色取區間中心，減少門檻邊緣誤差
+        step = 1 << (8 - bits)
+        lo = np.arange(0, 256, step, dtype=np.uint32)
+        b, g, r = np.meshgrid(lo, lo, lo, indexing="ij")
+        self._index = (b | (g << 8) | (r << 16)).ravel()
+        center = (lo + step // 2).astype(np.uint8)
+        cb, cg, cr = np.meshgrid(center, center, center, indexing="ij")
+        self._cube = np.stack([cb, cg, cr], axis=-1).reshape(1, -1, 3)
+
+    def update(self, lw, uw, ly, uy):
+        """門檻有變才重建查表；回傳是否重建"""
+        key = (tuple(int(x) for x in lw), tuple(int(x) for x in uw),
+               tuple(int(x) for x in ly), tuple(int(x) for x in uy))
+        if key == self.thresholds:
+            return False
+        cube = self._cube if self.space == "bgr" else self._camera_bgr(self._cube)
+        hsv = cv2.cvtColor(cube, cv2.COLOR_BGR2HSV)
+        w = cv2.inRange(hsv, np.array(key[0], np.uint8), np.array(key[1], np.uint8))
+        y = cv2.inRange(hsv, np.array(key[2], np.uint8), np.array(key[3], np.uint8))
+        packed = (w & WHITE_BIT) | (y & YELLOW_BIT)
+        self.table[self._index] = packed.ravel()
+        self.thresholds = key
+        return True
+
+    @staticmethod
+    def _camera_bgr(decoded):
+        """OpenCV I420 解碼結果 → 相機實際顏色：反推 BT.601 限制範圍的 Y/Cb/Cr，再當全範圍 YCrCb 轉回 BGR"""
+        b, g, r = (decoded[..., i].astype(np.float32) for i in range(3))
+        y = 16 + (65.481 * r + 128.553 * g + 24.966 * b) / 255
+        cb = 128 + (-37.797 * r - 74.203 * g + 112.0 * b) / 255
+        cr = 128 + (112.0 * r - 93.786 * g - 18.214 * b) / 255
+        ycc = np.clip(np.rint(np.stack([y, cr, cb], axis=-1)), 0, 255).astype(np.uint8)
+        return cv2.cvtColor(ycc, cv2.COLOR_YCrCb2BGR)
+
+    def _alloc(self, shape):
+        """每種尺寸保留一組緩衝：追蹤窗與全圖掃描交替時只切換，不重新配置"""
+        bufs = self._sets.get(shape)
+        if bufs is None:
+            if len(self._sets) >= MAX_SHAPES: self._sets.clear()
+            h, w = shape
+            bgra = np.empty((h, w, 4), dtype=np.uint8)
+            bufs = self._sets[shape] = (bgra, bgra.view(np.uint32).reshape(h, w), np.empty((h, w), dtype=np.uint32),
+                                        np.empty((h, w), dtype=np.uint8), np.empty((h, w), dtype=np.uint8),
+                                        np.empty((h, w), dtype=np.uint8), np.empty((h, w), dtype=np.uint8))
+        self._bgra, self._pix, self._idx, self._bits, self._tmp, self.mask_w, self.mask_y = bufs
+        self._shape = shape
+
+    def classify(self, roi, out_w=None, out_y=None):
+        """roi: BGR 或 BGRA uint8 → (mask_w, mask_y)，0/255，與 inRange 輸出格式相同；可指定輸出緩衝"""
+        if roi.shape[:2] != self._shape:
+            self._alloc(roi.shape[:2])
+        if out_w is None: out_w = self.mask_w
+        if out_y is None: out_y = self.mask_y
+        pix = self._pix
+        if roi.shape[2] == 4:
+            # 已經是 BGRA (lores 解碼)：連續記憶體直接當 uint32 看
+            if roi.flags.c_contiguous: pix = roi.view(np.uint32).reshape(roi.shape[:2])
+            else: np.copyto(self._bgra, roi)
+        else:
+            cv2.cvtColor(roi, cv2.COLOR_BGR2BGRA, dst=self._bgra)
+        np.bitwise_and(pix, self.qmask, out=self._idx)
+        np.take(self.table, self._idx, out=self._bits)
+        cv2.threshold(self._bits, YELLOW_BIT - 1, 255, cv2.THRESH_BINARY, dst=out_y)
+        np.bitwise_and(self._bits, WHITE_BIT, out=self._tmp)
+        cv2.threshold(self._tmp, 0, 255, cv2.THRESH_BINARY, dst=out_w)
+        return out_w, out_y
@@ -0,0 +1,410 @@
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+@  文件名：lane_core.py
+@  循線偵測與 PID：只依賴 (ROI 影像, 參數, 時間, 上一次狀態)，
+@  control_core 與離線重播 (replay_runlog.py) 共用同一份程式，結果逐位元相同
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+
+import math
+from types import MappingProxyType
+from collections import namedtuple
+import cv2
+import numpy as np
+from buffers import MaskBuffers
+from hsv_lut import HsvLutClassifier
+from perf import NULL_CLOCK
+from params_schema import STAGE_LUT, stage_generations
+
+MORPH_KERNEL = np.ones((3,3), np.uint8)
+
+CMD_STOP = 0
+CMD_DRIVE = 1
+
+Detection = namedtuple("Detection", "mask_w mask_y mask_clean used is_white lx rx lane_center has_line cte mask_px tracked "
+                                   "near_cte far_cte curvature band_x")
+Command = namedtuple("Command", "cmd l r steering mode")
+
+
+ControlConfig = namedtuple("ControlConfig", (
+    "version params stage_gen speed_base kp kd curve_slow mask_mode max_cov y_min_px single_lane_w white_thick "
+    "white_boost roi_y lw uw ly uy band_h peak_min min_lane_w steer_gain steer_lim lost_timeout "
+    "coast_factor min_mask_px track_win track_refresh curve_bands curve_gain"))
+
+
+def _bounds(*values):
+    arr = np.array(values, dtype=np.uint8)
+    arr.flags.writeable = False
+    return arr
+
+
+def make_config(p, hh, version=0, prev=None):
+    """
+    由 PARAMS (已經過 params_schema 檢查) 建立不可變的設定快照，控制迴圈只讀參考。
+    stage_gen 記錄各處理階段最後改變的版本 (與 prev 比較)，快取依此決定是否重建
+    """
+    s_lookahead = int(p.get("s_lookahead", 0))
+    return ControlConfig(
+        version=version,
+        params=MappingProxyType(dict(p)),
+        stage_gen=MappingProxyType(stage_generations(p, version, prev)),
+        speed_base=float(p["speed_base"]),
+        kp=float(p["Kp"]), kd=float(p["Kd"]),
+        curve_slow=float(p["curve_slow"]),
+        mask_mode=int(p["mask_mode"]),
+        max_cov=float(p["mask_max_cov"]),
+        y_min_px=int(p["y_min_pixels"]),
+        single_lane_w=int(p.get("single_lane_width", 160)),
+        white_thick=int(p.get("white_line_thick", 1)),
+        white_boost=float(p.get("white_curve_boost", 1.0)),
+        roi_y=max(0, min(hh-10, int(p["roi_y_min"]) + s_lookahead)),
+        lw=_bounds(p["h_min"], p["s_min"], p["v_min"]),
+        uw=_bounds(p["h_max"], p["s_max"], p["v_max"]),
+        ly=_bounds(p["yh_min"], p["ys_min"], p["yv_min"]),
+        uy=_bounds(p["yh_max"], p["ys_max"], p["yv_max"]),
+        band_h=int(p["band_h"]),
+        peak_min=int(p["peak_min"]),
+        min_lane_w=int(p["min_lane_width"]),
+        steer_gain=float(p["steer_gain"]),
+        steer_lim=float(p["steer_limit"]),
+        lost_timeout=float(p["lost_timeout"]),
+        coast_factor=float(p["coast_factor"]),
+        min_mask_px=int(p["min_mask_px"]),
+        track_win=int(p.get("track_win", 0)),
+        track_refresh=int(p.get("track_refresh", 10)),
+        curve_bands=int(p.get("curve_bands", 1)),
+        curve_gain=float(p.get("curve_gain", 0.0)),
+    )
+
+
+Track = namedtuple("Track", "lx rx used is_white opened version age")
+
+
+def band_peaks(mask, n, peak_thr):
+    """
+    整個 ROI 由下往上切成 n 條等高的帶，一次 reshape + sum 得到 n 條欄位直方圖；
+    回傳每條帶的 (lx, rx) (-1 表示沒有) 與帶高。索引 0 是最近 (最下面) 的帶
+    """
+    h, ww = mask.shape
+    bh = h // n
+    mid = ww // 2
+    # 帶高 <= 140 列，255 * 140 放得進 uint16，比 int32 累加快
+    hist = mask[h - n * bh:].reshape(n, bh, ww).sum(axis=1, dtype=np.uint16)[::-1]
+    rows = np.arange(n)
+    lx = hist[:, :mid].argmax(axis=1)
+    rx = hist[:, mid:].argmax(axis=1) + mid
+    lx[hist[rows, lx] < peak_thr] = -1
+    rx[hist[rows, rx] < peak_thr] = -1
+    return lx, rx, bh
+
+
+class LaneFit:
+    """各帶車道中心 → 二次曲線 x(y)，y 為離 ROI 底部的距離；擬合矩陣依 (帶高, 有效帶) 快取"""
+
+    def __init__(self):
+        self.cache = {}
+
+    def fit(self, centers, valid, bh):
+        """回傳多項式係數 (高次在前)，有效帶不足兩條回傳 None"""
+        k = int(valid.sum())
+        if k < 2: return None
+        key = (bh, valid.tobytes())
+        pinv = self.cache.get(key)
+        if pinv is None:
+            y = (np.flatnonzero(valid) + 0.5) * bh
+            deg = 2 if k >= 3 else 1
+            pinv = self.cache[key] = np.linalg.pinv(np.vander(y, deg + 1))
+        return pinv @ centers[valid]
+
+
+class LaneDetector:
+    """
+    ROI → 遮罩 → 欄位直方圖 → 車道中心；記住上一次的中心與車道寬。
+    track_win > 0 時進入追蹤模式：只處理上一張左右峰值附近的窄窗 (直方圖帶 + 型態學邊界)，
+    遮罩選擇沿用上次全圖掃描的結果；峰值不足/落在窗邊/像素太少、參數改變或每 track_refresh 張就退回全圖掃描
+    """
+
+    def __init__(self, width, use_lut=True, space="bgr"):
+        self.width = width
+        # "i420"：輸入為相機 lores 解碼的 BGRA，色彩修正在查表裡，所以一定要用查表
+        if space != "bgr" and not use_lut: raise ValueError("lores input requires the HSV lookup table")
+        self.bufs = MaskBuffers()
+        self.wbufs = MaskBuffers()      # 追蹤窗用
+        self.classifier = HsvLutClassifier(space=space) if use_lut else None
+        self.lut_gen = -1
+        self.last_center = width // 2
+        self.last_width = 160
+        self.track = None
+        self.lane_fit = LaneFit()
+
+    def detect(self, roi, cfg, clock=NULL_CLOCK):
+        bufs = self.bufs.ensure(roi.shape[:2])
+
+        # 查表只在 HSV 門檻改變 (lut 階段) 時重建
+        if self.classifier is not None and cfg.stage_gen[STAGE_LUT] != self.lut_gen:
+            self.classifier.update(cfg.lw, cfg.uw, cfg.ly, cfg.uy)
+            self.lut_gen = cfg.stage_gen[STAGE_LUT]
+        clock.lap("params")
+
+        t = self.track
+        # 多帶擬合需要整張遮罩，curve_bands > 1 時不做追蹤窗
+        if cfg.track_win > 0 and cfg.curve_bands <= 1 and t is not None and t.version == cfg.version and t.age < cfg.track_refresh:
+            det = self._detect_windows(roi, cfg, bufs, t)
+            clock.lap("track")
+            if det is not None:
+                self.track = t._replace(lx=det.lx, rx=det.rx, age=t.age + 1)
+                return det
+        det = self._detect_full(roi, cfg, bufs, clock)
+        return det
+
+    def _classify(self, roi, cfg, bufs):
+        if self.classifier is not None:
+            return self.classifier.classify(roi, bufs.mask_w, bufs.mask_y)
+        hsv = cv2.cvtColor(roi, cv2.COLOR_BGR2HSV, dst=bufs.hsv)
+        return cv2.inRange(hsv, cfg.lw, cfg.uw, dst=bufs.mask_w), cv2.inRange(hsv, cfg.ly, cfg.uy, dst=bufs.mask_y)
+
+    def _detect_full(self, roi, cfg, bufs, clock):
+        ww = self.width
+        if self.classifier is not None:
+            mask_w, mask_y = self.classifier.classify(roi)
+            clock.lap("classify")
+        else:
+            hsv = cv2.cvtColor(roi, cv2.COLOR_BGR2HSV, dst=bufs.hsv)
+            clock.lap("hsv")
+            mask_w = cv2.inRange(hsv, cfg.lw, cfg.uw, dst=bufs.mask_w)
+            mask_y = cv2.inRange(hsv, cfg.ly, cfg.uy, dst=bufs.mask_y)
+            clock.lap("inrange")
+
+        # 遮罩只有 0/255，countNonZero 等同 sum()//255 但不配置記憶體
+        w_px = cv2.countNonZero(mask_w); y_px = cv2.countNonZero(mask_y)
+        roi_px = mask_w.shape[0] * mask_w.shape[1]
+        max_cov = cfg.max_cov; y_min_px = cfg.y_min_px
+        mask_mode = cfg.mask_mode
+        used = 0; is_white = False
+
+        if mask_mode == 1: mask = mask_w; used = 1; is_white = True
+        elif mask_mode == 2: mask = mask_y; used = 2
+        elif mask_mode == 3: mask = cv2.bitwise_or(mask_w, mask_y, dst=bufs.mask_or); used = 3
+        else:
+            if (w_px/max(1,roi_px) > max_cov and y_px >= y_min_px) or (y_px >= y_min_px and y_px < w_px):
+                mask = mask_y; used = 2
+            else:
+                mask = mask_w; used = 1; is_white = True
+
+        if cv2.countNonZero(mask)/max(1,roi_px) > max_cov and used!=2 and y_px>=y_min_px:
+            mask = mask_y; used = 2
+
+        if is_white and cfg.white_thick > 0:
+            mask = cv2.dilate(mask, MORPH_KERNEL, dst=bufs.dilated, iterations=cfg.white_thick)
+
+        mask_clean = mask
+        opened = cv2.countNonZero(mask) > 1200
+        if opened:
+            mask_clean = cv2.morphologyEx(mask_clean, cv2.MORPH_OPEN, MORPH_KERNEL, dst=bufs.opened, iterations=1)
+        mask_clean = cv2.morphologyEx(mask_clean, cv2.MORPH_CLOSE, MORPH_KERNEL, dst=bufs.clean, iterations=1)
+        clock.lap("morph")
+
+        # 欄位直方圖：0/255 遮罩的欄總和 = 像素數 * 255，門檻同步乘 255
+        band = mask_clean[-cfg.band_h:, :]
+        hist = np.sum(band, axis=0, dtype=np.int32, out=bufs.colsum)
+        peak_thr = cfg.peak_min * 255
+
+        mid = ww // 2
+        lx = None; rx = None
+        if hist[:mid].max() >= peak_thr: lx = int(np.argmax(hist[:mid]))
+        if hist[mid:].max() >= peak_thr: rx = int(np.argmax(hist[mid:]) + mid)
+
+        bands = band_peaks(mask_clean, cfg.curve_bands, peak_thr) if cfg.curve_bands > 1 else None
+        det = self._lane(mask_w, mask_y, mask_clean, used, is_white, lx, rx, cfg, cv2.countNonZero(mask_clean), False,
+                         bands)
+        # 有找到線才建立追蹤窗；失線期間一律全圖掃描
+        self.track = Track(lx, rx, used, is_white, opened, cfg.version, 0) if det.has_line else None
+        clock.lap("hist")
+        return det
+
+    def _detect_windows(self, roi, cfg, bufs, t):
+        """只處理追蹤窗；信心不足回傳 None (改做全圖掃描)"""
+        h, ww = roi.shape[:2]
+        mid = ww // 2
+        win = cfg.track_win
+        band = min(cfg.band_h, h)
+        # 每次型態學運算影響 1px：dilate (white_thick 次) + open + close，窗外多留這麼多邊界
+        pad = 4 + (cfg.white_thick if t.is_white else 0)
+        wo = 2 * (win + pad) + 1
+        if wo >= mid: return None
+        y0 = max(0, h - band - pad)
+        wb = self.wbufs.ensure((h - y0, wo))
+        peak_thr = cfg.peak_min * 255
+
+        # 除錯畫面用的全尺寸遮罩：窗外清空
+        bufs.mask_w.fill(0); bufs.mask_y.fill(0); bufs.clean.fill(0)
+        found = {}
+        px = 0
+        for side, x in (("l", t.lx), ("r", t.rx)):
+            if x is None: continue
+            half0, half1 = (0, mid) if side == "l" else (mid, ww)
+            x0 = min(max(0, x - win - pad), ww - wo); x1 = x0 + wo
+            mask_w, mask_y = self._classify(roi[y0:h, x0:x1], cfg, wb)
+            if t.used == 1: mask = mask_w
+            elif t.used == 2: mask = mask_y
+            else: mask = cv2.bitwise_or(mask_w, mask_y, dst=wb.mask_or)
+            if t.is_white and cfg.white_thick > 0:
+                mask = cv2.dilate(mask, MORPH_KERNEL, dst=wb.dilated, iterations=cfg.white_thick)
+            if t.opened:
+                mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, MORPH_KERNEL, dst=wb.opened, iterations=1)
+            clean = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, MORPH_KERNEL, dst=wb.clean, iterations=1)
+
+            # 只採信窗內部 (扣掉邊界) 且在同一半邊的欄
+            i0 = max(x - win, half0, x0 + pad if x0 > 0 else 0)
+            i1 = min(x + win + 1, half1, x1 - pad if x1 < ww else ww)
+            if i1 <= i0: return None
+            hist = np.sum(clean[-band:, i0-x0:i1-x0], axis=0, dtype=np.int32, out=wb.colsum[:i1-i0])
+            if hist.max() < peak_thr: return None
+            p = int(np.argmax(hist))
+            # 峰值貼在窗邊：真正的峰可能在窗外
+            if (p == 0 and i0 > half0) or (p == i1 - i0 - 1 and i1 < half1): return None
+            found[side] = p + i0
+            px += cv2.countNonZero(clean[:, i0-x0:i1-x0])
+            bufs.mask_w[y0:h, i0:i1] = mask_w[:, i0-x0:i1-x0]
+            bufs.mask_y[y0:h, i0:i1] = mask_y[:, i0-x0:i1-x0]
+            bufs.clean[y0:h, i0:i1] = clean[:, i0-x0:i1-x0]
+        if px < cfg.min_mask_px: return None
+        return self._lane(bufs.mask_w, bufs.mask_y, bufs.clean, t.used, t.is_white,
+                          found.get("l"), found.get("r"), cfg, px, True)
+
+    def _lane(self, mask_w, mask_y, mask_clean, used, is_white, lx, rx, cfg, mask_px, tracked, bands=None):
+        ww = self.width
+        mid = ww // 2
+        has_line = False
+        lane_center = self.last_center
+        current_lane_width = self.last_width
+
+        if used != 0:
+            if lx is not None and rx is not None and (rx - lx) > cfg.min_lane_w:
+                lane_center = (lx + rx) // 2
+                current_lane_width = rx - lx
+                has_line = True
+            elif lx is not None:
+                lane_center = lx + (current_lane_width // 2)
+                has_line = True
+            elif rx is not None:
+                lane_center = rx - (current_lane_width // 2)
+                has_line = True
+
+        if has_line:
+            lane_center = int(max(0, min(ww-1, lane_center)))
+            self.last_width = int(current_lane_width)
+            self.last_center = lane_center
+
+        cte = float(mid - lane_center) if has_line else 0.0
+        near = far = float(mid - lane_center) if has_line else 0.0
+        curv = 0.0
+        band_x = None
+        if has_line and bands is not None:
+            near, far, curv, band_x = self._curve(bands, current_lane_width, cfg, near)
+        if is_white and abs(cte) > 10: cte *= cfg.white_boost
+        return Detection(mask_w, mask_y, mask_clean, used, is_white, lx, rx, lane_center, has_line,
+                         cte, mask_px, tracked, near, far, curv, band_x)
+
+    def _curve(self, bands, lane_w, cfg, cte):
+        """各帶中心 (與單帶相同規則) 擬合後，取最下/最上帶的偏移與曲率 d²x/dy²；擬合不了沿用單帶 CTE"""
+        blx, brx, bh = bands
+        mid = self.width // 2
+        both = (blx >= 0) & (brx >= 0) & ((brx - blx) > cfg.min_lane_w)
+        centers = np.where(both, (blx + brx) // 2,
+                           np.where(blx >= 0, blx + lane_w // 2, np.where(brx >= 0, brx - lane_w // 2, -1)))
+        valid = (blx >= 0) | (brx >= 0)
+        coef = self.lane_fit.fit(centers.astype(np.float64), valid, bh)
+        band_x = np.where(valid, centers, -1)
+        if coef is None: return cte, cte, 0.0, band_x
+        y_far = (len(blx) - 0.5) * bh
+        near = float(mid - np.polyval(coef, 0.5 * bh))
+        far = float(mid - np.polyval(coef, y_far))
+        curv = float(2.0 * coef[0]) if len(coef) == 3 else 0.0
+        return near, far, curv, band_x
+
+    # ---- 狀態存取 (run log 記錄處理前的狀態) ----
+    def state(self):
+        t = self.track
+        if t is None:
+            return self.last_center, self.last_width, -1, -1, 0, 0, 0, 0
+        return (self.last_center, self.last_width, -1 if t.lx is None else t.lx, -1 if t.rx is None else t.rx,
+                t.used, int(t.is_white) | (int(t.opened) << 1), t.version, t.age)
+
+    def restore(self, center, width, t_lx, t_rx, t_used, t_flags, t_version, t_age):
+        self.last_center = int(center); self.last_width = int(width)
+        if t_used == 0:
+            self.track = None
+        else:
+            self.track = Track(None if t_lx < 0 else int(t_lx), None if t_rx < 0 else int(t_rx), int(t_used),
+                               bool(t_flags & 1), bool(t_flags & 2), int(t_version), int(t_age))
+
+
+class LaneController:
+    """PD 轉向 + 失線滑行；now 由呼叫端給 (即時用 time.time()，重播用記錄的時間)"""
+
+    def __init__(self):
+        self.pid_error_last = 0.0
+        self.first_lock = True
+        self.lost_start = None
+        self.last_steer = 0.0
+        self.last_lane_ok = False
+
+    def step(self, det, cfg, mode, now):
+        if mode != "auto":
+            self.pid_error_last = 0.0; self.first_lock = True
+            return Command(CMD_STOP, 0, 0, 0, mode)
+
+        speed_base = cfg.speed_base; steer_lim = cfg.steer_lim
+        has_line = det.has_line
+        if has_line and det.mask_px < cfg.min_mask_px: has_line = False
+
+        if not has_line:
+            self.first_lock = True
+            if self.lost_start is None: self.lost_start = now
+            if self.last_lane_ok and (now - self.lost_start) <= cfg.lost_timeout:
+                base = max(0, min(100, speed_base * cfg.coast_factor))
+                st = max(-steer_lim, min(steer_lim, self.last_steer))
+                l = int(max(0, min(100, base - st)))
+                r = int(max(0, min(100, base + st)))
+                return Command(CMD_DRIVE, l, r, st, mode)
+            self.last_lane_ok = False
+            return Command(CMD_STOP, 0, 0, 0, "stop")
+
+        err = det.cte
+        # 前瞻：往最遠帶的偏移靠 (curve_gain=0 時與單帶相同)
+        if cfg.curve_gain > 0.0: err += cfg.curve_gain * (det.far_cte - det.near_cte)
+        if abs(err) < 2.0: err = 0.0
+
+        if self.first_lock:
+            self.pid_error_last = err
+            self.first_lock = False
+
+        derr = err - self.pid_error_last
+
+        raw_st = (cfg.kp * err) + (cfg.kd * derr)
+        self.pid_error_last = err
+
+        raw_st *= cfg.steer_gain
+        raw_st = max(-steer_lim, min(steer_lim, raw_st))
+
+        st = (0.6 * raw_st) + (0.4 * self.last_steer)
+
+        sf = 1.0 - (cfg.curve_slow * min(1.0, abs(st)/steer_lim))
+        base = max(0.0, min(100.0, speed_base * sf))
+
+        l = int(max(0, min(100, base - st)))
+        r = int(max(0, min(100, base + st)))
+
+        self.lost_start = None; self.last_lane_ok = True; self.last_steer = st
+        return Command(CMD_DRIVE, l, r, st, mode)
+
+    # ---- 狀態存取 (run log 每筆記錄處理前的狀態，重播可從任一筆開始) ----
+    def state(self):
+        lost = math.nan if self.lost_start is None else self.lost_start
+        return self.pid_error_last, self.last_steer, lost, int(self.first_lock) | (int(self.last_lane_ok) << 1)
+
+    def restore(self, err_last, last_steer, lost_start, flags):
+        self.pid_error_last = float(err_last)
+        self.last_steer = float(last_steer)
+        self.lost_start = None if math.isnan(lost_start) else float(lost_start)
+        self.first_lock = bool(flags & 1)
+        self.last_lane_ok = bool(flags & 2)
@@ -1,22 +1,44 @@
 import cv2
 import time
-import numpy as np
 import threading
-import datetime
-import libcamera
 import traceback
 import sys
 import os
 import json
-from picamera2 import Picamera2
+import argparse
+import functools
 from flask import Flask, Response, render_template_string, jsonify, request
+from frame_source import open_frame_source, LoresRoi, RATE_NATIVE
+from perf import PerfStats, StageClock
+from buffers import FrameRing
+from lane_core import LaneDetector, LaneController, make_config, CMD_DRIVE
+from runlog import RunLogWriter, MODES
+from actuator import Actuator
+from recorder import RecordingPipeline, POLICIES, DROP_OLDEST
+from streaming import ViewRegistry, MjpegBroadcaster, ViewerLink, limit_send_buffer
+from telemetry import TelemetryHub, EventStream, PerfSummary, event_stream, clamp_hz, LIVE_FIELDS
+from params_schema import SCHEMA, coerce_all, as_json as schema_json
+from vision_proc import (VisionClient, SharedViews, SharedFramePublisher, SharedTelemetry,
+                         SharedTelemetryReader, FramePump, RemotePerf, serve)
+from async_web import AsyncWebServer, AsyncFrameFeed
+from mask_stream import MaskLink, MaskEncoder
+from markupsafe import Markup
 
 # ------------------------------------------------------------------
-#  LOBOROBOT 初始化
+#  LOBOROBOT 初始化 (於 __main__ 建立；離線回放時改用 SimRobot)
 # ------------------------------------------------------------------
-from LOBOROBOT2 import LOBOROBOT
-clbrobot = LOBOROBOT()
-clbrobot.t_stop(0.1)
+clbrobot = None
+actuator = None     # 馬達執行緒，獨占 clbrobot
+
+def build_robot(sim=False):
+    if sim:
+        from sim_robot import SimRobot
+        robot = SimRobot()
+    else:
+        from LOBOROBOT2 import LOBOROBOT
+        robot = LOBOROBOT()
+    robot.t_stop(0.1)
+    return robot
 
 # ------------------------------------------------------------------
 #  全域變數
@@ -28,16 +50,29 @@ angle_tilt = 15
 
 running = True
 mode = "stop"
-latest_frame = None
-latest_frame_time = 0.0
-processed_frame = None 
-
-is_recording = False
-video_writer = None
+ring = FrameRing((hh, ww, 3), slots=4)    # capture → control 影格交接 (不複製)
+processed_count = 0
+last_processed_t = 0.0
+frame_source = None
+headless = False
+
+recorder = None     # 背景錄影 (RecordingPipeline)
+runlog = None       # 執行紀錄 (RunLogWriter)，--runlog 時開啟
+vision = None       # --procs：網頁行程這邊的視覺行程代理 (VisionClient)；視覺行程與 threaded 模式為 None
 SETTINGS_FILE = "user_params.json" 
 
-frame_lock = threading.Lock()
-param_lock = threading.Lock()
+param_lock = threading.Lock()  # 只保護寫入端 (PARAMS 修改 + 發佈 config)；控制迴圈不拿
+USE_HSV_LUT = True          # False: 改回 cvtColor + inRange 原始路徑
+LORES = False               # True: 控制迴圈改吃相機 lores YUV420 串流 (ring.aux)，main 只給錄影 / 網頁
+
+# 各階段延遲 (capture: 相機取像, wakeup: 影格送達到控制迴圈醒來, ... motor: I2C 寫入, total: 單次迴圈)
+PERF_STAGES = ["capture", "wakeup", "lores", "params", "hsv", "track", "inrange", "classify", "morph", "hist", "viz", "rec", "pid", "motor", "total", "encode", "grid", "pack", "deflate", "actuate", "rec_write", "runlog"]
+perf = PerfStats(PERF_STAGES)
+views = ViewRegistry()      # /live_view 觀看者，沒人看的除錯畫面不產生
+broadcaster = MjpegBroadcaster(perf=perf, grid_shape=(hh, ww, 3))   # 每張影格每種畫面只編碼一次
+masks = MaskEncoder(broadcaster, perf)     # /api/mask_stream：跟得上的觀看者共用同一則差異
+telemetry = TelemetryHub()  # 即時遙測 (cte/steering/fps...)，控制迴圈寫入不拿 param_lock
+TELEMETRY_HZ = 10.0         # /api/stream 預設推播頻率
 
 # ------------------------------------------------------------------
 #  參數設定 (V4 完整版核心)
@@ -81,13 +116,57 @@ PARAMS = {
     "white_curve_boost": 1.0,
     "white_line_thick": 1,
 
+    # --- [追蹤窗] 0 = 關閉 (每張全圖掃描) ---
+    "track_win": 0,
+    "track_refresh": 10,
+
+    # --- [多帶前瞻] 1 = 只用最下面一條帶 ---
+    "curve_bands": 1,
+    "curve_gain": 0.0,
+
     # --- 遙測數據 ---
     "cte": 0.0, "fps": 0, "mask_used": 0, "steering": 0.0,
     "mask_px": 0, "mask_w_px": 0, "mask_y_px": 0
 }
 
-LANE_LAST_CENTER = ww // 2
-LANE_LAST_WIDTH = 160
+config = make_config(PARAMS, hh)   # 目前生效的設定快照 (不可變)，改參數時整個替換
+
+def apply_params(updates):
+    """
+    依 params_schema 檢查轉型後套用並發佈新的設定快照。
+    回傳 None 或 (錯誤訊息, HTTP 狀態)：不合法 400，--procs 時視覺行程沒回應 503；失敗時 PARAMS 不變
+    """
+    try:
+        updates = coerce_all(updates)
+    except ValueError as e:
+        return str(e), 400
+    if vision is None:
+        _publish_params(updates)
+        return None
+    # --procs：視覺行程的設定是正本。先讓它套用 (不拿 param_lock)，成功後照它回傳的版本與參數更新網頁行程的副本
+    try:
+        version, params = vision.call("apply_params", updates)
+    except (RuntimeError, TimeoutError, OSError) as e:
+        return f"vision process: {e}", 503
+    _publish_params(params, version)
+    return None
+
+def _publish_params(updates, version=None):
+    """updates 已檢查過；version 給定時 (視覺行程的結果) 只接受比目前新的，同時送的請求晚回來不會蓋掉新的"""
+    global config
+    with param_lock:
+        if version is not None and version <= config.version: return
+        candidate = dict(PARAMS)
+        candidate.update(updates)
+        new = make_config(candidate, hh, config.version + 1 if version is None else version, prev=config)
+        PARAMS.update(updates)
+        config = new        # 單一參考替換，控制迴圈下一張影格就用新的
+
+def op_apply_params(updates):
+    """視覺行程端：套用後回傳 (版本, 參數)，網頁行程的副本照這份更新，兩邊的 params_version 一致"""
+    err = apply_params(updates)
+    if err: raise ValueError(err[0])
+    return config.version, {k: PARAMS[k] for k in SCHEMA if k in PARAMS}
 
 # ------------------------------------------------------------------
 #  【基礎設定】(Factory Defaults) - 您的安全網
@@ -360,7 +439,7 @@ INDEX_HTML = r"""
             <button class="btn btn-factory-w" onclick="setPreset('factory', 'school')">🏭 基礎設定 (白線)</button>
         </div>
         <div class="btn-row">
-            <button class="btn btn-rec" onclick="post('/api/rec/toggle')">錄影</button>
+            <button class="btn btn-rec" onclick="recToggle()">錄影</button>
             <button class="btn btn-off" onclick="shutdown()">關機</button>
         </div>
     </div>
@@ -374,11 +453,14 @@ INDEX_HTML = r"""
                 <div class="rec-dot"></div> REC
             </div>
             <img id="video" class="cam-frame" src="/live_view?m=cv">
+            <canvas id="maskcv" class="cam-frame" style="display:none; image-rendering:pixelated;"></canvas>
             <div class="capsule-row">
                 <button class="btn-view active" onclick="src('cv',this)">原始畫面</button>
                 <button class="btn-view" onclick="src('mask',this)">遮罩</button>
                 <button class="btn-view" onclick="src('maskw',this)">白線</button>
                 <button class="btn-view" onclick="src('masky',this)">黃線</button>
+                <button class="btn-view" onclick="src('grid',this)">四格</button>
+                <button class="btn-view btn-bits" onclick="bitsToggle(this)" title="遮罩改用 1 bit/px 差異串流畫在 canvas">位元</button>
             </div>
         </div>
     </div>
@@ -389,37 +471,41 @@ INDEX_HTML = r"""
             
             <div class="param-section">
                 <div style="font-size:10px; color:#888;">POWER & PID</div>
-                <div class="slider-row"><span class="slider-lbl">Speed</span><input id="in-speed_base" type="range" max="80" value="50" oninput="upd('speed_base',this.value)"><span class="slider-val" id="v-speed_base">50</span></div>
-                <div class="slider-row"><span class="slider-lbl">Kp (Turn)</span><input id="in-Kp" type="range" max="2" step="0.01" value="0.45" oninput="upd('Kp',this.value)"><span class="slider-val" id="v-Kp">0.45</span></div>
-                <div class="slider-row"><span class="slider-lbl">Kd (Stable)</span><input id="in-Kd" type="range" max="2" step="0.01" value="0.30" oninput="upd('Kd',this.value)"><span class="slider-val" id="v-Kd">0.30</span></div>
-                <div class="slider-row"><span class="slider-lbl">CurveSlow</span><input id="in-curve_slow" type="range" max="0.9" step="0.05" value="0.45" oninput="upd('curve_slow',this.value)"><span class="slider-val" id="v-curve_slow">0.45</span></div>
+                <div class="slider-row"><span class="slider-lbl">Speed</span><input id="in-speed_base" {{ attrs("speed_base") }} type="range" oninput="upd('speed_base',this.value)"><span class="slider-val" id="v-speed_base">50</span></div>
+                <div class="slider-row"><span class="slider-lbl">Kp (Turn)</span><input id="in-Kp" {{ attrs("Kp") }} type="range" oninput="upd('Kp',this.value)"><span class="slider-val" id="v-Kp">0.45</span></div>
+                <div class="slider-row"><span class="slider-lbl">Kd (Stable)</span><input id="in-Kd" {{ attrs("Kd") }} type="range" oninput="upd('Kd',this.value)"><span class="slider-val" id="v-Kd">0.30</span></div>
+                <div class="slider-row"><span class="slider-lbl">CurveSlow</span><input id="in-curve_slow" {{ attrs("curve_slow") }} type="range" oninput="upd('curve_slow',this.value)"><span class="slider-val" id="v-curve_slow">0.45</span></div>
             </div>
 
             <div class="param-section" style="background:#e8f6f3;">
                 <div style="font-size:10px; color:var(--xmas-green);">S-CURVE & OPTION</div>
-                <div class="slider-row"><span class="slider-lbl">LookAhead</span><input id="in-s_lookahead" type="range" min="-20" max="40" step="1" value="0" oninput="upd('s_lookahead',this.value)"><span class="slider-val" id="v-s_lookahead">0</span></div>
-                <div class="slider-row"><span class="slider-lbl">LaneWidth</span><input id="in-single_lane_width" type="range" min="80" max="250" step="5" value="160" oninput="upd('single_lane_width',this.value)"><span class="slider-val" id="v-single_lane_width">160</span></div>
-                <div class="slider-row"><span class="slider-lbl">Boost</span><input id="in-white_curve_boost" type="range" min="1.0" max="2.0" step="0.1" value="1.0" oninput="upd('white_curve_boost',this.value)"><span class="slider-val" id="v-white_curve_boost">1.0</span></div>
+                <div class="slider-row"><span class="slider-lbl">LookAhead</span><input id="in-s_lookahead" {{ attrs("s_lookahead") }} type="range" oninput="upd('s_lookahead',this.value)"><span class="slider-val" id="v-s_lookahead">0</span></div>
+                <div class="slider-row"><span class="slider-lbl">LaneWidth</span><input id="in-single_lane_width" {{ attrs("single_lane_width") }} type="range" oninput="upd('single_lane_width',this.value)"><span class="slider-val" id="v-single_lane_width">160</span></div>
+                <div class="slider-row"><span class="slider-lbl">Boost</span><input id="in-white_curve_boost" {{ attrs("white_curve_boost") }} type="range" oninput="upd('white_curve_boost',this.value)"><span class="slider-val" id="v-white_curve_boost">1.0</span></div>
+                <div class="slider-row"><span class="slider-lbl">TrackWin</span><input id="in-track_win" {{ attrs("track_win") }} type="range" oninput="upd('track_win',this.value)"><span class="slider-val" id="v-track_win">0</span></div>
+                <div class="slider-row"><span class="slider-lbl">Refresh</span><input id="in-track_refresh" {{ attrs("track_refresh") }} type="range" oninput="upd('track_refresh',this.value)"><span class="slider-val" id="v-track_refresh">10</span></div>
+                <div class="slider-row"><span class="slider-lbl">Bands</span><input id="in-curve_bands" {{ attrs("curve_bands") }} type="range" oninput="upd('curve_bands',this.value)"><span class="slider-val" id="v-curve_bands">1</span></div>
+                <div class="slider-row"><span class="slider-lbl">CurveGain</span><input id="in-curve_gain" {{ attrs("curve_gain") }} type="range" oninput="upd('curve_gain',this.value)"><span class="slider-val" id="v-curve_gain">0.0</span></div>
             </div>
 
             <div class="param-section">
                 <div style="font-size:10px; color:#888;">LANE LOGIC (V4)</div>
-                <div class="slider-row"><span class="slider-lbl">MaskMode</span><input id="in-mask_mode" type="range" max="3" value="0" oninput="upd('mask_mode',this.value)"><span class="slider-val" id="v-mask_mode">0</span></div>
-                <div class="slider-row"><span class="slider-lbl">MaxCov</span><input id="in-mask_max_cov" type="range" min="0.1" max="1.0" step="0.05" value="0.65" oninput="upd('mask_max_cov',this.value)"><span class="slider-val" id="v-mask_max_cov">0.65</span></div>
-                <div class="slider-row"><span class="slider-lbl">MaskPx</span><input id="in-min_mask_px" type="range" max="1000" value="250" oninput="upd('min_mask_px',this.value)"><span class="slider-val" id="v-min_mask_px">250</span></div>
-                <div class="slider-row"><span class="slider-lbl">YelPx</span><input id="in-y_min_pixels" type="range" max="1000" value="250" oninput="upd('y_min_pixels',this.value)"><span class="slider-val" id="v-y_min_pixels">250</span></div>
-                <div class="slider-row"><span class="slider-lbl">ROI Min</span><input id="in-roi_y_min" type="range" max="200" value="60" oninput="upd('roi_y_min',this.value)"><span class="slider-val" id="v-roi_y_min">60</span></div>
-                <div class="slider-row"><span class="slider-lbl">BandH</span><input id="in-band_h" type="range" max="140" value="90" oninput="upd('band_h',this.value)"><span class="slider-val" id="v-band_h">90</span></div>
-                <div class="slider-row"><span class="slider-lbl">PeakMin</span><input id="in-peak_min" type="range" max="50" value="6" oninput="upd('peak_min',this.value)"><span class="slider-val" id="v-peak_min">6</span></div>
-                <div class="slider-row"><span class="slider-lbl">LaneWMin</span><input id="in-min_lane_width" type="range" max="100" value="40" oninput="upd('min_lane_width',this.value)"><span class="slider-val" id="v-min_lane_width">40</span></div>
+                <div class="slider-row"><span class="slider-lbl">MaskMode</span><input id="in-mask_mode" {{ attrs("mask_mode") }} type="range" oninput="upd('mask_mode',this.value)"><span class="slider-val" id="v-mask_mode">0</span></div>
+                <div class="slider-row"><span class="slider-lbl">MaxCov</span><input id="in-mask_max_cov" {{ attrs("mask_max_cov") }} type="range" oninput="upd('mask_max_cov',this.value)"><span class="slider-val" id="v-mask_max_cov">0.65</span></div>
+                <div class="slider-row"><span class="slider-lbl">MaskPx</span><input id="in-min_mask_px" {{ attrs("min_mask_px") }} type="range" oninput="upd('min_mask_px',this.value)"><span class="slider-val" id="v-min_mask_px">250</span></div>
+                <div class="slider-row"><span class="slider-lbl">YelPx</span><input id="in-y_min_pixels" {{ attrs("y_min_pixels") }} type="range" oninput="upd('y_min_pixels',this.value)"><span class="slider-val" id="v-y_min_pixels">250</span></div>
+                <div class="slider-row"><span class="slider-lbl">ROI Min</span><input id="in-roi_y_min" {{ attrs("roi_y_min") }} type="range" oninput="upd('roi_y_min',this.value)"><span class="slider-val" id="v-roi_y_min">60</span></div>
+                <div class="slider-row"><span class="slider-lbl">BandH</span><input id="in-band_h" {{ attrs("band_h") }} type="range" oninput="upd('band_h',this.value)"><span class="slider-val" id="v-band_h">90</span></div>
+                <div class="slider-row"><span class="slider-lbl">PeakMin</span><input id="in-peak_min" {{ attrs("peak_min") }} type="range" oninput="upd('peak_min',this.value)"><span class="slider-val" id="v-peak_min">6</span></div>
+                <div class="slider-row"><span class="slider-lbl">LaneWMin</span><input id="in-min_lane_width" {{ attrs("min_lane_width") }} type="range" oninput="upd('min_lane_width',this.value)"><span class="slider-val" id="v-min_lane_width">40</span></div>
             </div>
 
             <div class="param-section">
                 <div style="font-size:10px; color:#888;">STEERING (V4)</div>
-                <div class="slider-row"><span class="slider-lbl">Gain</span><input id="in-steer_gain" type="range" max="5.0" step="0.1" value="2.4" oninput="upd('steer_gain',this.value)"><span class="slider-val" id="v-steer_gain">2.4</span></div>
-                <div class="slider-row"><span class="slider-lbl">Limit</span><input id="in-steer_limit" type="range" max="100" value="70" oninput="upd('steer_limit',this.value)"><span class="slider-val" id="v-steer_limit">70</span></div>
-                <div class="slider-row"><span class="slider-lbl">Timeout</span><input id="in-lost_timeout" type="range" max="2.0" step="0.1" value="0.7" oninput="upd('lost_timeout',this.value)"><span class="slider-val" id="v-lost_timeout">0.7</span></div>
-                <div class="slider-row"><span class="slider-lbl">Coast</span><input id="in-coast_factor" type="range" max="1.0" step="0.05" value="0.55" oninput="upd('coast_factor',this.value)"><span class="slider-val" id="v-coast_factor">0.55</span></div>
+                <div class="slider-row"><span class="slider-lbl">Gain</span><input id="in-steer_gain" {{ attrs("steer_gain") }} type="range" oninput="upd('steer_gain',this.value)"><span class="slider-val" id="v-steer_gain">2.4</span></div>
+                <div class="slider-row"><span class="slider-lbl">Limit</span><input id="in-steer_limit" {{ attrs("steer_limit") }} type="range" oninput="upd('steer_limit',this.value)"><span class="slider-val" id="v-steer_limit">70</span></div>
+                <div class="slider-row"><span class="slider-lbl">Timeout</span><input id="in-lost_timeout" {{ attrs("lost_timeout") }} type="range" oninput="upd('lost_timeout',this.value)"><span class="slider-val" id="v-lost_timeout">0.7</span></div>
+                <div class="slider-row"><span class="slider-lbl">Coast</span><input id="in-coast_factor" {{ attrs("coast_factor") }} type="range" oninput="upd('coast_factor',this.value)"><span class="slider-val" id="v-coast_factor">0.55</span></div>
             </div>
 
             <div class="param-section">
@@ -427,22 +513,22 @@ INDEX_HTML = r"""
                 
                 <div class="hsv-row">
                     <span class="hsv-label">H 色相</span>
-                    <input id="in-h_min" class="hsv-slider" type="range" max="180" value="0" oninput="upd('h_min',this.value)">
-                    <input id="in-h_max" class="hsv-slider" type="range" max="180" value="180" oninput="upd('h_max',this.value)">
+                    <input id="in-h_min" {{ attrs("h_min") }} class="hsv-slider" type="range" oninput="upd('h_min',this.value)">
+                    <input id="in-h_max" {{ attrs("h_max") }} class="hsv-slider" type="range" oninput="upd('h_max',this.value)">
                     <span class="hsv-val"><span id="v-h_min">0</span>/<span id="v-h_max">180</span></span>
                 </div>
                 
                 <div class="hsv-row">
                     <span class="hsv-label">S 飽和</span>
-                    <input id="in-s_min" class="hsv-slider" type="range" max="255" value="0" oninput="upd('s_min',this.value)">
-                    <input id="in-s_max" class="hsv-slider" type="range" max="255" value="60" oninput="upd('s_max',this.value)">
+                    <input id="in-s_min" {{ attrs("s_min") }} class="hsv-slider" type="range" oninput="upd('s_min',this.value)">
+                    <input id="in-s_max" {{ attrs("s_max") }} class="hsv-slider" type="range" oninput="upd('s_max',this.value)">
                     <span class="hsv-val"><span id="v-s_min">0</span>/<span id="v-s_max">60</span></span>
                 </div>
 
                 <div class="hsv-row">
                     <span class="hsv-label">V 明度</span>
-                    <input id="in-v_min" class="hsv-slider" type="range" max="255" value="180" oninput="upd('v_min',this.value)">
-                    <input id="in-v_max" class="hsv-slider" type="range" max="255" value="255" oninput="upd('v_max',this.value)">
+                    <input id="in-v_min" {{ attrs("v_min") }} class="hsv-slider" type="range" oninput="upd('v_min',this.value)">
+                    <input id="in-v_max" {{ attrs("v_max") }} class="hsv-slider" type="range" oninput="upd('v_max',this.value)">
                     <span class="hsv-val"><span id="v-v_min">180</span>/<span id="v-v_max">255</span></span>
                 </div>
             </div>
@@ -452,22 +538,22 @@ INDEX_HTML = r"""
                 
                 <div class="hsv-row">
                     <span class="hsv-label">H 色相</span>
-                    <input id="in-yh_min" class="hsv-slider" type="range" max="180" value="15" oninput="upd('yh_min',this.value)">
-                    <input id="in-yh_max" class="hsv-slider" type="range" max="180" value="45" oninput="upd('yh_max',this.value)">
+                    <input id="in-yh_min" {{ attrs("yh_min") }} class="hsv-slider" type="range" oninput="upd('yh_min',this.value)">
+                    <input id="in-yh_max" {{ attrs("yh_max") }} class="hsv-slider" type="range" oninput="upd('yh_max',this.value)">
                     <span class="hsv-val"><span id="v-yh_min">15</span>/<span id="v-yh_max">45</span></span>
                 </div>
                 
                 <div class="hsv-row">
                     <span class="hsv-label">S 飽和</span>
-                    <input id="in-ys_min" class="hsv-slider" type="range" max="255" value="60" oninput="upd('ys_min',this.value)">
-                    <input id="in-ys_max" class="hsv-slider" type="range" max="255" value="255" oninput="upd('ys_max',this.value)">
+                    <input id="in-ys_min" {{ attrs("ys_min") }} class="hsv-slider" type="range" oninput="upd('ys_min',this.value)">
+                    <input id="in-ys_max" {{ attrs("ys_max") }} class="hsv-slider" type="range" oninput="upd('ys_max',this.value)">
                     <span class="hsv-val"><span id="v-ys_min">60</span>/<span id="v-ys_max">255</span></span>
                 </div>
 
                 <div class="hsv-row">
                     <span class="hsv-label">V 明度</span>
-                    <input id="in-yv_min" class="hsv-slider" type="range" max="255" value="80" oninput="upd('yv_min',this.value)">
-                    <input id="in-yv_max" class="hsv-slider" type="range" max="255" value="255" oninput="upd('yv_max',this.value)">
+                    <input id="in-yv_min" {{ attrs("yv_min") }} class="hsv-slider" type="range" oninput="upd('yv_min',this.value)">
+                    <input id="in-yv_max" {{ attrs("yv_max") }} class="hsv-slider" type="range" oninput="upd('yv_max',this.value)">
                     <span class="hsv-val"><span id="v-yv_min">80</span>/<span id="v-yv_max">255</span></span>
                 </div>
             </div>
@@ -477,19 +563,81 @@ INDEX_HTML = r"""
 </div>
 
 <script>
-function src(m,b){ document.getElementById('video').src=`/live_view?m=${m}&t=${Date.now()}`; document.querySelectorAll('.capsule-row .btn-view').forEach(x=>x.classList.remove('active')); if(b)b.classList.add('active'); }
+const PARAM_SCHEMA = {{ schema|tojson }};   // params_schema.py：型別/範圍/單位
+let VIEW = 'cv', BITS = false, maskAbort = null;
+function src(m,b){
+    if(b){ document.querySelectorAll('.capsule-row .btn-view:not(.btn-bits)').forEach(x=>x.classList.remove('active')); b.classList.add('active'); }
+    VIEW = m;
+    const img = document.getElementById('video'), cvs = document.getElementById('maskcv');
+    if(maskAbort){ maskAbort.abort(); maskAbort = null; }
+    if(BITS && m.startsWith('mask')){
+        img.removeAttribute('src'); img.style.display = 'none'; cvs.style.display = 'block';
+        maskAbort = maskStream(m, cvs);
+    } else {
+        cvs.style.display = 'none'; img.style.display = 'block';
+        img.src = `/live_view?m=${m}&t=${Date.now()}`;
+    }
+}
+function bitsToggle(b){ BITS = !BITS; b.classList.toggle('active', BITS); src(VIEW); }
+
+// /api/mask_stream：u32 長度 | u8 kind | u16 h | u16 w | u32 seq | zlib(packbits 或與上一張的 XOR) (格式見 mask_stream.py)
+async function inflate(z){
+    const ds = new Blob([z]).stream().pipeThrough(new DecompressionStream('deflate'));
+    return new Uint8Array(await new Response(ds).arrayBuffer());
+}
+function drawBits(ctx, cvs, bits, h, w){
+    if(cvs.width !== w || cvs.height !== h || !cvs.im){ cvs.width = w; cvs.height = h; cvs.im = ctx.createImageData(w, h); }
+    const px = new Uint32Array(cvs.im.data.buffer);
+    for(let i = 0; i < w * h; i++) px[i] = (bits[i >> 3] >> (7 - (i & 7)) & 1) ? 0xFFFFFFFF : 0xFF000000;
+    ctx.putImageData(cvs.im, 0, 0);
+}
+function maskStream(m, cvs){
+    const ac = new AbortController(), ctx = cvs.getContext('2d');
+    let bits = null, buf = new Uint8Array(0);
+    fetch(`/api/mask_stream?m=${m}`, {signal: ac.signal}).then(async r => {
+        const rd = r.body.getReader();
+        for(;;){
+            const {value, done} = await rd.read();
+            if(done) break;
+            const nb = new Uint8Array(buf.length + value.length); nb.set(buf); nb.set(value, buf.length); buf = nb;
+            let off = 0, h = 0, w = 0;
+            while(buf.length - off >= 4){
+                const dv = new DataView(buf.buffer, buf.byteOffset + off);
+                const n = dv.getUint32(0, true);
+                if(buf.length - off < 4 + n) break;
+                const kind = dv.getUint8(4);
+                h = dv.getUint16(5, true); w = dv.getUint16(7, true);
+                const data = await inflate(buf.subarray(off + 13, off + 4 + n));
+                if(kind === 0 || !bits || bits.length !== data.length) bits = data;
+                else for(let i = 0; i < data.length; i++) bits[i] ^= data[i];
+                off += 4 + n;
+            }
+            if(h) drawBits(ctx, cvs, bits, h, w);     // 一次收到好幾張只畫最後一張
+            buf = buf.subarray(off);
+        }
+    }).catch(() => {});
+    return ac;
+}
 
 function post(u,b){ 
     fetch(u,{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify(b||{})})
     .catch(err => console.error("API Fail:", err));
 }
 
+function recToggle(){
+    fetch('/api/rec/toggle',{method:'POST'}).then(r=>r.json())
+    .then(d=>{ if(d.error) alert("無法錄影: "+d.error); })
+    .catch(err => console.error("API Fail:", err));
+}
+
 function upd(k,v){ 
     let el = document.getElementById('v-'+k);
     if(el) el.innerText=v; 
     let o={}; 
-    o[k]=(['Kp','Kd','curve_slow','mask_max_cov','steer_gain','lost_timeout','coast_factor','white_curve_boost'].includes(k)) ? parseFloat(v) : parseInt(v); 
-    post('/api/params',o); 
+    o[k]=(PARAM_SCHEMA[k] && PARAM_SCHEMA[k].type === 'float') ? parseFloat(v) : parseInt(v); 
+    fetch('/api/params',{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify(o)})
+    .then(r => r.ok ? null : r.json().then(j => console.warn("param rejected:", j.msg)))
+    .catch(err => console.error("API Fail:", err));
 }
 
 // 核心功能：讀取參數 (支援 User 與 Factory 模式)
@@ -537,15 +685,16 @@ function updateUI(d, force) {
     if(d.cte !== undefined) document.getElementById('d-cte').innerText = (d.cte).toFixed(1);
     if(d.fps !== undefined) document.getElementById('d-fps').innerText = d.fps;
 
+    // SSE 只送有變的欄位：沒帶到的 key 表示不變
     let light = document.getElementById('status-light');
-    if(light) {
+    if(light && d.fps !== undefined) {
         if(d.fps > 0) light.classList.add('status-ok');
         else light.classList.remove('status-ok');
     }
 
     // 錄影燈
     let recEl = document.getElementById('rec-indicator');
-    if(recEl) recEl.style.display = (d.recording) ? 'flex' : 'none';
+    if(recEl && d.recording !== undefined) recEl.style.display = (d.recording) ? 'flex' : 'none';
 
     for (const [key, value] of Object.entries(d)) {
         let txtEl = document.getElementById('v-'+key);
@@ -572,7 +721,16 @@ async function loop(){
  }catch(e){}
  setTimeout(loop, 250);
 }
-loop();
+
+// 優先用 SSE 推播 (只收有變的欄位)；瀏覽器不支援或連線被關閉時改回輪詢
+function startTelemetry(){
+ if(!window.EventSource){ loop(); return; }
+ let es = new EventSource('/api/stream');
+ es.onmessage = e => updateUI(JSON.parse(e.data), false);
+ es.addEventListener('config', e => updateUI(JSON.parse(e.data), false));
+ es.onerror = () => { if(es.readyState === EventSource.CLOSED) loop(); };
+}
+startTelemetry();
 </script>
 </body>
 </html>
@@ -581,203 +739,116 @@ loop();
 # ------------------------------------------------------------------
 #  核心控制邏輯
 # ------------------------------------------------------------------
-def _motor_stop(): clbrobot.t_stop(0.02)
+# 只投遞指令，實際 I2C 由 actuator 執行緒處理 (相同指令會被去重)
+def _motor_stop(): actuator.stop()
 
-last_l_sent, last_r_sent = -999, -999
-def _motor_drive(l, r):
-    global last_l_sent, last_r_sent
-    if l != last_l_sent or r != last_r_sent:
-        clbrobot.MotorRun(0, "forward", l); clbrobot.MotorRun(2, "forward", l)
-        clbrobot.MotorRun(1, "forward", r); clbrobot.MotorRun(3, "forward", r)
-        last_l_sent, last_r_sent = l, r
+def _motor_drive(l, r): actuator.drive(l, r)
 
 def control_core():
-    global latest_frame, latest_frame_time, processed_frame, mode, running
-    global LANE_LAST_CENTER, LANE_LAST_WIDTH
-
-    pid_error_last = 0.0
-    first_lock = True
-    lost_start = None
-    last_steer = 0.0
-    last_lane_ok = False
-    local_frame_time = 0.0 
+    global mode, running, processed_count, last_processed_t
+
+    local_seq = 0
+    held = None
     fps_cnt = 0; fps_tm = time.time()
+    clock = StageClock(perf)
+    detector = LaneDetector(ww, use_lut=USE_HSV_LUT, space="i420" if LORES else "bgr")
+    to_roi = LoresRoi((ww, hh)) if LORES else None
+    controller = LaneController()
+    logged_version = -1
+    tick = 0
 
     while running:
         try:
-            frame = None
-            with frame_lock:
-                if latest_frame is None:
-                    time.sleep(0.002)
-                    continue
-                if latest_frame_time == local_frame_time:
-                    time.sleep(0.001)
-                    continue
-                frame = latest_frame.copy()
-                local_frame_time = latest_frame_time
-
-            with param_lock:
-                speed_base = float(PARAMS["speed_base"])
-                kp = float(PARAMS["Kp"]); kd = float(PARAMS["Kd"])
-                curve_slow = float(PARAMS["curve_slow"])
-                mask_mode = int(PARAMS["mask_mode"])
-                max_cov = float(PARAMS["mask_max_cov"])
-                y_min_px = int(PARAMS["y_min_pixels"])
-                s_lookahead = int(PARAMS.get("s_lookahead", 0))
-                single_lane_w = int(PARAMS.get("single_lane_width", 160)) 
-                white_thick = int(PARAMS.get("white_line_thick", 1))
-                white_boost = float(PARAMS.get("white_curve_boost", 1.0))
-                roi_y = max(0, min(hh-10, int(PARAMS["roi_y_min"]) + s_lookahead))
-                
-                lw = np.array([PARAMS["h_min"], PARAMS["s_min"], PARAMS["v_min"]], dtype=np.uint8)
-                uw = np.array([PARAMS["h_max"], PARAMS["s_max"], PARAMS["v_max"]], dtype=np.uint8)
-                ly = np.array([PARAMS["yh_min"], PARAMS["ys_min"], PARAMS["yv_min"]], dtype=np.uint8)
-                uy = np.array([PARAMS["yh_max"], PARAMS["ys_max"], PARAMS["yv_max"]], dtype=np.uint8)
-                
-                band_h = int(PARAMS["band_h"])
-                peak_min = int(PARAMS["peak_min"])
-                min_lane_w = int(PARAMS["min_lane_width"])
-                steer_gain = float(PARAMS["steer_gain"])
-                steer_lim = float(PARAMS["steer_limit"])
-
-            roi = frame[roi_y:hh, 0:ww]
-            hsv = cv2.cvtColor(roi, cv2.COLOR_BGR2HSV)
-            mask_w = cv2.inRange(hsv, lw, uw)
-            mask_y = cv2.inRange(hsv, ly, uy)
-            
-            w_px = mask_w.sum() // 255; y_px = mask_y.sum() // 255
-            roi_px = mask_w.shape[0] * mask_w.shape[1]
-            used = 0; is_white = False
-
-            if mask_mode == 1: mask = mask_w; used = 1; is_white = True
-            elif mask_mode == 2: mask = mask_y; used = 2
-            elif mask_mode == 3: mask = cv2.bitwise_or(mask_w, mask_y); used = 3
-            else:
-                if (w_px/max(1,roi_px) > max_cov and y_px >= y_min_px) or (y_px >= y_min_px and y_px < w_px):
-                    mask = mask_y; used = 2
-                else:
-                    mask = mask_w; used = 1; is_white = True
-
-            if (mask.sum()//255)/max(1,roi_px) > max_cov and used!=2 and y_px>=y_min_px:
-                mask = mask_y; used = 2
-
-            if is_white and white_thick > 0:
-                mask = cv2.dilate(mask, np.ones((3,3),np.uint8), iterations=white_thick)
-
-            mask_clean = mask
-            if (mask.sum()//255) > 1200:
-                mask_clean = cv2.morphologyEx(mask_clean, cv2.MORPH_OPEN, np.ones((3,3),np.uint8), iterations=1)
-            mask_clean = cv2.morphologyEx(mask_clean, cv2.MORPH_CLOSE, np.ones((3,3),np.uint8), iterations=1)
-
-            band = mask_clean[-band_h:, :]
-            hist = np.sum(band > 0, axis=0)
-            
+            # 取最新影格槽並持有到下一張 (期間 capture 不會覆寫它)
+            got = ring.acquire_read(local_seq)
+            if got is None: continue
+            clock.start()
+            if held is not None: ring.release(held)
+            held, local_seq, stamp = got
+            perf.add("wakeup", clock.t0 - stamp)
+            frame = ring.slots[held]
+
+            cfg = config            # 不可變快照，讀一次參考就好
+            cur_version = cfg.version
+            params_copy = dict(cfg.params) if runlog is not None and cur_version != logged_version else None
+            cur_mode = mode
+            roi_y = cfg.roi_y; band_h = cfg.band_h
+            # vis：疊圖畫在 main 影格上；lores 模式的 ROI 另由 YUV420 轉出
+            roi = vis = frame[roi_y:hh, 0:ww]
+            if to_roi is not None:
+                roi = to_roi(ring.aux[held], roi_y)
+                clock.lap("lores")
+            if runlog is not None:
+                s_err, s_steer, s_lost, s_flags = controller.state()
+                s_det = detector.state()
+
+            det = detector.detect(roi, cfg, clock)
+            lx, rx, lane_center = det.lx, det.rx, det.lane_center
             mid = ww // 2
-            lx = None; rx = None
-            if hist[:mid].max() >= peak_min: lx = int(np.argmax(hist[:mid]))
-            if hist[mid:].max() >= peak_min: rx = int(np.argmax(hist[mid:]) + mid)
-
-            has_line = False
-            lane_center = LANE_LAST_CENTER
-            current_lane_width = LANE_LAST_WIDTH 
-
-            if used != 0:
-                if lx is not None and rx is not None and (rx - lx) > min_lane_w:
-                    lane_center = (lx + rx) // 2
-                    current_lane_width = rx - lx 
-                    has_line = True
-                elif lx is not None:
-                    lane_center = lx + (current_lane_width // 2) 
-                    has_line = True
-                elif rx is not None:
-                    lane_center = rx - (current_lane_width // 2)
-                    has_line = True
-            
-            if has_line:
-                lane_center = int(max(0, min(ww-1, lane_center)))
-                LANE_LAST_WIDTH = int(current_lane_width) 
-                LANE_LAST_CENTER = lane_center
-
-            cte = float(mid - lane_center) if has_line else 0.0
-            if is_white and abs(cte) > 10: cte *= white_boost
-
-            # 視覺化
-            y_vis = roi.shape[0] - (band_h // 2)
-            if lx: cv2.circle(roi, (lx, y_vis), 5, (0,255,0), -1)
-            if rx: cv2.circle(roi, (rx, y_vis), 5, (0,255,0), -1)
-            cv2.circle(roi, (lane_center, y_vis), 6, (255,0,0), -1)
-            cv2.line(roi, (mid, y_vis-15), (mid, y_vis+15), (0,255,255), 2)
-
-            processed_frame = {
-                "cv": frame, 
-                "mask": cv2.cvtColor(mask_clean, cv2.COLOR_GRAY2BGR),
-                "maskw": cv2.cvtColor(mask_w, cv2.COLOR_GRAY2BGR), 
-                "masky": cv2.cvtColor(mask_y, cv2.COLOR_GRAY2BGR)
-            }
-            
-            with param_lock:
-                PARAMS["cte"] = cte
-                PARAMS["mask_used"] = used
-                PARAMS["mask_px"] = int(mask_clean.sum()//255)
-
-            if is_recording and video_writer: 
-                try: video_writer.write(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
-                except: pass
-
-            if mode == "auto":
-                with param_lock:
-                    to = float(PARAMS["lost_timeout"]); cf = float(PARAMS["coast_factor"])
-                    mm_px = int(PARAMS["min_mask_px"])
-                
-                if has_line and (mask_clean.sum()//255) < mm_px: has_line = False
-
-                if not has_line:
-                    first_lock = True
-                    if lost_start is None: lost_start = time.time()
-                    if last_lane_ok and (time.time() - lost_start) <= to:
-                        base = max(0, min(100, speed_base * cf))
-                        st = max(-steer_lim, min(steer_lim, last_steer))
-                        l = int(max(0, min(100, base - st)))
-                        r = int(max(0, min(100, base + st)))
-                        _motor_drive(l, r)
-                        with param_lock: PARAMS["steering"] = st
-                    else:
-                        _motor_stop(); mode="stop"; last_lane_ok=False
-                        with param_lock: PARAMS["steering"] = 0
-                else:
-                    err = cte
-                    if abs(err) < 2.0: err = 0.0
-
-                    if first_lock:
-                        pid_error_last = err
-                        first_lock = False
-                        
-                    derr = err - pid_error_last
-                    
-                    raw_st = (kp * err) + (kd * derr)
-                    pid_error_last = err
-                    
-                    raw_st *= steer_gain
-                    raw_st = max(-steer_lim, min(steer_lim, raw_st))
-                    
-                    st = (0.6 * raw_st) + (0.4 * last_steer)
-
-                    sf = 1.0 - (curve_slow * min(1.0, abs(st)/steer_lim))
-                    base = max(0.0, min(100.0, speed_base * sf))
-                    
-                    l = int(max(0, min(100, base - st)))
-                    r = int(max(0, min(100, base + st)))
-                    
-                    lost_start = None; last_lane_ok = True; last_steer = st
-                    _motor_drive(l, r)
-                    with param_lock: PARAMS["steering"] = st
-            else:
-                _motor_stop(); pid_error_last=0.0; first_lock=True
-                with param_lock: PARAMS["steering"] = 0
-            
-            fps_cnt += 1
+
+            # 先下馬達指令再畫除錯畫面，縮短影格到馬達的延遲
+            now = time.time()
+            cmd = controller.step(det, cfg, cur_mode, now)
+            clock.lap("pid")
+            if cmd.cmd == CMD_DRIVE: _motor_drive(cmd.l, cmd.r)
+            else: _motor_stop()
+            clock.lap("motor")
+            if cmd.mode != cur_mode: mode = cmd.mode
+            telemetry.publish(cte=det.cte, mask_used=det.used, mask_px=det.mask_px,
+                              steering=cmd.steering, has_line=det.has_line, mode=mode,
+                              far_cte=det.far_cte, curvature=det.curvature)
+
+            # 執行紀錄：ROI 要在疊圖之前複製
+            if runlog is not None:
+                # lores 的 BGRA 只存 BGR (查表會丟掉 alpha，重播結果相同)
+                runlog.submit(roi[:, :, :3], {
+                    "tick": tick, "seq": local_seq, "t_capture": stamp, "t": now,
+                    "params_version": cur_version, "roi_y": roi_y, "mode": MODES.index(cur_mode),
+                    "s_center": s_det[0], "s_width": s_det[1], "s_t_lx": s_det[2], "s_t_rx": s_det[3],
+                    "s_t_used": s_det[4], "s_t_flags": s_det[5], "s_t_version": s_det[6], "s_t_age": s_det[7],
+                    "s_err_last": s_err,
+                    "s_last_steer": s_steer, "s_lost_start": s_lost, "s_flags": s_flags,
+                    "mask_used": det.used, "lx": -1 if lx is None else lx, "rx": -1 if rx is None else rx,
+                    "lane_center": lane_center, "has_line": det.has_line, "cte": det.cte,
+                    "mask_px": det.mask_px, "tracked": det.tracked,
+                    "near_cte": det.near_cte, "far_cte": det.far_cte, "curvature": det.curvature, "cmd": cmd.cmd, "l": cmd.l, "r": cmd.r, "steering": cmd.steering,
+                }, params_copy)
+                if params_copy is not None: logged_version = cur_version
+                clock.lap("runlog")
+            tick += 1
+
+            # 視覺化 (只產生有人在看的畫面；錄影需要 cv 疊圖)
+            watching = views.active
+            recording = recorder is not None and recorder.active
+            if "cv" in watching or recording:
+                y_vis = vis.shape[0] - (band_h // 2)
+                if lx: cv2.circle(vis, (lx, y_vis), 5, (0,255,0), -1)
+                if rx: cv2.circle(vis, (rx, y_vis), 5, (0,255,0), -1)
+                cv2.circle(vis, (lane_center, y_vis), 6, (255,0,0), -1)
+                cv2.line(vis, (mid, y_vis-15), (mid, y_vis+15), (0,255,255), 2)
+                if det.band_x is not None:
+                    # 多帶中心：由下往上，每條帶的中間高度
+                    bh = vis.shape[0] // len(det.band_x)
+                    for i, bx in enumerate(det.band_x):
+                        if bx >= 0: cv2.circle(vis, (int(bx), vis.shape[0] - int((i + 0.5) * bh)), 3, (255,0,255), -1)
+
+            # 影格槽之後會被 capture 覆寫，要給網頁看的 cv 畫面才複製
+            pf = {"cv": frame.copy()} if "cv" in watching else {}
+            # 遮罩維持單通道 (偵測器的緩衝下一張會覆寫，所以複製)；JPEG / 四格 / 位元串流各自處理
+            if "mask" in watching: pf["mask"] = det.mask_clean.copy()
+            if "maskw" in watching: pf["maskw"] = det.mask_w.copy()
+            if "masky" in watching: pf["masky"] = det.mask_y.copy()
+            broadcaster.publish(pf)
+            clock.lap("viz")
+
+            if recording:
+                recorder.submit(frame, now, det.has_line, det.cte)     # 只複製排隊，編碼在錄影執行緒
+                clock.lap("rec")
+
+            clock.total()
+            fps_cnt += 1; processed_count += 1; last_processed_t = time.perf_counter()
             if time.time()-fps_tm >= 1.0:
-                with param_lock: PARAMS["fps"] = fps_cnt
+                telemetry.publish(fps=fps_cnt)
                 fps_cnt=0; fps_tm=time.time()
 
         except Exception as e:
@@ -788,50 +859,133 @@ def control_core():
 # ------------------------------------------------------------------
 #  Flask & Camera
 # ------------------------------------------------------------------
-picamera = Picamera2()
-cfg = picamera.create_preview_configuration(main={"format":"RGB888", "size":(ww,hh)})
-cfg["transform"] = libcamera.Transform(hflip=1, vflip=1)
-picamera.configure(cfg); picamera.start()
-
 def capture_loop():
-    global latest_frame, latest_frame_time, running
+    """只受相機節奏限制 (capture 會阻塞到下一張)，直接寫進 ring 的空槽"""
+    global running, mode
+    lockstep = getattr(frame_source, "lockstep", False)
     while running:
-        frame = picamera.capture_array()
-        if frame is not None:
-            with frame_lock: 
-                latest_frame = frame
-                latest_frame_time = time.time()
-        time.sleep(0.01)
+        if lockstep:
+            while running and not ring.wait_consumed(): pass
+        t0 = time.perf_counter()
+        idx = ring.acquire_write()
+        if ring.aux is None:
+            frame = frame_source.read(ring.slots[idx])
+        else:
+            # lores 給控制迴圈；main 只在有人看 / 錄影時才複製
+            want_main = bool(views.active) or (recorder is not None and recorder.active)
+            frame = frame_source.read(ring.slots[idx] if want_main else None, ring.aux[idx])
+        perf.add("capture", time.perf_counter() - t0)
+        if frame is None:
+            # 回放結束：停車，headless 模式直接結束整個程式
+            print("Frame source exhausted")
+            mode = "stop"
+            if headless: running = False
+            break
+        ring.publish(idx)
+
+# ------------------------------------------------------------------
+#  需要相機 / 馬達 / 錄影的操作：threaded 直接執行；--procs 時由網頁行程轉送給視覺行程
+# ------------------------------------------------------------------
+def op_set_mode(m):
+    global mode
+    mode = "auto" if m=="start" else "stop"
+    if mode == "stop": _motor_stop()    # 緊急停車直接插隊，不等下一張影格
+    return mode
+
+def op_move_cam(a):
+    global angle_pan, angle_tilt
+    if a=="left": angle_pan-=5
+    elif a=="right": angle_pan+=5
+    elif a=="up": angle_tilt+=5
+    elif a=="down": angle_tilt-=5
+    elif a=="center": angle_pan=90; angle_tilt=15
+    angle_pan=max(0,min(180,angle_pan)); angle_tilt=max(0,min(180,angle_tilt))
+    actuator.call(clbrobot.set_servo_angle, Cam_X, angle_pan, 0); actuator.call(clbrobot.set_servo_angle, Cam_Y, angle_tilt, 0)
+    return {}
+
+def op_rec_toggle():
+    """回傳 (HTTP 狀態碼, JSON)"""
+    if recorder.active:
+        recorder.stop()
+        return 200, {"r":False}
+    ok, msg = recorder.start()
+    if not ok: return 507, {"r":False, "error":msg}
+    return 200, {"r":True, "dir":msg}
+
+def op_perf():
+    data = perf.snapshot()
+    data["actuator"] = actuator.stats() if actuator else {}
+    if runlog is not None: data["runlog"] = runlog.stats()
+    return data
+
+def op_close():
+    global running
+    running = False
+    actuator.close()        # 等停車指令實際寫出
+    recorder.close()        # 寫完佇列、關閉錄影檔，避免 AVI 索引損毀
+    if runlog is not None: runlog.close()
+    return {}
 
-threading.Thread(target=capture_loop, daemon=True).start()
-threading.Thread(target=control_core, daemon=True).start()
+OPS = {"set_mode": op_set_mode, "move_cam": op_move_cam, "rec_toggle": op_rec_toggle, "perf": op_perf,
+       "perf_stages": perf.snapshot, "apply_params": op_apply_params, "close": op_close}
+
+def control(name, *args):
+    if vision is None: return OPS[name](*args)
+    return vision.call(name, *args)
 
 app = Flask(__name__)
 @app.route("/")
-def index(): return render_template_string(INDEX_HTML)
-
-def gen_frame(m):
-    while True:
-        out = None
-        if processed_frame: out = processed_frame.get(m, processed_frame.get("cv"))
-        if out is None:
-            with frame_lock: 
-                if latest_frame is not None: out = latest_frame.copy()
-        if out is None: time.sleep(0.05); continue
-        try:
-            ret, jpeg = cv2.imencode(".jpg", cv2.cvtColor(out, cv2.COLOR_RGB2BGR))
-            if ret: yield (b"--frame\r\nContent-Type: image/jpeg\r\n\r\n" + jpeg.tobytes() + b"\r\n")
-        except: pass
-        time.sleep(0.04)
+def index(): return render_template_string(INDEX_HTML, attrs=_slider_attrs, schema=schema_json())
+
+def _slider_attrs(key):
+    """滑桿的 min/max/step/value 由 params_schema 與目前設定產生"""
+    spec = SCHEMA[key]
+    hint = f"{spec.lo}~{spec.hi} {spec.unit}".rstrip()
+    return Markup(f'min="{spec.lo}" max="{spec.hi}" step="{spec.step}" value="{config.params[key]}" title="{hint}"')
+
+@app.route("/api/schema")
+def api_schema(): return jsonify(schema_json())
+
+def gen_frame(link, fetch, sock=None):
+    """fetch() 回傳 (seq, 要送的 bytes)；MJPEG 與遮罩位元串流共用"""
+    views.subscribe(link.m, link)
+    limit_send_buffer(sock)
+    try:
+        last_seq = -1
+        while True:
+            # 等新影格；沒新影格就不編碼也不送
+            broadcaster.wait(last_seq)
+            seq, chunk = fetch()
+            if chunk is None or seq == last_seq: time.sleep(0.05); continue
+            last_seq = seq
+            t0 = time.perf_counter()
+            yield chunk         # werkzeug 寫完這張才回到這裡，耗時就是寫出時間
+            # 寫的期間又來的影格直接跳過 (只送最新的)
+            time.sleep(link.sent(len(chunk), time.perf_counter() - t0, broadcaster.seq - seq))
+    finally:
+        # 瀏覽器關閉 / 切換畫面時 werkzeug 會 close() generator
+        views.unsubscribe(link.m, link)
 
 @app.route("/live_view")
-def live_view(): return Response(gen_frame(request.args.get("m", "cv")), mimetype="multipart/x-mixed-replace; boundary=frame")
+def live_view():
+    """?m= 畫面，?q= JPEG 品質，?scale= 縮放 (1/0.75/0.5/0.25)，?fps= 幀率上限；連線太慢時自動往下調"""
+    a = request.args
+    link = ViewerLink(a.get("m", "cv"), a.get("q"), a.get("scale"), a.get("fps"))
+    fetch = lambda: broadcaster.frame(link.m, link.q, link.scale)
+    return Response(gen_frame(link, fetch, request.environ.get("werkzeug.socket")),
+                    mimetype="multipart/x-mixed-replace; boundary=frame")
+
+@app.route("/api/mask_stream")
+def api_mask_stream():
+    """?m=mask/maskw/masky 的 1 bit/px 差異串流 (格式見 mask_stream.py)，網頁以 canvas 畫"""
+    link = MaskLink(request.args.get("m", "mask"), request.args.get("fps"))
+    return Response(gen_frame(link, lambda: masks.frame(link), request.environ.get("werkzeug.socket")),
+                    mimetype="application/octet-stream", headers={"Cache-Control": "no-cache"})
 
 @app.route("/api/params", methods=["POST"])
 def ap():
-    with param_lock:
-        for k,v in request.json.items(): 
-            if k in PARAMS: PARAMS[k]=v
+    err = apply_params(request.json or {})
+    if err: return jsonify({"ok":False, "msg":err[0]}), err[1]
     return jsonify({"ok":True})
 
 # ★★★ 雙模式載入 API ★★★
@@ -850,63 +1004,195 @@ def set_preset_api(type, mode):
             return jsonify({"ok":False, "msg":"No saved data"})
             
     if target_preset:
-        with param_lock:
-            for k,v in target_preset.items():
-                PARAMS[k] = v
+        err = apply_params(target_preset)
+        if err: return jsonify({"ok":False, "msg":err[0]}), err[1]
         return jsonify({"ok":True})
     return jsonify({"ok":False})
 
 @app.route("/api/save_preset/<mode>", methods=["POST"])
 def save_preset_endpoint(mode):
-    with param_lock:
-        current = PARAMS.copy()
-    save_user_presets(mode, current)
+    save_user_presets(mode, dict(config.params))
     return jsonify({"ok":True})
 
 @app.route("/api/hud")
-def ah(): 
-    with param_lock:
-        # 傳送錄影狀態給前端
-        data = PARAMS.copy()
-        data["recording"] = is_recording
-        return jsonify(data)
+def ah(): return jsonify(hud_data())
+
+def hud_data():
+    # 傳送錄影狀態給前端 (Flask 與 --web async 共用)
+    data = dict(config.params)
+    data.update(telemetry.snapshot())
+    data.update(_hud_extra())
+    return data
+
+def _hud_extra():
+    # 觀看者統計在網頁行程；--procs 時錄影狀態已經由視覺行程寫在遙測裡
+    data = {"viewers": views.clients()}
+    if vision is None: data.update(_rec_extra())
+    return data
+
+def _rec_extra():
+    return dict(recorder.stats(), recording=recorder.active)
+
+def _read_config():
+    return {k: v for k, v in config.params.items() if k not in LIVE_FIELDS}
+
+@app.route("/api/stream")
+def api_stream():
+    """SSE 即時遙測：?hz= 推播頻率 (1~30)，只送有變的欄位"""
+    gen = event_stream(new_event_stream(request.args.get("hz")))
+    return Response(gen, mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+perf_summary = None         # /api/stream 共用的 p95 摘要；第一個連線時建立 (--procs 時 vision 已就緒)
+
+def new_event_stream(hz):
+    global perf_summary
+    if perf_summary is None: perf_summary = PerfSummary(perf if vision is None else RemotePerf(vision, perf))
+    return EventStream(telemetry, lambda: config.version, _read_config, extra=_hud_extra, perf=perf_summary,
+                       hz=clamp_hz(hz, TELEMETRY_HZ))
+
+@app.route("/api/perf")
+def api_perf():
+    """各階段延遲 p50/p95/p99 (ms)"""
+    data = control("perf")
+    if vision is not None: data.update(RemotePerf(vision, perf).local_part())   # 編碼在網頁行程
+    data["stream"] = dict(broadcaster.stats(), masks=masks.stats(), viewers=views.counts(), clients=views.clients())
+    return jsonify(data)
 
 @app.route("/api/mode/<m>", methods=["POST"])
-def am(m): global mode; mode="auto" if m=="start" else "stop"; return jsonify({"mode":mode})
+def am(m):
+    return jsonify({"mode":control("set_mode", m)})
 
 @app.route("/api/cam/<a>", methods=["POST"])
 def ac(a):
-    global angle_pan, angle_tilt
-    if a=="left": angle_pan-=5
-    elif a=="right": angle_pan+=5
-    elif a=="up": angle_tilt+=5
-    elif a=="down": angle_tilt-=5
-    elif a=="center": angle_pan=90; angle_tilt=15
-    angle_pan=max(0,min(180,angle_pan)); angle_tilt=max(0,min(180,angle_tilt))
-    clbrobot.set_servo_angle(Cam_X, angle_pan, 0.2); clbrobot.set_servo_angle(Cam_Y, angle_tilt, 0.2)
-    return jsonify({})
+    return jsonify(control("move_cam", a))
 
 @app.route("/api/rec/toggle", methods=["POST"])
 def ar():
-    global is_recording, video_writer
-    if is_recording: is_recording=False; video_writer.release()
-    else:
-        fn = f"/home/pi119/Videos/race_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.avi"
-        video_writer = cv2.VideoWriter(fn, cv2.VideoWriter_fourcc(*"XVID"), 20.0, (ww,hh))
-        is_recording=True
-    return jsonify({"r":is_recording})
+    status, body = control("rec_toggle")
+    return jsonify(body), status
 
 @app.route("/api/shutdown", methods=["POST"])
 def shutdown_pi():
     global running
+    control("close")        # 停車、寫完錄影與執行紀錄再關機
     running = False
-    _motor_stop()
     os.system("sudo shutdown -h now")
     return jsonify({"ok":True})
 
 @app.route("/api/exit", methods=["POST"])
-def ae(): global running; running=False; _motor_stop(); request.environ.get('werkzeug.server.shutdown')(); return jsonify({})
+def ae(): global running; control("close"); running=False; request.environ.get('werkzeug.server.shutdown')(); return jsonify({})
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Lane following (V5 Ultimate Tuned)")
+    ap.add_argument("--source", default="camera", help="'camera' 或錄影檔路徑 (mp4/avi)")
+    ap.add_argument("--rate", default=RATE_NATIVE, help="回放速度: native / max / 固定 FPS 數字")
+    ap.add_argument("--loop", action="store_true", help="回放到結尾後從頭播放")
+    ap.add_argument("--swap-rb", dest="swap_rb", action="store_true", default=None, help="回放時交換 R/B (預設: .avi 自動交換)")
+    ap.add_argument("--no-swap-rb", dest="swap_rb", action="store_false")
+    ap.add_argument("--sim", action="store_true", help="使用 SimRobot 替身 (回放時自動開啟)")
+    ap.add_argument("--preset", choices=list(FACTORY_PRESETS.keys()), help="啟動時套用基礎設定")
+    ap.add_argument("--auto", action="store_true", help="啟動後直接進入循線模式")
+    ap.add_argument("--headless", action="store_true", help="不啟動 Flask，跑完來源後輸出吞吐量")
+    ap.add_argument("--no-hsv-lut", action="store_true", help="停用 HSV 查表，改用 cvtColor + inRange")
+    ap.add_argument("--lores", action="store_true", help="相機加開 YUV420 lores 串流給控制迴圈 (影片來源時以 StandInCamera 模擬)")
+    ap.add_argument("--rec-policy", choices=POLICIES, default=DROP_OLDEST, help="錄影佇列滿時丟最舊或丟最新")
+    ap.add_argument("--rec-queue", type=int, default=8, help="錄影佇列長度 (影格數)")
+    ap.add_argument("--rec-dir", default="~/Videos", help="錄影輸出目錄")
+    ap.add_argument("--rec-segment-s", type=float, default=300.0, help="每段錄影最長秒數 (0=不限)")
+    ap.add_argument("--rec-segment-mb", type=float, default=500.0, help="每段錄影最大 MB (0=不限)")
+    ap.add_argument("--rec-min-free-mb", type=float, default=200.0, help="磁碟剩餘低於此值時拒絕/停止錄影")
+    ap.add_argument("--runlog", metavar="DIR", help="寫入執行紀錄 (原始 ROI + 遙測) 到空目錄，供 replay_runlog.py 重播")
+    ap.add_argument("--runlog-chunk", type=int, default=300, help="執行紀錄每個分段的筆數")
+    ap.add_argument("--telemetry-hz", type=float, default=TELEMETRY_HZ, help="/api/stream 預設推播頻率 (Hz)")
+    ap.add_argument("--procs", action="store_true", help="相機 + 循線 + 馬達放在獨立行程，網頁行程經 shared_memory 讀畫面與遙測")
+    ap.add_argument("--web", choices=("flask", "async"), default="flask",
+                    help="網頁伺服器：flask (每個連線一個執行緒) / async (串流與 /api/hud 在 asyncio 事件迴圈)")
+    ap.add_argument("--port", type=int, default=5000)
+    return ap.parse_args(argv)
+
+def serve_web(args):
+    if args.web == "async":
+        AsyncWebServer(app, AsyncFrameFeed(broadcaster, views), hud_data, new_event_stream, masks).run("0.0.0.0", args.port)
+    else:
+        app.run(host="0.0.0.0", port=args.port, threaded=True, debug=False)
+
+def start_pipeline(args):
+    """開相機 / 馬達 / 錄影 / 執行紀錄，啟動 capture 與控制執行緒 (--procs 時在視覺行程執行)"""
+    global ring, frame_source, clbrobot, actuator, recorder, runlog
+    if LORES: ring = FrameRing((hh, ww, 3), slots=4, aux_shape=(hh * 3 // 2, ww))
+    frame_source = open_frame_source(args.source, (ww, hh), rate=args.rate, loop=args.loop, swap_rb=args.swap_rb, lores=LORES)
+    clbrobot = build_robot(sim=args.sim or args.source != "camera")
+    actuator = Actuator(clbrobot, perf); actuator.start()
+    recorder = RecordingPipeline((hh, ww, 3), args.rec_dir, capacity=args.rec_queue, policy=args.rec_policy,
+                                 max_seconds=args.rec_segment_s, max_mb=args.rec_segment_mb,
+                                 min_free_mb=args.rec_min_free_mb, perf=perf)
+    if args.runlog:
+        runlog = RunLogWriter(args.runlog, (hh, ww, 3), use_lut=USE_HSV_LUT, chunk_ticks=args.runlog_chunk, perf=perf,
+                             space="i420" if LORES else "bgr")
+    if not headless:
+        actuator.call(clbrobot.set_servo_angle, Cam_X, angle_pan, 0); actuator.call(clbrobot.set_servo_angle, Cam_Y, angle_tilt, 0)
+    threading.Thread(target=capture_loop, daemon=True).start()
+    ctl_thread = threading.Thread(target=control_core, daemon=True)
+    ctl_thread.start()
+    return ctl_thread
+
+def finish_headless(ctl_thread, t0):
+    global running
+    try:
+        while running: time.sleep(0.2)
+    except KeyboardInterrupt:
+        running = False
+    ctl_thread.join(timeout=2.0)
+    dt = max(1e-6, last_processed_t - t0)
+    read = getattr(frame_source, "frames", processed_count)
+    print(f"processed {processed_count}/{read} frames in {dt:.2f}s ({processed_count/dt:.1f} fps)")
+    actuator.close()
+    recorder.close()
+    if runlog is not None:
+        runlog.close()
+        print(f"run log: {runlog.stats()}")
+
+def vision_main(args, block, conn):
+    """--procs 的視覺行程：畫面 / 遙測改寫進共享記憶體，主執行緒處理網頁行程送來的操作"""
+    global views, broadcaster, telemetry
+    views = SharedViews(block)
+    broadcaster = SharedFramePublisher(block)
+    telemetry = SharedTelemetry(block, extra=_rec_extra)
+    t0 = time.perf_counter()
+    ctl_thread = start_pipeline(args)
+    if headless:
+        finish_headless(ctl_thread, t0)
+        return
+    serve(conn, OPS, lambda: running)
+    if running: op_close()      # 網頁行程消失：停車並關檔
 
 if __name__ == "__main__":
-    clbrobot.set_servo_angle(Cam_X, angle_pan, 0.3); clbrobot.set_servo_angle(Cam_Y, angle_tilt, 0.3)
-    app.run(host="0.0.0.0", port=5000, threaded=True, debug=False)
\ No newline at end of file
+    args = parse_args()
+    headless = args.headless
+    USE_HSV_LUT = not args.no_hsv_lut
+    LORES = args.lores
+    if LORES and not USE_HSV_LUT: sys.exit("--lores 的色彩修正在 HSV 查表裡，不能與 --no-hsv-lut 併用")
+    TELEMETRY_HZ = clamp_hz(args.telemetry_hz, TELEMETRY_HZ)
+    if args.preset: apply_params(FACTORY_PRESETS[args.preset])
+    if args.auto: mode = "auto"
+
+    if args.procs:
+        # 先 fork 再啟動任何執行緒；子行程繼承上面套用好的參數與模式
+        vision = VisionClient(functools.partial(vision_main, args), (hh, ww, 3))
+        if headless:
+            vision.proc.join()
+            vision.close()
+        else:
+            telemetry = SharedTelemetryReader(vision.block)
+            FramePump(vision.block, views, broadcaster).start()
+            try:
+                serve_web(args)
+            finally:
+                vision.close()
+    else:
+        t0 = time.perf_counter()
+        ctl_thread = start_pipeline(args)
+        if headless:
+            finish_headless(ctl_thread, t0)
+        else:
+            serve_web(args)
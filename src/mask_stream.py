@@ -0,0 +1,87 @@
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+@  文件名：mask_stream.py
+@  /api/mask_stream：二值遮罩不走 JPEG。np.packbits 成 1 bit/px (每張影格打包一次)，
+@  再跟觀看者手上那張 XOR (通常只有車道線邊緣在變)，以 zlib 壓縮後送出；瀏覽器用 DecompressionStream 解開畫在 canvas
+@
+@  訊息 (little-endian)：u32 後面的長度 | u8 kind | u16 h | u16 w | u32 seq | zlib 資料
+@    kind 0 KEY    解開就是 packbits (第一張、尺寸改變)
+@    kind 1 DELTA  解開後與上一張 XOR
+@  packbits 逐列接續、MSB 在前，最後一個位元組不足 8 px 補 0
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+
+import struct
+import time
+import zlib
+import numpy as np
+
+from streaming import ViewerLink, MASK_VIEWS
+
+KEY, DELTA = 0, 1
+HEADER = struct.Struct("<IBHHI")
+LEVEL = 3                   # zlib 等級：再高位元組只少一點，耗時卻加倍
+
+
+def decode(msg, bits=None):
+    """解一則訊息 (含長度欄位)；回傳 (seq, (h, w), bits)。給測試 / 離線工具用，瀏覽器端在 INDEX_HTML"""
+    _, kind, h, w, seq = HEADER.unpack_from(msg)
+    body = np.frombuffer(zlib.decompress(msg[HEADER.size:]), np.uint8)
+    bits = body.copy() if kind == KEY else np.bitwise_xor(bits, body)
+    return seq, (h, w), bits
+
+
+class MaskLink(ViewerLink):
+    """遮罩位元串流的連線：沒有品質 / 尺寸可降，寫太慢只降幀率"""
+
+    levels = ((1.0, 0, 1.0), (1.0, 0, 0.5), (1.0, 0, 0.25))
+    fmt = "bits"
+
+    def __init__(self, m, fps=None):
+        super().__init__(m if m in MASK_VIEWS else "mask", fps=fps)
+        self.base = None        # 這個觀看者手上那張：(seq, packed, (h, w))
+
+
+class MaskEncoder:
+    """
+    整個伺服器共用一個 (同 MjpegBroadcaster)：每種遮罩記住最近一則訊息與它的基準影格，
+    跟得上的觀看者 (手上正好是同一張) 直接拿同一份 bytes；剛連上或落後的才另外編碼
+    """
+
+    def __init__(self, broadcaster, perf=None):
+        self.broadcaster = broadcaster
+        self.perf = perf
+        self._last = {}                       # mode -> ((基準 seq, seq), 訊息)
+        self.encoded = 0
+        self.served = 0
+
+    def encode(self, seq, packed, shape, base=None):
+        """base：觀看者手上那張 (seq, packed, shape)；None 或尺寸不同就送 KEY"""
+        t0 = time.perf_counter()
+        if base is not None and base[2] == shape:
+            kind, body = DELTA, np.bitwise_xor(packed, base[1])
+        else:
+            kind, body = KEY, packed
+        z = zlib.compress(body, LEVEL)
+        if self.perf is not None: self.perf.add("deflate", time.perf_counter() - t0)
+        return HEADER.pack(HEADER.size - 4 + len(z), kind, shape[0], shape[1], seq & 0xFFFFFFFF) + z
+
+    def frame(self, link):
+        """對應 MjpegBroadcaster.frame()：回傳 (seq, 訊息)，沒有新遮罩時訊息為 None；送出後更新 link.base"""
+        seq, packed, shape = self.broadcaster.packed(link.m)
+        base = link.base
+        if packed is None or (base is not None and base[0] == seq): return seq, None
+        if base is not None and base[2] != shape: base = None
+        key = (base[0] if base is not None else None, seq)
+        last = self._last.get(link.m)
+        if last and last[0] == key:
+            msg = last[1]
+        else:
+            # 兩個觀看者同時編同一則只是多做一次，結果相同，不必上鎖
+            msg = self.encode(seq, packed, shape, base)
+            self._last[link.m] = (key, msg)
+            self.encoded += 1
+        self.served += 1
+        link.base = (seq, packed, shape)      # packed 是 broadcaster 共用的，只讀不改
+        return seq, msg
+
+    def stats(self):
+        return {"encoded": self.encoded, "served": self.served}
@@ -0,0 +1,113 @@
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+@  文件名：params_schema.py
+@  可調參數的型別、範圍、單位與影響的處理階段：
+@  寫入時 (/api/params、預設值) 檢查並轉型一次，控制迴圈不用再防呆；
+@  網頁滑桿的 min/max/step 也由這裡產生
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+
+import math
+from collections import namedtuple
+
+# 處理階段：參數改變時哪些快取要重建
+STAGE_LUT = "lut"       # HSV 查表
+STAGE_ROI = "roi"       # ROI 範圍與遮罩緩衝
+STAGE_MASK = "mask"     # 遮罩選擇與型態學
+STAGE_HIST = "hist"     # 欄位直方圖與車道中心
+STAGE_PID = "pid"       # 轉向
+STAGE_DRIVE = "drive"   # 速度
+STAGES = (STAGE_LUT, STAGE_ROI, STAGE_MASK, STAGE_HIST, STAGE_PID, STAGE_DRIVE)
+
+Param = namedtuple("Param", "type lo hi step unit stages")
+
+
+def _i(lo, hi, unit="", *stages, step=1): return Param(int, lo, hi, step, unit, stages)
+def _f(lo, hi, step, unit="", *stages): return Param(float, lo, hi, step, unit, stages)
+
+
+SCHEMA = {
+    # --- [動力 & PID] ---
+    "speed_base":   _i(0, 80, "%", STAGE_DRIVE),
+    "Kp":           _f(0.0, 2.0, 0.01, "", STAGE_PID),
+    "Kd":           _f(0.0, 2.0, 0.01, "", STAGE_PID),
+    "curve_slow":   _f(0.0, 0.9, 0.05, "ratio", STAGE_DRIVE),
+    # --- [白線 HSV] (OpenCV: H 0~180, S/V 0~255) ---
+    "h_min": _i(0, 180, "H", STAGE_LUT), "h_max": _i(0, 180, "H", STAGE_LUT),
+    "s_min": _i(0, 255, "S", STAGE_LUT), "s_max": _i(0, 255, "S", STAGE_LUT),
+    "v_min": _i(0, 255, "V", STAGE_LUT), "v_max": _i(0, 255, "V", STAGE_LUT),
+    # --- [黃線 HSV] ---
+    "yh_min": _i(0, 180, "H", STAGE_LUT), "yh_max": _i(0, 180, "H", STAGE_LUT),
+    "ys_min": _i(0, 255, "S", STAGE_LUT), "ys_max": _i(0, 255, "S", STAGE_LUT),
+    "yv_min": _i(0, 255, "V", STAGE_LUT), "yv_max": _i(0, 255, "V", STAGE_LUT),
+    # --- [遮罩邏輯] ---
+    "mask_mode":      _i(0, 3, "", STAGE_MASK),          # 0 自動 / 1 白 / 2 黃 / 3 白+黃
+    "mask_max_cov":   _f(0.1, 1.0, 0.05, "ratio", STAGE_MASK),
+    "min_mask_px":    _i(0, 1000, "px", STAGE_PID),
+    "y_min_pixels":   _i(0, 1000, "px", STAGE_MASK),
+    "roi_y_min":      _i(0, 200, "px", STAGE_ROI),
+    "band_h":         _i(1, 140, "px", STAGE_HIST),
+    "peak_min":       _i(0, 50, "px", STAGE_HIST),
+    "min_lane_width": _i(0, 100, "px", STAGE_HIST),
+    # --- [轉向控制] ---
+    "steer_gain":   _f(0.0, 5.0, 0.1, "x", STAGE_PID),
+    "steer_limit":  _i(1, 100, "%", STAGE_PID),           # 0 會讓減速比例除以零
+    "lost_timeout": _f(0.0, 2.0, 0.1, "s", STAGE_PID),
+    "coast_factor": _f(0.0, 1.0, 0.05, "ratio", STAGE_DRIVE),
+    # --- [S彎與優化] ---
+    "s_lookahead":       _i(-20, 40, "px", STAGE_ROI),
+    "single_lane_width": _i(80, 250, "px", STAGE_HIST, step=5),
+    "white_curve_boost": _f(1.0, 2.0, 0.1, "x", STAGE_PID),
+    "white_line_thick":  _i(0, 5, "iter", STAGE_MASK),
+    # --- [追蹤窗] track_win=0 關閉，每次都全圖掃描 ---
+    "track_win":     _i(0, 60, "px", STAGE_HIST),
+    "track_refresh": _i(1, 100, "frames", STAGE_HIST),
+    # --- [多帶前瞻] curve_bands=1 只用最下面一條帶 ---
+    "curve_bands":   _i(1, 8, "bands", STAGE_HIST),
+    "curve_gain":    _f(0.0, 2.0, 0.05, "x", STAGE_PID),
+}
+
+
+def coerce(key, value):
+    """轉成 schema 型別並檢查範圍；不合法丟 ValueError (訊息可直接回給前端)"""
+    spec = SCHEMA.get(key)
+    if spec is None:
+        raise ValueError(f"{key}: unknown parameter")
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(f"{key}: expected a number, got {value!r}")
+    try:
+        num = float(value)
+    except ValueError:
+        raise ValueError(f"{key}: expected a number, got {value!r}") from None
+    if not math.isfinite(num):
+        raise ValueError(f"{key}: must be finite")
+    if spec.type is int:
+        if num != int(num):
+            raise ValueError(f"{key}: expected an integer, got {value!r}")
+        num = int(num)
+    if not spec.lo <= num <= spec.hi:
+        raise ValueError(f"{key}: {num} out of range [{spec.lo}, {spec.hi}] {spec.unit}".rstrip())
+    return num
+
+
+def coerce_all(updates):
+    """只處理 schema 內的 key (舊預設檔裡的遙測欄位直接略過)；任何一個不合法就整批拒絕"""
+    if not isinstance(updates, dict):
+        raise ValueError("params must be a JSON object")
+    return {k: coerce(k, v) for k, v in updates.items() if k in SCHEMA}
+
+
+def changed_stages(old, new):
+    return {s for k, spec in SCHEMA.items() if old.get(k) != new.get(k) for s in spec.stages}
+
+
+def stage_generations(params, version, prev=None):
+    """每個階段最後一次改變時的設定版本；快取只要比對自己關心的階段"""
+    if prev is None:
+        return {s: version for s in STAGES}
+    changed = changed_stages(prev.params, params)
+    return {s: version if s in changed else prev.stage_gen[s] for s in STAGES}
+
+
+def as_json():
+    """給 /api/schema 與網頁滑桿"""
+    return {k: {"type": spec.type.__name__, "min": spec.lo, "max": spec.hi, "step": spec.step,
+                "unit": spec.unit, "stages": list(spec.stages)} for k, spec in SCHEMA.items()}
@@ -0,0 +1,88 @@
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+@  文件名：perf.py
+@  各階段延遲統計：固定長度環形樣本 + p50/p95/p99
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+
+import threading
+import time
+import numpy as np
+
+
+class RollingHistogram:
+    """保留最近 size 筆樣本 (秒)，寫入 O(1)、不配置記憶體"""
+
+    def __init__(self, size=512):
+        self.buf = np.zeros(size, dtype=np.float64)
+        self.size = size
+        self.idx = 0
+        self.count = 0
+
+    def add(self, value):
+        self.buf[self.idx] = value
+        self.idx = (self.idx + 1) % self.size
+        if self.count < self.size: self.count += 1
+
+    def percentiles(self, qs=(50, 95, 99)):
+        n = self.count
+        if n == 0: return None
+        data = self.buf[:n].copy() if n < self.size else self.buf.copy()
+        return np.percentile(data, qs), float(data.max())
+
+
+class PerfStats:
+    """每個階段一個 RollingHistogram；寫入端只有一個執行緒，讀取端取快照"""
+
+    def __init__(self, stages, size=512):
+        self.stages = list(stages)
+        self.hists = {s: RollingHistogram(size) for s in self.stages}
+        self.lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        h = self.hists.get(stage)
+        if h is None:
+            with self.lock:
+                h = self.hists.setdefault(stage, RollingHistogram(self.hists[self.stages[0]].size))
+                if stage not in self.stages: self.stages.append(stage)
+        h.add(seconds)
+
+    def snapshot(self):
+        """回傳 {stage: {p50, p95, p99, max, n}}，單位 ms"""
+        out = {}
+        for s in list(self.stages):
+            res = self.hists[s].percentiles()
+            if res is None: continue
+            (p50, p95, p99), mx = res
+            out[s] = {"p50": round(p50 * 1e3, 3), "p95": round(p95 * 1e3, 3),
+                      "p99": round(p99 * 1e3, 3), "max": round(mx * 1e3, 3),
+                      "n": self.hists[s].count}
+        return out
+
+
+class StageClock:
+    """迴圈內逐段計時：start() 後每次 lap(stage) 記錄與上一個時間點的差"""
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.t0 = self.t = time.perf_counter()
+
+    def start(self):
+        self.t0 = self.t = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.stats.add(stage, now - self.t)
+        self.t = now
+
+    def total(self, stage="total"):
+        self.stats.add(stage, time.perf_counter() - self.t0)
+
+
+class NullClock:
+    """不計時的 StageClock (離線重播用)"""
+
+    def start(self): pass
+    def lap(self, stage): pass
+    def total(self, stage="total"): pass
+
+
+NULL_CLOCK = NullClock()
@@ -0,0 +1,235 @@
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+@  文件名：recorder.py
+@  背景錄影：控制迴圈只把影格複製進預先配置的緩衝並排隊，
+@  XVID 編碼與寫檔在獨立執行緒，佇列滿了依策略丟棄，不會拖慢 _motor_drive。
+@  每次錄影 (session) 依時間/大小自動分段，並持續檢查 SD 卡剩餘空間。
+@  每段關檔時寫出旁路索引 (runindex.py)，可直接跳到指定影格或失線事件。
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+
+import os
+import shutil
+import threading
+import time
+import datetime
+import traceback
+from collections import deque
+import cv2
+import numpy as np
+from runindex import write_sidecar
+
+DROP_OLDEST = "drop_oldest"     # 佇列滿：丟掉最舊的 (錄影保持最新)
+DROP_NEWEST = "drop_newest"     # 佇列滿：丟掉這張新的 (錄影保持連續)
+POLICIES = (DROP_OLDEST, DROP_NEWEST)
+
+FRAME_INFO_DTYPE = np.dtype([("t", "<f8"), ("has_line", "u1"), ("cte", "<f4")])
+
+
+def free_mb(path):
+    return shutil.disk_usage(path).free / (1024 * 1024)
+
+
+class SegmentWriter:
+    """單次錄影的分段寫檔；只在錄影執行緒內使用"""
+
+    def __init__(self, out_dir, size, fps=20.0, fourcc="XVID", prefix="race",
+                 max_seconds=300.0, max_mb=500.0, min_free_mb=200.0):
+        self.out_dir = out_dir
+        self.size = size
+        self.fps = fps
+        self.fourcc = fourcc
+        self.prefix = prefix
+        self.max_seconds = max_seconds
+        self.max_mb = max_mb
+        self.min_free_mb = min_free_mb
+        self.session = None
+        self.segments = []
+        self.path = None
+        self._writer = None
+        self._seg_t0 = 0.0
+        self._seg_frames = 0
+        self._info = np.zeros(1024, dtype=FRAME_INFO_DTYPE)   # 本段每張影格的遙測，不夠時加倍
+
+    def begin(self, session):
+        self.session = session
+        self.segments = []
+
+    def _open_segment(self):
+        part = len(self.segments) + 1
+        self.path = os.path.join(self.out_dir, f"{self.prefix}_{self.session}_part{part:02d}.avi")
+        self._writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*self.fourcc), self.fps, self.size)
+        if not self._writer.isOpened():
+            self._writer = None
+            raise IOError(f"無法建立錄影檔: {self.path}")
+        self.segments.append(self.path)
+        self._seg_t0 = time.monotonic()
+        self._seg_frames = 0
+
+    def write(self, bgr, info):
+        """寫一張；回傳 None 表示正常，否則為停止錄影的原因"""
+        if self._writer is None:
+            self._open_segment()
+        self._writer.write(bgr)
+        if self._seg_frames == len(self._info):
+            self._info = np.concatenate([self._info, np.zeros_like(self._info)])
+        self._info[self._seg_frames] = info
+        self._seg_frames += 1
+
+        # 約每秒檢查一次：磁碟空間、分段長度與大小
+        if self._seg_frames % max(1, int(self.fps)) == 0:
+            if free_mb(self.out_dir) < self.min_free_mb:
+                self.close()
+                return "disk_low"
+            too_long = self.max_seconds and time.monotonic() - self._seg_t0 >= self.max_seconds
+            too_big = self.max_mb and os.path.getsize(self.path) >= self.max_mb * 1024 * 1024
+            if too_long or too_big:
+                self.close()            # 下一張影格開新分段
+        return None
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+            info = self._info[:self._seg_frames]
+            try:
+                write_sidecar(self.path, info["t"], info["has_line"], info["cte"])
+            except Exception as e:
+                print(f"Error writing index for {self.path}: {e}")
+
+
+class RecordingPipeline:
+    def __init__(self, frame_shape, out_dir, capacity=8, policy=DROP_OLDEST, fps=20.0, fourcc="XVID",
+                 max_seconds=300.0, max_mb=500.0, min_free_mb=200.0, perf=None):
+        if policy not in POLICIES:
+            raise ValueError(f"policy must be one of {POLICIES}")
+        self.policy = policy
+        self.perf = perf
+        self.out_dir = os.path.expanduser(out_dir)
+        self.min_free_mb = min_free_mb
+        self.segments = SegmentWriter(self.out_dir, (frame_shape[1], frame_shape[0]), fps=fps, fourcc=fourcc,
+                                      max_seconds=max_seconds, max_mb=max_mb, min_free_mb=min_free_mb)
+        self.pool = [np.empty(frame_shape, dtype=np.uint8) for _ in range(capacity)]
+        self.info = np.zeros(capacity, dtype=FRAME_INFO_DTYPE)
+        self._bgr = np.empty(frame_shape, dtype=np.uint8)
+        self.free = deque(range(capacity))
+        self.queue = deque()        # ("frame", idx) / ("open", session) / ("close", None)，依序處理
+        self.cond = threading.Condition()
+        self.active = False
+        self.busy = False           # 寫檔執行緒正在處理一筆工作
+        self._writing = False       # 寫檔執行緒：處理過 open、還沒處理 close (stop 之前排進來的影格照寫)
+        self.stop_reason = None
+        self.submitted = 0
+        self.encoded = 0
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    # ---- 控制端 (Flask) ----
+    def start(self):
+        """開始新的錄影；回傳 (ok, 訊息)"""
+        try:
+            os.makedirs(self.out_dir, exist_ok=True)
+            space = free_mb(self.out_dir)
+        except OSError as e:
+            return False, str(e)
+        if space < self.min_free_mb:
+            return False, f"磁碟剩餘 {space:.0f} MB，低於 {self.min_free_mb:.0f} MB"
+        with self.cond:
+            if self.active: return False, "already recording"
+            self.active = True
+            self.stop_reason = None
+            self.queue.append(("open", datetime.datetime.now().strftime('%Y%m%d_%H%M%S')))
+            self.cond.notify_all()
+        return True, self.out_dir
+
+    def stop(self, reason="user"):
+        with self.cond:
+            if not self.active: return False
+            self.active = False
+            self.stop_reason = reason
+            self.queue.append(("close", None))
+            self.cond.notify_all()
+        return True
+
+    def close(self, timeout=3.0):
+        """停止錄影並等佇列寫完、檔案關閉 (關機前呼叫)"""
+        self.stop("shutdown")
+        with self.cond:
+            return self.cond.wait_for(lambda: not self.queue and not self.busy, timeout)
+
+    def stats(self):
+        return {"rec_encoded": self.encoded, "rec_dropped": self.dropped,
+                "rec_queue": len(self.queue), "rec_policy": self.policy,
+                "rec_file": self.segments.path, "rec_segments": len(self.segments.segments),
+                "rec_stop_reason": self.stop_reason}
+
+    # ---- 控制迴圈 ----
+    def submit(self, frame, t=0.0, has_line=False, cte=0.0):
+        """不阻塞：拿一個空緩衝複製影格；沒空位時依策略丟棄"""
+        with self.cond:
+            if not self.active: return False
+            self.submitted += 1
+            if self.free:
+                idx = self.free.popleft()
+            elif self.policy == DROP_NEWEST:
+                self.dropped += 1
+                return False
+            else:
+                idx = self._steal_oldest()
+                if idx is None:
+                    self.dropped += 1
+                    return False
+        np.copyto(self.pool[idx], frame)
+        self.info[idx] = (t, has_line, cte)
+        with self.cond:
+            self.queue.append(("frame", idx))
+            self.cond.notify_all()
+        return True
+
+    def _steal_oldest(self):
+        for i, (kind, idx) in enumerate(self.queue):
+            if kind == "frame":
+                del self.queue[i]
+                self.dropped += 1
+                return idx
+        return None
+
+    # ---- 寫檔執行緒 ----
+    def _run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.queue)
+                kind, arg = self.queue.popleft()
+                self.busy = True
+            reason = None
+            skipped = False
+            try:
+                if kind == "open":
+                    self.segments.close()
+                    self.segments.begin(arg)
+                    self._writing = True
+                elif kind == "close":
+                    self.segments.close()
+                    self._writing = False
+                elif kind == "frame" and not self._writing:
+                    skipped = True          # 因錯誤 / 磁碟不足停錄後還在佇列的影格：不再開新分段
+                elif kind == "frame":
+                    t0 = time.perf_counter()
+                    cv2.cvtColor(self.pool[arg], cv2.COLOR_RGB2BGR, dst=self._bgr)
+                    reason = self.segments.write(self._bgr, self.info[arg])
+                    self.encoded += 1
+                    if self.perf is not None: self.perf.add("rec_write", time.perf_counter() - t0)
+            except Exception as e:
+                print(f"Error in recorder: {e}")
+                traceback.print_exc()
+                reason = "error"
+            finally:
+                with self.cond:
+                    if kind == "frame": self.free.append(arg)
+                    if skipped: self.dropped += 1
+                    self.busy = False
+                    self.cond.notify_all()
+            if reason is not None:
+                print(f"Recording stopped: {reason}")
+                self._writing = False
+                self.segments.close()
+                self.stop(reason)
@@ -0,0 +1,104 @@
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+@  文件名：replay_runlog.py
+@  以 lane_core 重播 run log，逐筆比對偵測結果與馬達指令 (逐位元相同才算通過)
+@  用法：python3 src/replay_runlog.py runs/20250101_120000 [--show 10]
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+
+import argparse
+import sys
+import time
+from lane_core import LaneDetector, LaneController, make_config
+from runlog import RunLog, MODES
+
+CHECK_FIELDS = ("mask_used", "lx", "rx", "lane_center", "has_line", "cte", "mask_px", "cmd", "l", "r", "steering")
+
+
+DET_STATE = ("s_center", "s_width", "s_t_lx", "s_t_rx", "s_t_used", "s_t_flags", "s_t_version", "s_t_age")
+
+
+def _det_state(rec):
+    # 格式 1 沒有追蹤窗欄位，視為沒有追蹤
+    names = rec.dtype.names
+    return tuple(int(rec[k]) if k in names else 0 for k in DET_STATE)
+
+
+def seed(detector, controller, rec):
+    detector.restore(*_det_state(rec))
+    controller.restore(rec["s_err_last"], rec["s_last_steer"], rec["s_lost_start"], int(rec["s_flags"]))
+
+
+def state_matches(detector, controller, rec):
+    err_last, last_steer, lost, flags = controller.state()
+    same_lost = (lost == rec["s_lost_start"]) or (lost != lost and rec["s_lost_start"] != rec["s_lost_start"])
+    det_state = detector.state()
+    if "s_t_used" not in rec.dtype.names: det_state = det_state[:2] + (0,) * 6
+    return (det_state == _det_state(rec)
+            and err_last == rec["s_err_last"] and last_steer == rec["s_last_steer"]
+            and same_lost and flags == rec["s_flags"])
+
+
+def replay(log, show=10):
+    hh = log.frame_shape[0]
+    detector = LaneDetector(log.frame_shape[1], use_lut=log.use_lut, space=log.space)
+    controller = LaneController()
+    cfg_cache = {}
+    # 舊格式沒有的欄位不比對
+    check = CHECK_FIELDS + tuple(k for k in ("tracked", "near_cte", "far_cte", "curvature") if k in log.dtype.names)
+    ticks = mismatches = gaps = 0
+    prev_tick = None
+    t_first = t_last = None
+    t0 = time.perf_counter()
+
+    for roi, rec in log.ticks():
+        version = int(rec["params_version"])
+        cfg = cfg_cache.get(version)
+        if cfg is None:
+            cfg = cfg_cache[version] = make_config(log.params[version], hh, version)
+        if cfg.roi_y != rec["roi_y"]:
+            raise ValueError(f"tick {rec['tick']}: roi_y {rec['roi_y']} 與參數版本 {version} 不符")
+
+        # 第一筆或中間有丟棄：直接套用記錄的狀態；否則狀態也要一致
+        tick = int(rec["tick"])
+        if prev_tick is None or tick != prev_tick + 1:
+            if prev_tick is not None: gaps += 1
+            seed(detector, controller, rec)
+        elif not state_matches(detector, controller, rec):
+            mismatches += 1
+            if mismatches <= show: print(f"tick {tick}: state diverged")
+            seed(detector, controller, rec)
+        prev_tick = tick
+
+        det = detector.detect(roi, cfg)
+        cmd = controller.step(det, cfg, MODES[rec["mode"]], float(rec["t"]))
+        got = {"mask_used": det.used, "lx": -1 if det.lx is None else det.lx,
+               "rx": -1 if det.rx is None else det.rx, "lane_center": det.lane_center,
+               "has_line": int(det.has_line), "cte": det.cte, "mask_px": det.mask_px,
+               "cmd": cmd.cmd, "l": cmd.l, "r": cmd.r, "steering": cmd.steering, "tracked": int(det.tracked),
+               "near_cte": det.near_cte, "far_cte": det.far_cte, "curvature": det.curvature}
+        diff = [k for k in check if got[k] != rec[k]]
+        if diff:
+            mismatches += 1
+            if mismatches <= show:
+                print(f"tick {tick}: " + ", ".join(f"{k} {rec[k]} -> {got[k]}" for k in diff))
+
+        ticks += 1
+        if t_first is None: t_first = float(rec["t"])
+        t_last = float(rec["t"])
+
+    dt = max(1e-6, time.perf_counter() - t0)
+    span = (t_last - t_first) if ticks else 0.0
+    print(f"replayed {ticks} ticks in {dt:.2f}s ({ticks/dt:.1f} ticks/s, {span/dt:.1f}x real time), "
+          f"{mismatches} mismatches, {gaps} gaps")
+    return mismatches
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Replay a run log through lane_core")
+    ap.add_argument("path", help="run log 目錄 (main.py --runlog 產生)")
+    ap.add_argument("--show", type=int, default=10, help="最多列出幾筆不一致")
+    args = ap.parse_args(argv)
+    return 1 if replay(RunLog(args.path), args.show) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
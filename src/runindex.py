@@ -0,0 +1,213 @@
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+@  文件名：runindex.py
+@  錄影檔的旁路索引：每段 .avi 關檔時寫出
+@    <檔名>.idx.npy      每張影格一筆 (影格號, 時間, AVI 位元組位置, 關鍵影格, has_line, cte)，可 mmap
+@    <檔名>.events.json  失線事件 (開始影格/時間/長度/可跳轉的關鍵影格)
+@  用法：
+@    python3 src/runindex.py events ~/Videos                    列出所有錄影的失線事件
+@    python3 src/runindex.py frame race_..._part01.avi 1234 -o f.png   跳到指定影格
+@    python3 src/runindex.py build race_..._part01.avi          舊錄影補建索引 (無遙測)
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+
+import argparse
+import glob
+import json
+import os
+import struct
+import sys
+import tempfile
+import numpy as np
+
+INDEX_DTYPE = np.dtype([
+    ("frame", "<u4"),
+    ("t", "<f8"),               # 控制迴圈時間 (time.time())
+    ("offset", "<i8"),          # 影格資料在 .avi 中的位元組位置 (找不到 idx1 時為 -1)
+    ("size", "<u4"),
+    ("keyframe", "u1"),
+    ("has_line", "u1"),
+    ("cte", "<f4"),
+])
+AVIIF_KEYFRAME = 0x10
+
+
+def index_path(avi): return os.path.splitext(avi)[0] + ".idx.npy"
+def events_path(avi): return os.path.splitext(avi)[0] + ".events.json"
+
+
+def _find_chunk(f, fourcc, start, end, list_type=None):
+    """在 [start, end) 找 RIFF chunk；回傳 (資料起點, 大小)"""
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        cid, size = struct.unpack("<4sI", f.read(8))
+        if cid == fourcc and (list_type is None or f.read(4) == list_type):
+            return pos + 8, size
+        pos += 8 + size + (size & 1)
+    return None
+
+
+def parse_avi_index(path):
+    """讀 AVI 的 idx1：回傳影像串流每張影格的 (offset, size, keyframe) 陣列，沒有 idx1 回傳 None"""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END); end = f.tell(); f.seek(0)
+        if f.read(12)[8:12] != b"AVI ": return None
+        movi = _find_chunk(f, b"LIST", 12, end, b"movi")
+        idx1 = _find_chunk(f, b"idx1", 12, end)
+        if movi is None or idx1 is None: return None
+        f.seek(idx1[0])
+        raw = np.frombuffer(f.read(idx1[1] // 16 * 16), dtype=[("id", "S4"), ("flags", "<u4"), ("offset", "<u4"), ("size", "<u4")])
+    # 只取影像串流 00dc / 00db
+    video = raw[np.char.endswith(raw["id"], b"dc") | np.char.endswith(raw["id"], b"db")]
+    # idx1 的位置相對於 "movi" 標記 (少數寫法是檔案絕對位置)，資料在 8 bytes chunk 標頭之後
+    base = movi[0] if len(video) and video["offset"][0] < movi[0] else 0
+    offsets = video["offset"].astype(np.int64) + base + 8
+    return offsets, video["size"], (video["flags"] & AVIIF_KEYFRAME) != 0
+
+
+def lost_line_events(index):
+    """has_line 1→0 的轉折；seek_frame 是事件前最近的關鍵影格，從那裡解碼即可"""
+    has = index["has_line"].astype(np.int8)
+    if len(has) == 0: return []
+    edges = np.diff(np.concatenate(([1], has, [1])))
+    starts = np.flatnonzero(edges == -1)
+    ends = np.flatnonzero(edges == 1)
+    keys = np.flatnonzero(index["keyframe"])
+    events = []
+    for s, e in zip(starts, ends):
+        k = keys[np.searchsorted(keys, s, side="right") - 1] if len(keys) and keys[0] <= s else 0
+        events.append({"frame": int(s), "t": float(index["t"][s]), "frames": int(e - s),
+                       "duration": float(index["t"][e - 1] - index["t"][s]), "seek_frame": int(k)})
+    return events
+
+
+def write_sidecar(avi, t, has_line, cte):
+    """關檔後建立索引；t / has_line / cte 為每張寫入影格的遙測"""
+    n = len(t)
+    index = np.zeros(n, dtype=INDEX_DTYPE)
+    index["frame"] = np.arange(n)
+    index["t"] = t; index["has_line"] = has_line; index["cte"] = cte
+    index["offset"] = -1
+    parsed = parse_avi_index(avi)
+    if parsed is not None:
+        offsets, sizes, keys = parsed
+        m = min(n, len(offsets))
+        index["offset"][:m] = offsets[:m]; index["size"][:m] = sizes[:m]; index["keyframe"][:m] = keys[:m]
+    else:
+        index["keyframe"][:1] = 1
+    np.save(index_path(avi), index)
+    events = lost_line_events(index)
+    with open(events_path(avi), "w") as f:
+        json.dump({"video": os.path.basename(avi), "frames": n,
+                   "t0": float(t[0]) if n else None, "events": events}, f)
+    return index, events
+
+
+def load_index(avi):
+    return np.load(index_path(avi), mmap_mode="r")
+
+
+def read_frame(avi, n, index=None):
+    """
+    跳到第 n 張：用索引記下的位元組位置直接讀資料區塊，不靠容器的 seek。
+    最近的關鍵影格到第 n 張的區塊接在原檔標頭後面成一個小 AVI 依序解碼 (MJPG 每張都是關鍵影格，只有一塊)；
+    與回放用同一個解碼器，結果逐位元相同。舊檔沒有 idx1 (offset 為 -1) 才退回 CAP_PROP_POS_FRAMES
+    """
+    import cv2
+    if index is None: index = load_index(avi)
+    if not 0 <= n < len(index): return None
+    if index["offset"][n] < 0: return _read_frame_seek(avi, n, index)
+    k = _key_before(index, n)
+    with open(avi, "rb") as f:
+        clip = _clip_avi(f, index[k:n + 1])
+    fd, tmp = tempfile.mkstemp(suffix=".avi")
+    try:
+        with os.fdopen(fd, "wb") as out: out.write(clip)
+        cap = cv2.VideoCapture(tmp)
+        try:
+            for _ in range(n - k):
+                if not cap.grab(): return None
+            ok, frame = cap.read()
+            return frame if ok else None
+        finally:
+            cap.release()
+    finally:
+        os.unlink(tmp)
+
+
+def _key_before(index, n):
+    keys = np.flatnonzero(index["keyframe"][:n + 1])
+    return int(keys[-1]) if len(keys) else 0
+
+
+def _clip_avi(f, rows):
+    """原檔 movi 之前的標頭 (hdrl，串流格式不變) + 只含 rows 這幾張的 movi；不寫 idx1，解碼端依序讀"""
+    f.seek(0, os.SEEK_END); end = f.tell()
+    movi = _find_chunk(f, b"LIST", 12, end, b"movi")
+    f.seek(0)
+    head = bytearray(f.read(movi[0] - 8))
+    chunks = []
+    for off, size in zip(rows["offset"], rows["size"]):
+        f.seek(int(off) - 8)                    # 連同 chunk 標頭 (00dc + 大小) 一起複製
+        chunks.append(f.read(8 + int(size) + (int(size) & 1)))
+    body = b"".join(chunks)
+    clip = head + b"LIST" + struct.pack("<I", 4 + len(body)) + b"movi" + body
+    clip[4:8] = struct.pack("<I", len(clip) - 8)
+    return bytes(clip)
+
+
+def _read_frame_seek(avi, n, index):
+    """沒有位元組位置時：從之前最近的關鍵影格以容器的 seek 開始解碼"""
+    import cv2
+    k = _key_before(index, n)
+    cap = cv2.VideoCapture(avi)
+    try:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, k)
+        for _ in range(n - k):
+            if not cap.grab(): return None
+        ok, frame = cap.read()
+        return frame if ok else None
+    finally:
+        cap.release()
+
+
+def _cmd_events(args):
+    for path in sorted(glob.glob(os.path.join(os.path.expanduser(args.dir), "*.events.json"))):
+        with open(path) as f: info = json.load(f)
+        for e in info["events"]:
+            print(f"{info['video']}  frame {e['frame']:>6}  +{e['t'] - info['t0']:8.2f}s  "
+                  f"lost {e['frames']:>4} frames ({e['duration']:.2f}s)  seek {e['seek_frame']}")
+
+
+def _cmd_frame(args):
+    import cv2
+    frame = read_frame(args.video, args.n)
+    if frame is None:
+        print("frame out of range"); return 1
+    cv2.imwrite(args.out, frame)
+    print(f"wrote {args.out}")
+    return 0
+
+
+def _cmd_build(args):
+    import cv2
+    cap = cv2.VideoCapture(args.video)
+    n = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)); fps = cap.get(cv2.CAP_PROP_FPS) or 20.0
+    cap.release()
+    _, events = write_sidecar(args.video, np.arange(n) / fps, np.ones(n, np.uint8), np.zeros(n, np.float32))
+    print(f"indexed {n} frames -> {index_path(args.video)}")
+    return 0
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Seek index for recorded runs")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("events", help="列出目錄下所有錄影的失線事件"); p.add_argument("dir")
+    p = sub.add_parser("frame", help="輸出指定影格"); p.add_argument("video"); p.add_argument("n", type=int)
+    p.add_argument("-o", "--out", default="frame.png")
+    p = sub.add_parser("build", help="為沒有索引的錄影補建索引"); p.add_argument("video")
+    args = ap.parse_args(argv)
+    return {"events": _cmd_events, "frame": _cmd_frame, "build": _cmd_build}[args.cmd](args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,216 @@
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+@  文件名：runlog.py
+@  執行紀錄：每次迴圈的原始 ROI 影像 + 遙測，分段、只追加、可 np.memmap，
+@  供 replay_runlog.py 逐位元重播 (XVID 有損壓縮無法重現失線事件)
+@
+@  目錄結構：
+@    meta.json            影格尺寸、是否使用 HSV 查表、ROI 來源 (bgr / i420 = lores 解碼)、遙測 dtype
+@    params.jsonl         每個 params_version 的完整參數 (版本變動時追加一行)
+@    index.jsonl          每個分段一行：{"chunk": n, "roi_shape": [h, w, 3]}
+@    chunk_NNNNN.roi      uint8 [n, h, w, 3]，同一分段 ROI 尺寸固定 (roi_y 改變就換分段)
+@    chunk_NNNNN.tel      TELEMETRY_DTYPE [n]
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+
+import os
+import json
+import threading
+import time
+import traceback
+from collections import deque
+import numpy as np
+
+FORMAT_VERSION = 3
+MODES = ("stop", "auto")
+
+TELEMETRY_DTYPE = np.dtype([
+    ("tick", "<u8"),            # 控制迴圈序號 (丟棄的紀錄會留下缺號)
+    ("seq", "<u8"),             # FrameRing 影格序號
+    ("t_capture", "<f8"),       # 影格送達 (perf_counter)
+    ("t", "<f8"),               # 控制用時間 (time.time()，失線逾時依此計算)
+    ("params_version", "<u4"),
+    ("roi_y", "<u2"),
+    ("mode", "u1"),             # MODES 索引
+    # 處理前的狀態：重播可從任一筆開始
+    ("s_center", "<i2"), ("s_width", "<i2"),
+    ("s_t_lx", "<i2"), ("s_t_rx", "<i2"), ("s_t_used", "u1"), ("s_t_flags", "u1"),     # 追蹤窗 (s_t_used=0 表示沒有)
+    ("s_t_version", "<u4"), ("s_t_age", "<u2"),
+    ("s_err_last", "<f8"), ("s_last_steer", "<f8"), ("s_lost_start", "<f8"), ("s_flags", "u1"),
+    # 偵測結果 (lx / rx 沒找到記 -1)
+    ("mask_used", "u1"), ("lx", "<i2"), ("rx", "<i2"), ("lane_center", "<i2"),
+    ("has_line", "u1"), ("cte", "<f8"), ("mask_px", "<u4"), ("tracked", "u1"),
+    ("near_cte", "<f8"), ("far_cte", "<f8"), ("curvature", "<f8"),     # 多帶擬合 (curve_bands=1 時 near=far)
+    # 控制輸出
+    ("cmd", "u1"), ("l", "u1"), ("r", "u1"), ("steering", "<f8"),
+])
+
+
+def _append_line(path, obj):
+    with open(path, "a") as f:
+        f.write(json.dumps(obj) + "\n")
+
+
+def _read_lines(path):
+    if not os.path.exists(path): return []
+    with open(path) as f:
+        # 最後一行可能寫到一半 (斷電)，略過
+        out = []
+        for line in f:
+            try: out.append(json.loads(line))
+            except ValueError: break
+        return out
+
+
+class RunLogWriter:
+    """控制迴圈只複製進預先配置的槽並排隊，寫檔在獨立執行緒；佇列滿丟最新一筆"""
+
+    def __init__(self, path, frame_shape, use_lut=True, chunk_ticks=300, capacity=32, perf=None, space="bgr"):
+        self.path = path
+        self.frame_shape = tuple(frame_shape)
+        self.chunk_ticks = chunk_ticks
+        self.perf = perf
+        os.makedirs(path, exist_ok=True)
+        if os.listdir(path):
+            raise FileExistsError(f"run log 目錄不是空的: {path}")
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({"format": FORMAT_VERSION, "frame_shape": list(frame_shape), "hsv_lut": bool(use_lut), "space": space,
+                       "telemetry_dtype": TELEMETRY_DTYPE.descr}, f)
+
+        nbytes = int(np.prod(frame_shape))
+        self.pool = [np.empty(nbytes, dtype=np.uint8) for _ in range(capacity)]
+        self.tel = np.zeros(capacity, dtype=TELEMETRY_DTYPE)
+        self.shapes = [None] * capacity
+        self.params = [None] * capacity
+        self.free = deque(range(capacity))
+        self.queue = deque()
+        self.cond = threading.Condition()
+        self.running = True
+        self.busy = False
+        self.written = 0
+        self.dropped = 0
+        self.chunks = 0
+        self._chunk = None          # (roi 檔, tel 檔, roi_shape, 筆數)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, roi, fields, params=None):
+        """roi 必須在覆寫/疊圖前送進來；params 只在版本變動時給 (完整 PARAMS 副本)"""
+        with self.cond:
+            if not self.running: return False
+            if not self.free:
+                self.dropped += 1
+                return False
+            idx = self.free.popleft()
+        np.copyto(self.pool[idx][:roi.size].reshape(roi.shape), roi)
+        rec = self.tel[idx]
+        for k, v in fields.items(): rec[k] = v
+        self.shapes[idx] = roi.shape
+        self.params[idx] = params
+        with self.cond:
+            self.queue.append(idx)
+            self.cond.notify_all()
+        return True
+
+    def close(self, timeout=3.0):
+        with self.cond:
+            self.cond.wait_for(lambda: not self.queue and not self.busy, timeout)
+            self.running = False
+            self.cond.notify_all()
+        self.thread.join(timeout)
+
+    def stats(self):
+        return {"runlog_written": self.written, "runlog_dropped": self.dropped,
+                "runlog_chunks": self.chunks, "runlog_queue": len(self.queue)}
+
+    def _open_chunk(self, shape):
+        self._close_chunk()
+        n = self.chunks
+        base = os.path.join(self.path, f"chunk_{n:05d}")
+        _append_line(os.path.join(self.path, "index.jsonl"), {"chunk": n, "roi_shape": list(shape)})
+        # buffering=0：每筆直接寫出，當機時最多損失最後一筆
+        self._chunk = [open(base + ".roi", "ab", buffering=0), open(base + ".tel", "ab", buffering=0), shape, 0]
+        self.chunks += 1
+
+    def _close_chunk(self):
+        if self._chunk is not None:
+            self._chunk[0].close(); self._chunk[1].close()
+            self._chunk = None
+
+    def _write(self, idx):
+        if self.params[idx] is not None:
+            _append_line(os.path.join(self.path, "params.jsonl"),
+                         {"version": int(self.tel[idx]["params_version"]), "params": self.params[idx]})
+        shape = self.shapes[idx]
+        if self._chunk is None or self._chunk[2] != shape or self._chunk[3] >= self.chunk_ticks:
+            self._open_chunk(shape)
+        n = int(np.prod(shape))
+        self._chunk[0].write(memoryview(self.pool[idx][:n]))
+        self._chunk[1].write(self.tel[idx:idx+1].tobytes())
+        self._chunk[3] += 1
+        self.written += 1
+
+    def _run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.queue or not self.running)
+                if not self.queue: break
+                idx = self.queue.popleft()
+                self.busy = True
+            t0 = time.perf_counter()
+            try:
+                self._write(idx)
+            except Exception as e:
+                print(f"Error in runlog: {e}")
+                traceback.print_exc()
+            finally:
+                with self.cond:
+                    self.free.append(idx)
+                    self.busy = False
+                    self.cond.notify_all()
+            if self.perf is not None: self.perf.add("runlog", time.perf_counter() - t0)
+        self._close_chunk()
+
+
+class RunLog:
+    """讀取端：各分段以 np.memmap 開啟，不載入記憶體"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta["format"] > FORMAT_VERSION:
+            raise ValueError(f"不支援的 run log 格式: {self.meta['format']}")
+        # 依檔案內記錄的 dtype 讀取，舊格式少的欄位重播時略過
+        self.dtype = np.dtype([tuple(f) for f in self.meta["telemetry_dtype"]])
+        self.frame_shape = tuple(self.meta["frame_shape"])
+        self.use_lut = self.meta["hsv_lut"]
+        self.space = self.meta.get("space", "bgr")
+        self.params = {p["version"]: p["params"] for p in _read_lines(os.path.join(path, "params.jsonl"))}
+        self.index = _read_lines(os.path.join(path, "index.jsonl"))
+
+    def chunk(self, n):
+        """回傳 (rois, tel)；筆數取兩個檔案都完整寫入的部分"""
+        shape = tuple(self.index[n]["roi_shape"])
+        base = os.path.join(self.path, f"chunk_{n:05d}")
+        frame_bytes = int(np.prod(shape))
+        count = min(os.path.getsize(base + ".roi") // frame_bytes,
+                    os.path.getsize(base + ".tel") // self.dtype.itemsize)
+        if count == 0:
+            return np.empty((0,) + shape, np.uint8), np.empty(0, self.dtype)
+        rois = np.memmap(base + ".roi", dtype=np.uint8, mode="r", shape=(count,) + shape)
+        tel = np.memmap(base + ".tel", dtype=self.dtype, mode="r", shape=(count,))
+        return rois, tel
+
+    def __len__(self):
+        return len(self.index)
+
+    def ticks(self):
+        """依序產生 (roi, tel 紀錄)"""
+        for n in range(len(self.index)):
+            rois, tel = self.chunk(n)
+            for i in range(len(tel)):
+                yield rois[i], tel[i]
+
+    def telemetry(self):
+        """全部遙測接成一個陣列 (只讀遙測檔，不碰影像)"""
+        parts = [self.chunk(n)[1] for n in range(len(self.index))]
+        return np.concatenate(parts) if parts else np.empty(0, self.dtype)
@@ -0,0 +1,50 @@
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+@  文件名：sim_robot.py
+@  無硬體時的替身車體：介面與 LOBOROBOT 相同，只記錄指令不寫 I2C
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+
+import time
+
+FORWARD = 'forward'
+BACKWARD = 'backward'
+
+
+class SimRobot:
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.speeds = [0, 0, 0, 0]      # 四輪目前速度 (正=前進)
+        self.servos = {}
+        self.motor_calls = 0
+        self.stop_calls = 0
+
+    def _validate_speed(self, speed):
+        if not 0 <= speed <= 100:
+            raise ValueError("Speed must be between 0 and 100")
+
+    def MotorRun(self, motor, direction, speed):
+        self._validate_speed(speed)
+        self.speeds[motor] = speed if direction == FORWARD else -speed
+        self.motor_calls += 1
+        if self.verbose:
+            print(f"SIM: motor {motor} {direction} {speed}")
+
+    def MotorRunAll(self, runs):
+        for motor, direction, speed in runs:
+            self.MotorRun(motor, direction, speed)
+
+    def MotorStop(self, motor):
+        self.speeds = [0, 0, 0, 0]
+
+    def t_stop(self, t_time):
+        self.speeds = [0, 0, 0, 0]
+        self.stop_calls += 1
+        if t_time > 0:
+            time.sleep(t_time)
+
+    def set_servo_angle(self, channel, angle, t_time):
+        self.servos[channel] = angle
+        if t_time > 0:
+            time.sleep(t_time)
+
+    def stop_servo_angle(self, channel):
+        self.servos.pop(channel, None)
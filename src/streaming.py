@@ -0,0 +1,279 @@
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+@  文件名：streaming.py
+@  /live_view 串流相關：觀看者登記 (只產生有人在看的除錯畫面)、
+@  MJPEG 廣播 (每張影格每種畫面、每種品質/尺寸只編碼一次，所有觀看者共用)、
+@  每個連線依寫出耗時自動調降品質 / 尺寸 / 幀率 (ViewerLink)、
+@  m=grid 四格合成畫面 (有人看 grid 時才合成，一張影格只合成、編碼一次)、
+@  二值遮罩的 np.packbits (/api/mask_stream 用，見 mask_stream.py)
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+
+import itertools
+import socket
+import threading
+import time
+import cv2
+import numpy as np
+
+VIEW_MODES = ("cv", "mask", "maskw", "masky")
+MASK_VIEWS = ("mask", "maskw", "masky")     # 控制迴圈給單通道 0/255 影像
+GRID = "grid"               # 四種畫面縮小拼成一張；不是獨立的來源畫面 (共享記憶體不留位置)
+
+QUALITY_DEFAULT = 80
+QUALITY_MIN, QUALITY_MAX = 10, 95
+SCALES = (1.0, 0.75, 0.5, 0.25)     # 只用這幾種，觀看者之間才共用得到編碼結果
+FPS_MIN, FPS_MAX = 1.0, 25.0
+SEND_BUFFER = 16384                 # 串流連線的 SO_SNDBUF：核心只替慢的觀看者排幾張，寫出耗時才反映得出網路
+# (品質比例, 縮小幾級, 幀率比例)：寫出太慢就往下一級，先降品質再縮圖最後降幀率
+LEVELS = ((1.0, 0, 1.0), (0.75, 0, 1.0), (0.6, 1, 1.0), (0.5, 2, 0.5), (0.4, 3, 0.25))
+SLOW = 0.5                          # 寫一張超過影格間隔的這個比例 → 降一級
+FAST = 0.1                          # 連續 RECOVER 張都低於這個比例 → 升一級 (介於中間就重新計數)
+RECOVER = 50
+
+
+def normalize_view(m):
+    return m if m in VIEW_MODES or m == GRID else "cv"
+
+
+def _active(counts):
+    """grid 需要四種來源畫面都產生"""
+    if GRID in counts: return frozenset(counts) | frozenset(VIEW_MODES)
+    return frozenset(counts)
+
+
+def _num(v, default, lo, hi):
+    try: v = float(v)
+    except (TypeError, ValueError): return default
+    return max(lo, min(hi, v)) if v == v else default
+
+
+def limit_send_buffer(sock, size=SEND_BUFFER):
+    if sock is None: return
+    try: sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, size)
+    except OSError: pass
+
+
+class ViewerLink:
+    """
+    一個 /live_view 連線：?q= ?scale= ?fps= 是上限，實際設定依寫出耗時在 LEVELS 之間移動。
+    sent() 每送出一張呼叫一次；寫的期間又有新影格 publish 就算丟棄 (只送最新的，不排隊)
+    """
+
+    _ids = itertools.count(1)
+    levels = LEVELS
+    fmt = "jpeg"
+
+    def __init__(self, m, q=None, scale=None, fps=None):
+        self.id = next(self._ids)
+        self.m = normalize_view(m)
+        self.max_q = int(_num(q, QUALITY_DEFAULT, QUALITY_MIN, QUALITY_MAX))
+        s = _num(scale, 1.0, SCALES[-1], SCALES[0])
+        self.base_scale = min(range(len(SCALES)), key=lambda i: abs(SCALES[i] - s))
+        self.max_fps = _num(fps, FPS_MAX, FPS_MIN, FPS_MAX)
+        self.level = 0
+        self._fast = 0
+        self._apply()
+        self.frames = 0
+        self.bytes = 0
+        self.dropped = 0
+        self.rate = 0.0                 # bytes/s，每秒更新
+        self._win = (time.monotonic(), 0)
+
+    def _apply(self):
+        qr, ds, fr = self.levels[self.level]
+        self.q = max(QUALITY_MIN, int(round(self.max_q * qr / 5)) * 5)
+        self.scale = SCALES[min(len(SCALES) - 1, self.base_scale + ds)]
+        self.period = 1.0 / max(FPS_MIN, self.max_fps * fr)
+
+    def sent(self, nbytes, write_s, missed):
+        """回傳送下一張前要等的秒數"""
+        self.frames += 1
+        self.bytes += nbytes
+        self.dropped += max(0, missed)
+        if write_s > self.period * SLOW:
+            self._fast = 0
+            if self.level < len(self.levels) - 1:
+                self.level += 1; self._apply()
+        elif write_s < self.period * FAST:
+            self._fast += 1
+            if self._fast >= RECOVER and self.level > 0:
+                self._fast = 0
+                self.level -= 1; self._apply()
+        else:
+            self._fast = 0
+        now = time.monotonic()
+        t0, b0 = self._win
+        if now - t0 >= 1.0:
+            self.rate = (self.bytes - b0) / (now - t0)
+            self._win = (now, self.bytes)
+        return max(0.0, self.period - write_s)
+
+    def stats(self):
+        return {"id": self.id, "m": self.m, "fmt": self.fmt, "q": self.q, "scale": self.scale, "fps": round(1.0 / self.period, 1),
+                "level": self.level, "kBps": round(self.rate / 1e3, 1), "dropped": self.dropped}
+
+
+class ViewRegistry:
+    """
+    記錄每種畫面目前有幾個觀看者 (與每個連線的 ViewerLink)。
+    控制迴圈每張影格只讀 self.active (frozenset)，不需要拿鎖。
+    """
+
+    def __init__(self):
+        self._counts = {}
+        self._links = set()
+        self._lock = threading.Lock()
+        self.active = frozenset()
+
+    def subscribe(self, m, link=None):
+        with self._lock:
+            self._counts[m] = self._counts.get(m, 0) + 1
+            if link is not None: self._links.add(link)
+            self.active = _active(self._counts)
+
+    def unsubscribe(self, m, link=None):
+        with self._lock:
+            n = self._counts.get(m, 0) - 1
+            if n > 0: self._counts[m] = n
+            else: self._counts.pop(m, None)
+            self._links.discard(link)
+            self.active = _active(self._counts)
+
+    def counts(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def clients(self):
+        """每個觀看者的設定與 bytes/s、丟棄張數 (遙測用)"""
+        with self._lock:
+            links = sorted(self._links, key=lambda l: l.id)
+        return [l.stats() for l in links]
+
+
+class GridCanvas:
+    """
+    預先配置的 [h, w, 3] 畫布，2x2 格依 VIEW_MODES 順序放 cv / mask / maskw / masky；
+    每格等比縮小貼齊左上 (遮罩只有 ROI 高度)，還沒有的畫面留黑
+    """
+
+    def __init__(self, shape):
+        self.canvas = np.zeros(shape, np.uint8)
+        h, w = shape[:2]
+        self.tile = (h // 2, w // 2)
+        self.origins = [(r * (h // 2), c * (w // 2)) for r in range(2) for c in range(2)]
+
+    def compose(self, frames):
+        th, tw = self.tile
+        for (y, x), m in zip(self.origins, VIEW_MODES):
+            cell = self.canvas[y:y + th, x:x + tw]
+            img = frames.get(m)
+            if img is None:
+                cell[:] = 0; continue
+            s = min(th / img.shape[0], tw / img.shape[1])
+            nh, nw = max(1, int(img.shape[0] * s)), max(1, int(img.shape[1] * s))
+            if img.ndim == 2:       # 遮罩：縮小後再展成三通道貼上
+                cv2.cvtColor(cv2.resize(img, (nw, nh), interpolation=cv2.INTER_AREA), cv2.COLOR_GRAY2BGR, dst=cell[:nh, :nw])
+            else:
+                cv2.resize(img, (nw, nh), dst=cell[:nh, :nw], interpolation=cv2.INTER_AREA)
+            cell[nh:] = 0
+            cv2.putText(cell, m, (4, 14), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 0), 1, cv2.LINE_AA)
+        return self.canvas
+
+
+class MjpegBroadcaster:
+    """
+    控制迴圈 publish() 一組畫面後，第一個來要某 (模式, 品質, 尺寸) 的觀看者負責編碼，
+    其他觀看者直接拿同一份 bytes；影格序號沒變就完全不編碼。
+    """
+
+    def __init__(self, quality=QUALITY_DEFAULT, perf=None, grid_shape=(240, 320, 3)):
+        self.quality = quality
+        self.perf = perf
+        self.grid = GridCanvas(grid_shape)
+        self._src = (0, None)                 # (seq, {mode: RGB 影像})
+        self._cache = {}                      # (mode, q, scale) -> (seq, multipart chunk)
+        self._bits = {}                       # mode -> (seq, packbits, (h, w))
+        self._locks = {m: threading.Lock() for m in VIEW_MODES + (GRID,)}
+        self._cond = threading.Condition()
+        self.encoded = 0
+        self.served = 0
+        self.listeners = []                   # publish 後呼叫 listener(seq) (asyncio 伺服器用)
+
+    @property
+    def seq(self):
+        return self._src[0]
+
+    def publish(self, frames):
+        with self._cond:
+            self._src = (self._src[0] + 1, frames)
+            seq = self._src[0]
+            self._cond.notify_all()
+        for fn in self.listeners: fn(seq)
+
+    def wait(self, last_seq, timeout=0.5):
+        """等到有比 last_seq 更新的影格 (或逾時)"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._src[0] != last_seq, timeout)
+            return self._src[0]
+
+    def cached(self, m, q=None, scale=1.0):
+        """已經編好的最新一張 (seq, chunk)，還沒編就回傳 None；不編碼、不等鎖"""
+        cached = self._cache.get((m, q or self.quality, scale))
+        if cached and cached[0] == self._src[0]:
+            self.served += 1
+            return cached
+        return None
+
+    def frame(self, m, q=None, scale=1.0):
+        """回傳 (seq, multipart chunk)；尚無影格時 chunk 為 None"""
+        key = (m, q or self.quality, scale)
+        seq, frames = self._src
+        if frames is None: return seq, None
+        cached = self._cache.get(key)
+        if cached and cached[0] == seq:
+            self.served += 1
+            return cached
+        with self._locks[m]:
+            cached = self._cache.get(key)
+            if cached and cached[0] == seq:        # 等鎖期間別人已編好
+                self.served += 1
+                return cached
+            t0 = time.perf_counter()
+            if m == GRID:
+                img = self.grid.compose(frames)     # 在 grid 的鎖內，畫布編碼完才會被下一張覆寫
+                if self.perf is not None: self.perf.add("grid", time.perf_counter() - t0)
+                t0 = time.perf_counter()
+            else:
+                img = frames.get(m)
+                if img is None: return seq, None   # 這個畫面下一張影格才會產生 (不拿 cv 代替，免得快取在錯的 key 下)
+            if scale != 1.0:
+                img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            if img.ndim == 3: img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)     # 遮罩直接編成灰階 JPEG
+            ok, jpeg = cv2.imencode(".jpg", img, [int(cv2.IMWRITE_JPEG_QUALITY), key[1]])
+            if self.perf is not None: self.perf.add("encode", time.perf_counter() - t0)
+            if not ok: return seq, None
+            chunk = b"--frame\r\nContent-Type: image/jpeg\r\n\r\n" + jpeg.tobytes() + b"\r\n"
+            if len(self._cache) > 32:               # 觀看者換過很多種設定：清掉舊影格的版本
+                self._cache = {k: v for k, v in self._cache.items() if v[0] == seq}
+            self._cache[key] = (seq, chunk)
+            self.encoded += 1
+            self.served += 1
+            return seq, chunk
+
+    def packed(self, m):
+        """
+        二值遮罩的 np.packbits (1 bit/px，逐列接續)，每張影格每種遮罩只打包一次；
+        回傳 (seq, packed, (h, w))，沒有這個遮罩時 packed 為 None
+        """
+        seq, frames = self._src
+        cached = self._bits.get(m)
+        if cached and cached[0] == seq: return cached
+        img = frames.get(m) if frames is not None else None
+        if img is None or img.ndim != 2: return seq, None, None
+        t0 = time.perf_counter()
+        packed = np.packbits(img)             # 非 0 即 1
+        if self.perf is not None: self.perf.add("pack", time.perf_counter() - t0)
+        self._bits[m] = res = (seq, packed, img.shape)
+        return res
+
+    def stats(self):
+        return {"encoded": self.encoded, "served": self.served}
@@ -0,0 +1,128 @@
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+@  文件名：telemetry.py
+@  即時遙測推播 (/api/stream, Server-Sent Events)：
+@  控制迴圈只換掉一個 dict (不拿 param_lock)，每個連線依自己的頻率送「有變的欄位」，
+@  參數設定只在 params_version 改變時整包送一次
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+
+import json
+import threading
+import time
+
+HZ_MIN, HZ_MAX = 1.0, 30.0
+PERF_PERIOD = 1.0           # 延遲統計變化慢，每秒最多送一次
+HEARTBEAT = 5.0             # 沒有變化時的保活註解，讓斷線的連線早點被發現
+# PARAMS 裡舊有的遙測欄位：由 TelemetryHub 提供，整包設定不送
+LIVE_FIELDS = ("cte", "fps", "mask_used", "steering", "mask_px", "mask_w_px", "mask_y_px")
+
+
+class TelemetryHub:
+    """單一寫入者 (控制迴圈)：publish() 建新 dict 後整個替換，讀取端拿到的永遠是完整的一份"""
+
+    def __init__(self):
+        self.live = {}
+        self.seq = 0
+
+    def publish(self, **fields):
+        live = dict(self.live)
+        live.update(fields)
+        self.live = live
+        self.seq += 1
+
+    def snapshot(self):
+        return self.live
+
+
+class PerfSummary:
+    """
+    各階段 p95 (ms) 的摘要，最多每 period 秒算一次，所有 SSE 連線共用；
+    --procs 時 snapshot() 是跨行程的 Pipe 呼叫，視覺行程沒回應就沿用上一份
+    """
+
+    def __init__(self, stages, period=PERF_PERIOD):
+        self.stages = stages
+        self.period = period
+        self.lock = threading.Lock()
+        self.t = None
+        self.value = {}
+
+    def get(self):
+        with self.lock:
+            now = time.monotonic()
+            if self.t is None or now - self.t >= self.period:
+                self.t = now
+                try:
+                    self.value = {k: round(s["p95"], 2) for k, s in self.stages.snapshot().items()}
+                except (RuntimeError, TimeoutError):
+                    pass
+            return self.value
+
+
+def sse(data, event=None):
+    head = f"event: {event}\n" if event else ""
+    return f"{head}data: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+def clamp_hz(hz, default):
+    try: hz = float(hz)
+    except (TypeError, ValueError): return default
+    return max(HZ_MIN, min(HZ_MAX, hz))
+
+
+class EventStream:
+    """
+    SSE 的狀態與內容，不含等待：每隔 period 秒呼叫一次 poll()，回傳要送的文字 (沒有就 None)。
+    threaded 伺服器用 event_stream() 包成 generator，asyncio 伺服器在協程裡 await sleep
+    - event: config  完整參數 (連線時與 config_version() 改變時)
+    - (預設事件)      即時欄位的差異，只含與上次送出不同的 key
+    read_config() 讀不可變的設定快照，只在版本變動時呼叫以免每次都送整包；perf 是共用的 PerfSummary
+    poll() 可能阻塞 (--procs 時 perf 摘要要經 Pipe 問視覺行程)，asyncio 伺服器要丟到執行緒池
+    """
+
+    def __init__(self, hub, config_version, read_config, extra=None, perf=None, hz=10.0):
+        self.hub = hub
+        self.config_version = config_version
+        self.read_config = read_config
+        self.extra = extra
+        self.perf = perf
+        self.period = 1.0 / hz
+        self.sent = {}
+        self.version = None
+        self.t_perf = self.t_beat = 0.0
+
+    def first(self):
+        return "retry: 2000\n\n"
+
+    def poll(self):
+        now = time.monotonic()
+        out = []
+        v = self.config_version()
+        if v != self.version:
+            self.version = v
+            out.append(sse(dict(self.read_config(), params_version=v), "config"))
+            self.t_beat = now
+
+        cur = dict(self.hub.snapshot())
+        if self.extra is not None: cur.update(self.extra())
+        if self.perf is not None and now - self.t_perf >= PERF_PERIOD:
+            cur["perf"] = self.perf.get()
+            self.t_perf = now
+        delta = {k: val for k, val in cur.items() if k not in self.sent or self.sent[k] != val}
+        if delta:
+            self.sent.update(delta)
+            out.append(sse(delta))
+            self.t_beat = now
+        elif now - self.t_beat >= HEARTBEAT:
+            out.append(": ping\n\n")
+            self.t_beat = now
+        return "".join(out) or None
+
+
+def event_stream(es):
+    """把 EventStream 包成產生 SSE 文字的 generator (threaded 伺服器用)"""
+    yield es.first()
+    while True:
+        now = time.monotonic()
+        text = es.poll()
+        if text: yield text
+        time.sleep(max(0.0, es.period - (time.monotonic() - now)))
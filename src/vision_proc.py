@@ -0,0 +1,266 @@
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+@  文件名：vision_proc.py
+@  --procs：相機 + 循線 + 馬達在獨立的視覺行程，網頁行程只透過 shared_memory 讀畫面與遙測，
+@  MJPEG 編碼、JSON、Flask 執行緒都不再跟控制迴圈搶同一個 GIL
+@
+@  共享記憶體配置 (SharedBlock)：
+@    header     各畫面的 seqlock 序號、總影格序號、網頁要看的畫面 (位元遮罩)、遙測序號與長度
+@    frames     VIEW_MODES 每種畫面一格 [h, w, 3] (遮罩只用前 view_rows 列的第 0 通道)
+@    telemetry  遙測 JSON (視覺行程最多每 TEL_PERIOD 秒寫一次)
+@  網頁 → 視覺行程的操作 (參數、模式、錄影、雲台、perf、結束) 走 Pipe，一次一個請求，
+@  每個請求帶序號，逾時後才到的舊回覆會被丟掉
+'''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''''
+
+import json
+import multiprocessing as mp
+import os
+import threading
+import time
+import traceback
+from multiprocessing import shared_memory
+import numpy as np
+
+from streaming import VIEW_MODES, MASK_VIEWS
+
+TEL_BYTES = 8192
+TEL_PERIOD = 0.02           # 遙測最多 50 Hz 寫進共享記憶體 (SSE 上限 30 Hz)
+PUMP_PERIOD = 0.005         # 網頁行程檢查新影格的間隔
+CLOSE_TIMEOUT = 12.0        # op_close 最久：馬達 1 秒 + 錄影 3 秒 + 執行紀錄 3+3 秒，再留一點餘裕
+
+HEADER_DTYPE = np.dtype([
+    ("frame_seq", "<u8"),                       # 每次 publish +1
+    ("view_seq", "<u8", (len(VIEW_MODES),)),    # seqlock：奇數表示寫入中
+    ("view_rows", "<u4", (len(VIEW_MODES),)),   # 遮罩畫面只有 ROI 高度
+    ("view_mask", "<u4"),                       # 網頁行程目前有人看的畫面
+    ("tel_seq", "<u8"),
+    ("tel_len", "<u4"),
+])
+
+
+class SharedBlock:
+    """name=None 時建立一塊新的共享記憶體，否則以名稱連上；欄位都是 numpy view"""
+
+    def __init__(self, frame_shape, name=None):
+        self.frame_shape = tuple(frame_shape)
+        frame_bytes = int(np.prod(frame_shape))
+        size = HEADER_DTYPE.itemsize + len(VIEW_MODES) * frame_bytes + TEL_BYTES
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size)
+        buf = self.shm.buf
+        self.header = np.ndarray((), HEADER_DTYPE, buffer=buf)
+        off = HEADER_DTYPE.itemsize
+        self.frames = np.ndarray((len(VIEW_MODES),) + self.frame_shape, np.uint8, buffer=buf, offset=off)
+        off += len(VIEW_MODES) * frame_bytes
+        self.tel = np.ndarray((TEL_BYTES,), np.uint8, buffer=buf, offset=off)
+        if self.owner: self.header[()] = 0
+
+    @property
+    def name(self): return self.shm.name
+
+    def close(self):
+        # numpy view 要先放掉，否則 SharedMemory.close() 會因為還有 export 而失敗
+        del self.header, self.frames, self.tel
+        self.shm.close()
+        if self.owner: self.shm.unlink()
+
+
+# ---------------- 視覺行程端 (取代 views / broadcaster / telemetry) ----------------
+
+class SharedViews:
+    """對應 ViewRegistry.active：讀網頁行程寫入的位元遮罩"""
+
+    def __init__(self, block):
+        self.block = block
+        self._mask = -1
+        self._active = frozenset()
+
+    @property
+    def active(self):
+        mask = int(self.block.header["view_mask"])
+        if mask != self._mask:
+            self._active = frozenset(m for i, m in enumerate(VIEW_MODES) if mask >> i & 1)
+            self._mask = mask
+        return self._active
+
+
+class SharedFramePublisher:
+    """對應 MjpegBroadcaster.publish()：畫面直接複製進共享記憶體，不在這個行程編碼"""
+
+    def __init__(self, block):
+        self.block = block
+
+    def publish(self, frames):
+        h = self.block.header
+        for i, m in enumerate(VIEW_MODES):
+            img = frames.get(m)
+            if img is None: continue
+            rows = img.shape[0]
+            dst = self.block.frames[i][:rows]
+            h["view_seq"][i] += 1
+            np.copyto(dst[..., 0] if img.ndim == 2 else dst, img)
+            h["view_rows"][i] = rows
+            h["view_seq"][i] += 1
+        h["frame_seq"] += 1
+
+
+class SharedTelemetry:
+    """對應 TelemetryHub：本地 dict 照常更新，節流後以 JSON 寫進共享記憶體；extra() 的欄位一起寫"""
+
+    def __init__(self, block, extra=None):
+        self.block = block
+        self.extra = extra
+        self.live = {}
+        self.seq = 0
+        self._t = 0.0
+
+    def publish(self, **fields):
+        self.live.update(fields)
+        self.seq += 1
+        now = time.monotonic()
+        if now - self._t < TEL_PERIOD: return
+        self._t = now
+        data = dict(self.live)
+        if self.extra is not None: data.update(self.extra())
+        raw = json.dumps(data, separators=(",", ":")).encode()
+        if len(raw) > TEL_BYTES: return
+        h = self.block.header
+        h["tel_seq"] += 1
+        self.block.tel[:len(raw)] = np.frombuffer(raw, np.uint8)
+        h["tel_len"] = len(raw)
+        h["tel_seq"] += 1
+
+    def snapshot(self):
+        return self.live
+
+
+def serve(conn, ops, running):
+    """視覺行程主執行緒：處理網頁行程送來的操作；父行程消失 (被 kill) 時自己結束"""
+    parent = os.getppid()
+    while running():
+        if not conn.poll(0.5):
+            if os.getppid() != parent: return
+            continue
+        try:
+            rid, name, args = conn.recv()
+        except EOFError:
+            return
+        try:
+            conn.send((rid, True, ops[name](*args)))
+        except Exception as e:
+            traceback.print_exc()
+            conn.send((rid, False, f"{type(e).__name__}: {e}"))
+        if name == "close": return
+
+
+# ---------------- 網頁行程端 ----------------
+
+class SharedTelemetryReader:
+    """對應 TelemetryHub.snapshot()；讀到寫一半的資料就沿用上一份"""
+
+    def __init__(self, block):
+        self.block = block
+        self._seq = -1
+        self._live = {}
+
+    def snapshot(self):
+        h = self.block.header
+        s1 = int(h["tel_seq"])
+        if s1 == self._seq or s1 & 1: return self._live
+        raw = self.block.tel[:int(h["tel_len"])].tobytes()
+        if int(h["tel_seq"]) != s1: return self._live
+        try:
+            self._live = json.loads(raw)
+            self._seq = s1
+        except ValueError:
+            pass
+        return self._live
+
+
+class FramePump(threading.Thread):
+    """把有人看的畫面從共享記憶體複製出來交給本地 MjpegBroadcaster (編碼在網頁行程)"""
+
+    def __init__(self, block, views, broadcaster):
+        super().__init__(daemon=True)
+        self.block = block
+        self.views = views
+        self.broadcaster = broadcaster
+        self.running = True
+        self.torn = 0
+
+    def run(self):
+        h = self.block.header
+        last = -1
+        while self.running:
+            active = self.views.active
+            h["view_mask"] = sum(1 << i for i, m in enumerate(VIEW_MODES) if m in active)
+            seq = int(h["frame_seq"])
+            if seq == last or not active:
+                time.sleep(PUMP_PERIOD); continue
+            last = seq
+            frames = {}
+            for i, m in enumerate(VIEW_MODES):
+                if m not in active: continue
+                s1 = int(h["view_seq"][i])
+                if s1 & 1 or s1 == 0: continue
+                img = self.block.frames[i][:int(h["view_rows"][i])]
+                img = (img[..., 0] if m in MASK_VIEWS else img).copy()
+                if int(h["view_seq"][i]) != s1:
+                    self.torn += 1; continue           # 複製途中被覆寫：這張跳過
+                frames[m] = img
+            if frames: self.broadcaster.publish(frames)
+
+
+class RemotePerf:
+    """對應 PerfStats.snapshot()：控制迴圈各階段在視覺行程，JPEG 編碼、四格合成與遮罩打包 (local) 在網頁行程"""
+
+    def __init__(self, client, local, local_stages=("encode", "grid", "pack", "deflate")):
+        self.client = client
+        self.local = local
+        self.local_stages = local_stages
+
+    def local_part(self):
+        mine = self.local.snapshot()
+        return {k: mine[k] for k in self.local_stages if k in mine}
+
+    def snapshot(self):
+        data = self.client.call("perf_stages")
+        data.update(self.local_part())
+        return data
+
+
+class VisionClient:
+    """
+    fork 出視覺行程並提供 call(name, *args)：在視覺行程執行 ops[name] 並回傳結果
+    (fork 要在任何執行緒啟動前，子行程繼承已套用的參數與模式)
+    """
+
+    def __init__(self, target, frame_shape):
+        self.block = SharedBlock(frame_shape)
+        self.conn, child = mp.Pipe()
+        self.lock = threading.Lock()
+        self.rid = 0
+        # fork 直接繼承共享記憶體的對應，子行程不用再以名稱連上 (避免 resource_tracker 重複登記)
+        self.proc = mp.get_context("fork").Process(target=target, args=(self.block, child), daemon=True)
+        self.proc.start()
+
+    def call(self, name, *args, timeout=5.0):
+        with self.lock:
+            if not self.proc.is_alive(): raise RuntimeError("vision process is not running")
+            self.rid += 1
+            self.conn.send((self.rid, name, args))
+            t_end = time.monotonic() + timeout
+            while True:
+                if not self.conn.poll(max(0.0, t_end - time.monotonic())):
+                    raise TimeoutError(f"vision process did not answer {name}")
+                rid, ok, res = self.conn.recv()
+                if rid == self.rid: break           # 之前逾時的請求晚到的回覆：丟掉
+        if not ok: raise RuntimeError(res)
+        return res
+
+    def close(self, timeout=3.0):
+        if self.proc.is_alive():
+            try: self.call("close", timeout=CLOSE_TIMEOUT)
+            except (RuntimeError, TimeoutError, OSError): pass
+        self.proc.join(timeout)
+        if self.proc.is_alive(): self.proc.terminate()
+        self.block.close()